@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline de analítica del bot ETS
+Flujo de eventos append-only en bloques columnares binarios, agregación
+continua en memoria acotada y herramienta offline de resumen
+
+Formato de archivo: secuencia de bloques
+    b'ETSA' | u32 n | ts[n] u32 | user[n] u64 | kind[n] u8 | label[n] u16 | value[n] i16
+Las etiquetas (rutas, intents, niveles) se guardan en `<archivo>.labels`,
+una por línea; el número de línea es el id usado en la columna `label`.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter, deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Tipos de evento
+RATING = 1
+RISK = 2
+INTENT = 3
+CALLBACK = 4
+
+KIND_NAMES = {RATING: 'rating', RISK: 'risk', INTENT: 'intent', CALLBACK: 'callback'}
+
+RISK_SCORES = {'low': 1, 'medium': 2, 'high': 3}
+
+BLOCK_MAGIC = b'ETSA'
+BLOCK_HEADER = struct.Struct('<4sI')
+
+# (typecode, bytes por elemento) de cada columna, en orden de escritura
+COLUMNS = (('I', 4), ('Q', 8), ('B', 1), ('H', 2), ('h', 2))
+RECORD_SIZE = sum(size for _, size in COLUMNS)
+
+_SWAP = sys.byteorder != 'little'
+
+
+def _new_columns() -> List[array]:
+    return [array(code) for code, _ in COLUMNS]
+
+
+class RollingAggregator:
+    """Conteos y promedios por (tipo, etiqueta) sobre una ventana deslizante
+
+    La ventana se divide en `window // resolution` cubetas; al avanzar el
+    tiempo se descartan las más viejas, así la memoria no crece con el tráfico.
+    """
+
+    def __init__(self, window: int = 3600, resolution: int = 60):
+        self.resolution = resolution
+        self.size = max(1, window // resolution)
+        self.buckets: deque = deque()  # (índice de cubeta, {clave: [conteo, suma]})
+
+    def add(self, ts: int, kind: int, label: str, value: int):
+        index = ts // self.resolution
+        if not self.buckets or self.buckets[-1][0] < index:
+            self.buckets.append((index, {}))
+            self._expire(index)
+            bucket = self.buckets[-1][1]
+        else:
+            bucket = self._bucket_for(index)
+            if bucket is None:
+                return  # Evento fuera de la ventana
+        entry = bucket.get((kind, label))
+        if entry is None:
+            bucket[(kind, label)] = [1, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+
+    def _bucket_for(self, index: int) -> Optional[Dict]:
+        for bucket_index, bucket in reversed(self.buckets):
+            if bucket_index == index:
+                return bucket
+            if bucket_index < index:
+                break
+        return None
+
+    def _expire(self, newest: int):
+        while self.buckets and self.buckets[0][0] <= newest - self.size:
+            self.buckets.popleft()
+
+    def snapshot(self, now: Optional[int] = None) -> Dict[Tuple[str, str], Dict]:
+        """Devuelve {(tipo, etiqueta): {'count', 'avg'}} de la ventana actual"""
+        if now is not None:
+            self._expire(now // self.resolution)
+        totals: Dict[Tuple[int, str], List[int]] = {}
+        for _, bucket in self.buckets:
+            for key, (count, total) in bucket.items():
+                entry = totals.setdefault(key, [0, 0])
+                entry[0] += count
+                entry[1] += total
+        return {
+            (KIND_NAMES.get(kind, str(kind)), label): {'count': count, 'avg': total / count}
+            for (kind, label), (count, total) in totals.items()
+        }
+
+
+class AnalyticsLog:
+    """Escritor append-only con buffer y volcado por lotes"""
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = 1024,
+                 aggregator: Optional[RollingAggregator] = None):
+        self.path = path
+        self.batch_size = batch_size
+        self.aggregator = aggregator or RollingAggregator()
+        self.columns = _new_columns()
+        self.labels: Dict[str, int] = {}
+        self._new_labels: List[str] = []
+        if path and os.path.exists(path + '.labels'):
+            with open(path + '.labels', encoding='utf-8') as f:
+                for line in f:
+                    self.labels[line.rstrip('\n')] = len(self.labels)
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def _label_id(self, label: str) -> int:
+        label_id = self.labels.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self.labels[label] = label_id
+            self._new_labels.append(label)
+        return label_id
+
+    def record(self, kind: int, user_id: int, label: str, value: int = 0, ts: Optional[int] = None):
+        if ts is None:
+            ts = int(time.time())
+        ts_col, user_col, kind_col, label_col, value_col = self.columns
+        ts_col.append(ts)
+        user_col.append(user_id)
+        kind_col.append(kind)
+        label_col.append(self._label_id(label))
+        value_col.append(value)
+        self.aggregator.add(ts, kind, label, value)
+        if len(ts_col) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Escribe el lote pendiente como un bloque columnar"""
+        count = len(self)
+        if not count:
+            return
+        if self.path:
+            if self._new_labels:
+                with open(self.path + '.labels', 'a', encoding='utf-8') as f:
+                    f.write(''.join(label + '\n' for label in self._new_labels))
+            with open(self.path, 'ab') as f:
+                f.write(BLOCK_HEADER.pack(BLOCK_MAGIC, count))
+                for column in self.columns:
+                    if _SWAP:
+                        column.byteswap()
+                    f.write(column.tobytes())
+        self._new_labels = []
+        self.columns = _new_columns()
+
+
+# ----------------- LECTURA Y RESUMEN OFFLINE -----------------
+def iter_blocks(path: str) -> Iterator[List[array]]:
+    """Lee el archivo bloque a bloque; la memoria depende del tamaño del lote"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            magic, count = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC:
+                raise ValueError(f"Bloque corrupto en {path} (offset {f.tell() - BLOCK_HEADER.size})")
+            columns = []
+            for code, size in COLUMNS:
+                column = array(code)
+                column.frombytes(f.read(count * size))
+                if _SWAP:
+                    column.byteswap()
+                columns.append(column)
+            yield columns
+
+
+def load_labels(path: str) -> List[str]:
+    if not os.path.exists(path + '.labels'):
+        return []
+    with open(path + '.labels', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def summarize(path: str) -> Dict:
+    """Resume un archivo de eventos: conteos, promedios, usuarios y rango temporal"""
+    labels = load_labels(path)
+    # Los valores tienen pocos niveles (ratings, riesgo), así que contar tripletas
+    # (tipo, etiqueta, valor) en C basta para obtener sumas y promedios
+    triples: Counter = Counter()
+    users = set()
+    total = 0
+    first_ts = last_ts = None
+    for ts_col, user_col, kind_col, label_col, value_col in iter_blocks(path):
+        total += len(ts_col)
+        triples.update(zip(kind_col, label_col, value_col))
+        users.update(user_col)
+        block_min, block_max = min(ts_col), max(ts_col)
+        first_ts = block_min if first_ts is None else min(first_ts, block_min)
+        last_ts = block_max if last_ts is None else max(last_ts, block_max)
+
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for (kind, label_id, value), count in triples.items():
+        label = labels[label_id] if label_id < len(labels) else str(label_id)
+        entry = groups.setdefault((KIND_NAMES.get(kind, str(kind)), label), [0, 0])
+        entry[0] += count
+        entry[1] += value * count
+
+    return {
+        'events': total,
+        'unique_users': len(users),
+        'first_ts': first_ts,
+        'last_ts': last_ts,
+        'groups': {
+            key: {'count': count, 'avg': total_value / count}
+            for key, (count, total_value) in sorted(groups.items())
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumen offline de eventos de analítica")
+    parser.add_argument("path", help="Archivo de eventos (ANALYTICS_PATH)")
+    args = parser.parse_args(argv)
+
+    summary = summarize(args.path)
+    print(f"Eventos: {summary['events']}  Usuarios únicos: {summary['unique_users']}")
+    if summary['events']:
+        print(f"Rango: {time.strftime('%Y-%m-%d %H:%M', time.gmtime(summary['first_ts']))} - "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(summary['last_ts']))} UTC")
+    for (kind, label), stats in summary['groups'].items():
+        print(f"{kind:<9} {label:<30} {stats['count']:>10}  prom={stats['avg']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de citas
+Genera los turnos de cada centro a partir de sus `horarios`, guarda los
+turnos libres en arrays ordenados (bisect) y mantiene un índice por servicio
+y ciudad ordenado por el primer turno libre de cada centro, de modo que "el
+próximo turno de pruebas cerca de mí" es una búsqueda binaria. Reservar y
+cancelar son atómicos bajo un lock.
+"""
+
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from opening_hours import MINUTES_PER_WEEK, clinic_key, parse_horarios
+
+SLOT_MINUTES = 30
+HORIZON_DAYS = 28
+
+# Turno: minutos desde la época Unix (hora local del servidor)
+Slot = int
+# Clave del índice: (categoría de servicio, ciudad o None para cualquiera)
+IndexKey = Tuple[str, Optional[str]]
+
+# Entradas del índice: turno y número de centro empaquetados en un entero, que se compara
+# mucho más rápido que una tupla (turno, id); el índice es una lista (bisect va por la vía rápida)
+_CLINIC_BITS = 20
+_CLINIC_MASK = (1 << _CLINIC_BITS) - 1
+
+
+def service_category(service: str) -> str:
+    """'Pruebas VIH' → 'pruebas', 'Consulta gratuita' → 'consulta'"""
+    word = service.split()[0].lower()
+    return ''.join(char for char in unicodedata.normalize('NFKD', word) if not unicodedata.combining(char))
+
+
+def slot_at(moment: datetime) -> Slot:
+    return int(moment.timestamp() // 60)
+
+
+def slot_datetime(slot: Slot) -> datetime:
+    return datetime.fromtimestamp(slot * 60)
+
+
+class Clinic:
+    """Turnos de un centro: libres en un array ordenado y ocupación de los reservados"""
+    __slots__ = ('clinic_id', 'number', 'city', 'center', 'capacity', 'categories', 'weekly', 'free', 'booked',
+                 'indexed', 'generated_until')
+
+    def __init__(self, clinic_id: str, number: int, city: str, center: Dict, capacity: int):
+        self.clinic_id = clinic_id
+        self.number = number
+        self.city = city
+        self.center = center
+        self.capacity = capacity
+        self.categories: FrozenSet[str] = frozenset(service_category(service) for service in center['servicios'])
+        self.weekly = parse_horarios(center['horarios'])
+        self.free = array('q')
+        self.booked: Dict[Slot, int] = {}
+        # Primer turno libre tal como figura en el índice (None si no figura)
+        self.indexed: Optional[Slot] = None
+        self.generated_until: Slot = 0
+
+    def index_keys(self) -> List[IndexKey]:
+        return [key for category in self.categories for key in ((category, self.city), (category, None))]
+
+
+class SlotEngine:
+    """Turnos de todos los centros con reserva atómica y búsqueda del próximo libre"""
+
+    def __init__(self, slot_minutes: int = SLOT_MINUTES, horizon_days: int = HORIZON_DAYS, clock=time.time):
+        self.slot_minutes = slot_minutes
+        self.horizon = horizon_days * 24 * 60
+        self.clock = clock
+        self.clinics: Dict[str, Clinic] = {}
+        self._by_number: List[Clinic] = []
+        self._index: Dict[IndexKey, List[int]] = {}
+        # Momento del último advance: desde ahí el índice no tiene turnos pasados
+        self.advanced_to: Slot = self.now()
+        # Un solo lock: las operaciones son de microsegundos y así el índice nunca queda a medias
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_medical_centers(cls, medical_centers: Dict, **kwargs) -> 'SlotEngine':
+        engine = cls(**kwargs)
+        for city, city_data in medical_centers.items():
+            for position, center in enumerate(city_data['centros']):
+                engine.add_clinic(clinic_key(city, position), city, center)
+        return engine
+
+    def now(self) -> Slot:
+        return int(self.clock() // 60)
+
+    # ----------------- CALENDARIO -----------------
+    def _generate(self, clinic: Clinic, start: Slot, end: Slot) -> List[Slot]:
+        """Turnos que caben completos en el horario semanal entre start y end"""
+        # Lunes 00:00 local de la semana de `start`
+        moment = slot_datetime(start)
+        monday = slot_at(datetime(moment.year, moment.month, moment.day) - timedelta(days=moment.weekday()))
+        step = self.slot_minutes
+        slots = []
+        for week in range(monday, end, MINUTES_PER_WEEK):
+            for open_at, close_at in clinic.weekly:
+                first = week + open_at
+                for slot in range(first, week + close_at - step + 1, step):
+                    if start <= slot < end:
+                        slots.append(slot)
+        return slots
+
+    def add_clinic(self, clinic_id: str, city: str, center: Dict):
+        """Da de alta un centro; `consultorios` es el número de citas simultáneas por turno"""
+        now = self.advanced_to
+        with self._lock:
+            if len(self._by_number) > _CLINIC_MASK:
+                raise ValueError(f"Más de {_CLINIC_MASK + 1} centros")
+            clinic = Clinic(clinic_id, len(self._by_number), city, center, center.get('consultorios', 1))
+            clinic.free.extend(self._generate(clinic, now, now + self.horizon))
+            clinic.generated_until = now + self.horizon
+            self.clinics[clinic_id] = clinic
+            self._by_number.append(clinic)
+            self._reindex(clinic)
+
+    def advance(self, now: Optional[Slot] = None) -> int:
+        """Descarta los turnos pasados y extiende el calendario hasta el horizonte; devuelve turnos nuevos"""
+        now = self.now() if now is None else now
+        added = 0
+        with self._lock:
+            self.advanced_to = now
+            for clinic in self.clinics.values():
+                del clinic.free[:bisect_left(clinic.free, now)]
+                for slot in [slot for slot in clinic.booked if slot < now]:
+                    del clinic.booked[slot]
+                # El calendario se extiende por días completos
+                if clinic.generated_until <= now + self.horizon - 24 * 60:
+                    new = self._generate(clinic, max(now, clinic.generated_until), now + self.horizon)
+                    clinic.free.extend(new)
+                    clinic.generated_until = now + self.horizon
+                    added += len(new)
+                self._reindex(clinic)
+        return added
+
+    # ----------------- ÍNDICE -----------------
+    def _reindex(self, clinic: Clinic):
+        first = clinic.free[0] if clinic.free else None
+        if first == clinic.indexed:
+            return
+        for key in clinic.index_keys():
+            entries = self._index.setdefault(key, [])
+            if clinic.indexed is not None:
+                del entries[bisect_left(entries, clinic.indexed << _CLINIC_BITS | clinic.number)]
+            if first is not None:
+                insort(entries, first << _CLINIC_BITS | clinic.number)
+        clinic.indexed = first
+
+    def _earliest(self, category: str, city: Optional[str], limit: int, after: Slot) -> List[Tuple[Slot, str]]:
+        entries = self._index.get((category, city), ())
+        position = bisect_left(entries, after << _CLINIC_BITS)
+        results = [(entry >> _CLINIC_BITS, self._by_number[entry & _CLINIC_MASK].clinic_id)
+                   for entry in entries[position:position + limit]]
+        # Centros cuyo primer libre es anterior a `after` (pedido a futuro o sin advance reciente)
+        for entry in entries[:position]:
+            clinic = self._by_number[entry & _CLINIC_MASK]
+            index = bisect_left(clinic.free, after)
+            if index < len(clinic.free):
+                results.append((clinic.free[index], clinic.clinic_id))
+        return sorted(results)[:limit]
+
+    def earliest_per_clinic(self, category: str, city: Optional[str] = None, limit: int = 3,
+                            after: Optional[Slot] = None) -> List[Tuple[Slot, str]]:
+        """Primer turno libre de hasta `limit` centros distintos, del más próximo al más lejano"""
+        after = self.advanced_to if after is None else after
+        with self._lock:
+            return self._earliest(category, city, limit, after)
+
+    def next_free(self, category: str, city: Optional[str] = None,
+                  after: Optional[Slot] = None) -> Optional[Tuple[Slot, str]]:
+        """Próximo (turno, centro) libre para la categoría, en la ciudad o en cualquiera"""
+        found = self.earliest_per_clinic(category, city, limit=1, after=after)
+        return found[0] if found else None
+
+    def free_slots(self, clinic_id: str, after: Optional[Slot] = None, limit: int = 5) -> List[Slot]:
+        after = self.advanced_to if after is None else after
+        with self._lock:
+            free = self.clinics[clinic_id].free
+            start = bisect_left(free, after)
+            return list(free[start:start + limit])
+
+    # ----------------- RESERVAS -----------------
+    def _reserve(self, clinic: Clinic, slot: Slot) -> bool:
+        free = clinic.free
+        index = bisect_left(free, slot)
+        if index == len(free) or free[index] != slot:
+            return False
+        booked = clinic.booked.get(slot, 0) + 1
+        clinic.booked[slot] = booked
+        if booked >= clinic.capacity:
+            del free[index]
+            if index == 0:
+                self._reindex(clinic)
+        return True
+
+    def reserve(self, clinic_id: str, slot: Slot) -> bool:
+        """Ocupa una plaza del turno si sigue libre; False si otro la tomó antes"""
+        with self._lock:
+            clinic = self.clinics.get(clinic_id)
+            return clinic is not None and self._reserve(clinic, slot)
+
+    def reserve_next(self, category: str, city: Optional[str] = None,
+                     after: Optional[Slot] = None) -> Optional[Tuple[Slot, str]]:
+        """Busca y ocupa el próximo turno libre en una sola operación, sin carreras entre usuarios"""
+        after = self.advanced_to if after is None else after
+        with self._lock:
+            found = self._earliest(category, city, 1, after)
+            if not found:
+                return None
+            slot, clinic_id = found[0]
+            self._reserve(self.clinics[clinic_id], slot)
+            return found[0]
+
+    def cancel(self, clinic_id: str, slot: Slot) -> bool:
+        """Libera una plaza reservada; False si no había reserva en ese turno"""
+        with self._lock:
+            clinic = self.clinics.get(clinic_id)
+            booked = clinic.booked.get(slot, 0) if clinic else 0
+            if not booked:
+                return False
+            if booked == 1:
+                del clinic.booked[slot]
+            else:
+                clinic.booked[slot] = booked - 1
+            if booked == clinic.capacity:
+                insort(clinic.free, slot)
+                self._reindex(clinic)
+            return True
+
+    def restore(self, reservations: Iterable[Tuple[str, Slot]]) -> int:
+        """Vuelve a ocupar reservas guardadas en los perfiles; devuelve las aplicadas"""
+        return sum(self.reserve(clinic_id, slot) for clinic_id, slot in reservations)
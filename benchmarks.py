@@ -0,0 +1,1601 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Arnés de benchmarks del bot ETS
+Uso: python benchmarks.py [nombre ...]  (sin argumentos ejecuta todos)
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+BENCHMARKS: Dict[str, Callable[[], Dict]] = {}
+
+
+def benchmark(name: str):
+    """Registra una función de benchmark que devuelve un dict de métricas"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def time_per_op(func: Callable[[], None], iterations: int) -> float:
+    """Devuelve el costo medio por llamada en nanosegundos"""
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def measure_memory(build: Callable[[], object]):
+    """Construye un objeto y devuelve (objeto, bytes asignados)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+# ----------------- RATE LIMIT -----------------
+@benchmark("rate_limiter")
+def bench_rate_limiter(active_users: int = 100_000, checks: int = 500_000) -> Dict:
+    from rate_limiter import DELAY, SlidingWindowRateLimiter
+
+    def build():
+        limiter = SlidingWindowRateLimiter(max_events=8, window=10.0, idle_ttl=600.0)
+        for user_id in range(active_users):
+            limiter.check(user_id, now=0.0)
+        return limiter
+
+    limiter, memory = measure_memory(build)
+
+    rng = random.Random(26)
+    user_ids = [rng.randrange(active_users) for _ in range(checks)]
+    clock = iter(i * 1e-5 for i in range(checks))
+    ids = iter(user_ids)
+    ns_per_check = time_per_op(lambda: limiter.check(next(ids), now=next(clock)), checks)
+
+    # Referencia: el costo de una búsqueda en dict para dimensionar la sobrecarga
+    plain = dict.fromkeys(range(active_users), 0)
+    ids = iter(user_ids)
+    ns_baseline = time_per_op(lambda: plain.get(next(ids)), checks)
+
+    # Ráfaga de 500 mensajes en 5 s con política 'delay': los diferidos salen espaciados y acotados
+    delayed = SlidingWindowRateLimiter(max_events=8, window=10.0, policy=DELAY, max_delay=30.0)
+    releases = []
+    for i in range(500):
+        now = i * 0.01
+        action, wait = delayed.check(1, now=now)
+        if action == DELAY:
+            releases.append(now + wait)
+    gaps = [later - earlier for earlier, later in zip(releases, releases[1:])]
+    assert len(releases) == delayed.max_deferred, releases
+    assert all(abs(gap - delayed.release_interval) < 1e-9 for gap in gaps), gaps
+
+    return {
+        'active_users': active_users,
+        'bytes_per_user': round(memory / active_users, 1),
+        'ns_per_check': round(ns_per_check, 1),
+        'ns_dict_lookup_baseline': round(ns_baseline, 1),
+        'decisions': dict(limiter.stats),
+        'burst_deferred': len(releases),
+        'burst_release_span_s': round(releases[-1] - releases[0], 2),
+        'burst_decisions': dict(delayed.stats),
+    }
+
+
+# ----------------- ANALÍTICA -----------------
+@benchmark("analytics")
+def bench_analytics(events: int = 2_000_000) -> Dict:
+    import os
+    import tempfile
+    import analytics
+
+    rng = random.Random(27)
+    routes = ['menu', 'encyclopedia', 'ets_detail', 'city', 'rating', 'test_guide']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.bin')
+        log = analytics.AnalyticsLog(path, batch_size=4096)
+        start = time.perf_counter()
+        for i in range(events):
+            log.record(analytics.CALLBACK, rng.randrange(50_000), routes[i % len(routes)],
+                       rng.randint(1, 5), ts=1_700_000_000 + i // 100)
+        log.flush()
+        write_s = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        summary = analytics.summarize(path)
+        summarize_s = time.perf_counter() - start
+
+    return {
+        'events': events,
+        'bytes_per_event': round(size / events, 2),
+        'ns_per_record': round(write_s * 1e9 / events, 1),
+        'summarize_seconds': round(summarize_s, 3),
+        'summarize_events_per_s': int(events / summarize_s),
+        'aggregator_buckets': len(log.aggregator.buckets),
+        'unique_users': summary['unique_users'],
+    }
+
+
+# ----------------- MIGRACIÓN DE PERFILES -----------------
+@benchmark("user_migration")
+def bench_user_migration(users: int = 100_000) -> Dict:
+    import glob
+    import os
+    import tempfile
+    from datetime import datetime
+    import user_migration
+
+    def records():
+        started = datetime(2024, 1, 1)
+        for user_id in range(users):
+            yield {
+                'user_id': user_id,
+                'profile': {'age': 18 + user_id % 50, 'gender': 'Femenino', 'risk_level': 'low',
+                            'last_symptoms': ['ardor al orinar'], 'preferences': {}, 'language': 'es'},
+                'session': {'started_at': started, 'current_flow': 'main_menu', 'context': {},
+                            'interaction_count': user_id % 20},
+            }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        user_migration.export_records(records(), tmp, chunk_size=20_000)
+        export_s = time.perf_counter() - start
+        generation, export_dir = user_migration.latest_export(tmp)
+        size = sum(os.path.getsize(path) for path in user_migration.iter_chunk_paths(export_dir))
+
+        imported = 0
+
+        def sink(record):
+            nonlocal imported
+            imported += 1
+
+        start = time.perf_counter()
+        user_migration.import_records(tmp, sink)
+        import_s = time.perf_counter() - start
+
+        # Memoria pico de una segunda importación: debe ser independiente de `users`
+        tracemalloc.start()
+        user_migration.import_records(tmp, sink, checkpoint_path=os.path.join(tmp, 'peak.json'))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Un segundo apagado exporta todo de nuevo y la importación reanudable lo vuelve a leer
+        reexported = user_migration.export_records(records(), tmp, chunk_size=20_000)['records']
+        reimported = user_migration.import_records(tmp, sink)['records']
+        generations_on_disk = len(glob.glob(os.path.join(tmp, 'gen-*')))
+
+    return {
+        'users': users,
+        'export_records_per_s': int(users / export_s),
+        'import_records_per_s': int(imported / import_s),
+        'bytes_per_record_gz': round(size / users, 1),
+        'peak_traced_mb': round(peak / 2**20, 2),
+        'reexported_records': reexported,
+        'reimported_records': reimported,
+        'generations_on_disk': generations_on_disk,
+    }
+
+
+# ----------------- TAREAS PROGRAMADAS -----------------
+@benchmark("scheduler")
+def bench_scheduler(reminders: int = 1_000_000, sessions: int = 200_000) -> Dict:
+    import os
+    import tempfile
+    from datetime import datetime, timedelta
+    from scheduler import ReminderQueue
+    from ets_bot import UserSessionManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'reminders.journal')
+        queue = ReminderQueue(path)
+        rng = random.Random(29)
+        start = time.perf_counter()
+        for user_id in range(reminders):
+            queue.schedule(user_id, 'seguimiento', rng.uniform(0, 1000))
+        schedule_ns = (time.perf_counter() - start) * 1e9 / reminders
+        queue.close()
+
+        start = time.perf_counter()
+        queue = ReminderQueue(path)
+        reload_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = queue.pop_due(now=500, limit=25)
+        pop_us = (time.perf_counter() - start) * 1e6
+        popped = len(batch)
+        # La mitad de los envíos falla: se reprograma y sigue en el journal tras reabrir
+        for i, (due, user_id, kind) in enumerate(batch):
+            if i % 2:
+                queue.retry(user_id, kind, due, now=500)
+            else:
+                queue.complete(user_id, kind, due)
+        queue.close()
+        queue = ReminderQueue(path)
+        survived_failures = sum((user_id, kind) in queue.pending for i, (_, user_id, kind) in enumerate(batch) if i % 2)
+        queue.close()
+
+    # Reprogramar sin parar no debe hacer crecer el heap sin límite
+    churn = ReminderQueue()
+    for _ in range(50):
+        for user_id in range(1000):
+            churn.schedule(user_id, 'seguimiento', rng.uniform(0, 1000))
+    churn_heap_ratio = len(churn.heap) / len(churn)
+
+    manager = UserSessionManager()
+    for user_id in range(sessions):
+        manager.get_session(user_id)
+    old = datetime.now() - timedelta(days=2)
+    for session in manager.sessions.values():
+        session['last_activity'] = old
+    start = time.perf_counter()
+    removed = manager.sweep_expired(timedelta(hours=24), limit=500)
+    slice_us = (time.perf_counter() - start) * 1e6
+
+    return {
+        'pending_reminders': reminders,
+        'ns_per_schedule': round(schedule_ns, 1),
+        'reload_seconds': round(reload_s, 3),
+        'pop_25_due_us': round(pop_us, 1),
+        'popped': popped,
+        'failed_sends_kept': survived_failures,
+        'churn_heap_ratio': round(churn_heap_ratio, 2),
+        'sweep_slice_removed': removed,
+        'sweep_slice_us': round(slice_us, 1),
+    }
+
+
+@benchmark("reminder_job")
+def bench_reminder_job(reminders: int = 5_000, rate: float = 2_000.0, budget: float = 0.5,
+                       latency: float = 0.005) -> Dict:
+    """Un atraso de recordatorios se vacía al ritmo del bucket, no al del intervalo del job"""
+    import asyncio
+    import os
+    import tempfile
+    from types import SimpleNamespace
+    from broadcast import TokenBucket
+
+    os.environ.setdefault('REMINDERS_PATH', os.path.join(tempfile.mkdtemp(), 'reminders.journal'))
+    import ets_bot
+
+    bot = ets_bot.ETSBotAdvanced('123:abc')
+    bot.reminder_bucket = TokenBucket(rate)
+    ets_bot.REMINDER_JOB_BUDGET = budget
+    for user_id in range(reminders):
+        bot.reminders.schedule(user_id, 'seguimiento', 0.0)
+    sent = []
+    passes = 0
+
+    async def send_message(chat_id, **kwargs):
+        await asyncio.sleep(latency)
+        sent.append(chat_id)
+
+    async def run():
+        nonlocal passes
+        continuations = []
+        job_queue = SimpleNamespace(run_once=lambda callback, when, name: continuations.append(callback))
+        context = SimpleNamespace(bot=SimpleNamespace(send_message=send_message), job_queue=job_queue)
+        begin = time.perf_counter()
+        # La primera pasada la lanza el job periódico; las demás son continuaciones inmediatas
+        callback = bot.send_reminders_job
+        while callback is not None:
+            passes += 1
+            await callback(context)
+            callback = continuations.pop() if continuations else None
+        return time.perf_counter() - begin
+
+    elapsed = asyncio.run(run())
+    bot.reminders.close()
+    assert len(sent) == reminders and not bot.reminders.pending, (len(sent), len(bot.reminders.pending))
+    return {
+        'reminders': reminders,
+        'target_per_s': rate,
+        'achieved_per_s': round(reminders / elapsed, 1),
+        'job_passes': passes,
+        # Antes: 25 por ejecución del job cada 60 s
+        'old_cap_per_s': round(25 / 60, 2),
+    }
+
+
+# ----------------- CATÁLOGO MULTILINGÜE -----------------
+@benchmark("i18n")
+def bench_i18n(extra_languages: int = 30, iterations: int = 200_000) -> Dict:
+    import json
+    import os
+    import shutil
+    import tempfile
+    from i18n import LOCALES_DIR, MessageCatalog
+
+    messages = ["me duele al orinar", "tengo una llaga pequeña", "quiero hacerme una prueba",
+                "hola buenas tardes", "no sé qué hacer"]
+
+    def per_message_ns(catalog):
+        def handle(text):
+            intent = catalog.detect_intent('es', text)
+            catalog.text('es', f'intent.{intent}', personalized_advice='-', greeting='-')
+        batch = iter(messages * (iterations // len(messages)))
+        return time_per_op(lambda: handle(next(batch)), iterations // len(messages) * len(messages))
+
+    base = MessageCatalog.load(LOCALES_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in os.listdir(LOCALES_DIR):
+            shutil.copy(os.path.join(LOCALES_DIR, path), tmp)
+        with open(os.path.join(LOCALES_DIR, 'en.json'), encoding='utf-8') as f:
+            template = json.load(f)
+        for i in range(extra_languages):
+            template['language'] = f'x{i}'
+            template['markers'] = [f'marcador{i}']
+            with open(os.path.join(tmp, f'x{i}.json'), 'w', encoding='utf-8') as f:
+                json.dump(template, f, ensure_ascii=False)
+        many = MessageCatalog.load(tmp)
+
+    base_ns = per_message_ns(base)
+    many_ns = per_message_ns(many)
+    detect_ns = time_per_op(lambda: many.detect_language("hola tengo una duda sobre mi prueba"), iterations)
+    return {
+        'languages_base': len(base.languages),
+        'languages_extended': len(many.languages),
+        'ns_per_message_base': round(base_ns, 1),
+        'ns_per_message_extended': round(many_ns, 1),
+        'latency_ratio': round(many_ns / base_ns, 3),
+        'ns_detect_language_first_message': round(detect_ns, 1),
+    }
+
+
+def load_reference_database() -> Dict:
+    """Lee el literal ETS_DATABASE de ets_bot sin importar telegram ni construir la aplicación"""
+    import ast
+    import os
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ets_bot.py')
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id == 'ETS_DATABASE'):
+            return ast.literal_eval(node.value)
+    raise RuntimeError("ets_database no encontrado")
+
+
+def synthetic_knowledge_base(size: int) -> Dict:
+    """Clona las entradas reales de la enciclopedia con nombres nuevos hasta `size`"""
+    entries = list(load_reference_database().values())
+    database = {}
+    for i in range(size):
+        entry = dict(entries[i % len(entries)])
+        entry['nombre'] = f"{entry['nombre']} variante{i}"
+        database[f"ets{i}"] = entry
+    return database
+
+
+# ----------------- BÚSQUEDA EN LA ENCICLOPEDIA -----------------
+@benchmark("search")
+def bench_search(sizes=(5, 100, 1000), queries: int = 20_000) -> Dict:
+    from search import EncyclopediaIndex
+
+    questions = ["¿cuánto tarda la sífilis en dar síntomas?", "como se cura la gonorrea",
+                 "qué complicaciones tiene la clamidia", "vacuna vph", "herpes variante3 tratamiento"]
+    results = {}
+    for size in sizes:
+        database = synthetic_knowledge_base(size)
+        start = time.perf_counter()
+        index = EncyclopediaIndex.build(database)
+        build_ms = (time.perf_counter() - start) * 1000
+        batch = iter(questions * (queries // len(questions)))
+        query_us = time_per_op(lambda: index.search(next(batch)), queries // len(questions) * len(questions)) / 1000
+        results[f'kb_{size}'] = {'docs': len(index), 'build_ms': round(build_ms, 2),
+                                 'query_us': round(query_us, 1)}
+    return results
+
+
+# ----------------- INFERENCIA DE CONDICIONES -----------------
+@benchmark("symptom_index")
+def bench_symptom_index(sizes=(5, 100, 500), queries: int = 20_000) -> Dict:
+    from symptom_index import SymptomIndex
+
+    texts = ["me duele al orinar y tengo flujo amarillo", "tengo una llaga que no duele",
+             "ampollas y fiebre", "sangrado entre periodos y dolor pélvico"]
+    results = {}
+    for size in sizes:
+        database = synthetic_knowledge_base(size)
+        start = time.perf_counter()
+        index = SymptomIndex.build(database)
+        build_ms = (time.perf_counter() - start) * 1000
+        batch = iter(texts * (queries // len(texts)))
+        query_us = time_per_op(lambda: index.rank(next(batch), 'Femenino'), queries // len(texts) * len(texts)) / 1000
+        results[f'kb_{size}'] = {'terms': len(index.postings[None]), 'build_ms': round(build_ms, 2),
+                                 'rank_us': round(query_us, 1)}
+    return results
+
+
+# ----------------- PERSONALIZACIÓN -----------------
+@benchmark("personalization")
+def bench_personalization(lookups: int = 200_000) -> Dict:
+    import itertools
+    import personalization
+    from i18n import load_catalog
+
+    catalog = load_catalog()
+    tables = personalization.PersonalizationTables(catalog)
+
+    # Paridad exhaustiva: toda edad válida × géneros × riesgos × idiomas contra las reglas
+    ages = [None, 0] + list(range(13, 101))
+    genders = [None, '', 'Masculino', 'Femenino', 'No binario', 'mujer (femenino)', 'Otro']
+    risks = [None, 'unknown', 'low', 'medium', 'high']
+    mismatches = 0
+    profiles = 0
+    for age, gender, risk, language in itertools.product(ages, genders, risks, catalog.languages):
+        profile = {'age': age, 'gender': gender, 'risk_level': risk, 'language': language}
+        key = tables.key_for(profile)
+        expected = (
+            personalization.recommended_tests(catalog, profile),
+            personalization.personalized_recommendations(catalog, profile),
+            personalization.personalized_greeting(catalog, profile),
+            *(personalization.personalized_advice(catalog, category, profile)
+              for category in personalization.ADVICE_CATEGORIES + ('general',)),
+        )
+        actual = (
+            tables.tests[key], tables.recommendations[key], tables.greetings[key],
+            *(tables.advice_for(key, category) for category in personalization.ADVICE_CATEGORIES + ('general',)),
+        )
+        profiles += 1
+        mismatches += expected != actual
+
+    sample = {'age': 22, 'gender': 'Femenino', 'risk_level': 'high', 'language': 'es'}
+    sample['profile_key'] = personalization.profile_key(sample)
+    rule_ns = time_per_op(lambda: personalization.recommended_tests(catalog, sample), lookups)
+    table_ns = time_per_op(lambda: tables.tests[tables.key_for(sample)], lookups)
+    if mismatches:
+        raise AssertionError(f"{mismatches} perfiles difieren de las reglas")
+    return {
+        'keys': len(tables.tests),
+        'profiles_checked': profiles,
+        'mismatches': mismatches,
+        'ns_rule_evaluation': round(rule_ns, 1),
+        'ns_table_lookup': round(table_ns, 1),
+    }
+
+
+# ----------------- EDICIÓN INCREMENTAL -----------------
+@benchmark("message_cache")
+def bench_message_cache(clicks: int = 100_000, chats: int = 5_000) -> Dict:
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from message_cache import MessageStateCache, render_hashes, UNCHANGED, MARKUP_ONLY
+
+    screens = []
+    for i in range(6):
+        keyboard = [[InlineKeyboardButton(f"Opción {i}.{j}", callback_data=f"screen_{i}_{j}")] for j in range(8)]
+        screens.append((f"**Pantalla {i}**\n" + "texto " * 60, InlineKeyboardMarkup(keyboard)))
+
+    cache = MessageStateCache()
+    rng = random.Random(34)
+    outcomes = {'api_calls': 0, 'skipped': 0, 'markup_only': 0}
+
+    def click():
+        chat_id = rng.randrange(chats)
+        text, markup = screens[rng.randrange(len(screens))]
+        hashes = render_hashes(text, 'Markdown', markup)
+        state = cache.compare(chat_id, 1, *hashes)
+        if state == UNCHANGED:
+            outcomes['skipped'] += 1
+            return
+        if state == MARKUP_ONLY:
+            outcomes['markup_only'] += 1
+        outcomes['api_calls'] += 1
+        cache.remember(chat_id, 1, *hashes)
+
+    ns_per_click = time_per_op(click, clicks)
+    return {
+        'clicks': clicks,
+        'ns_per_decision': round(ns_per_click, 1),
+        'saved_api_calls_pct': round(100 * outcomes['skipped'] / clicks, 1),
+        **outcomes,
+    }
+
+
+@benchmark("logging")
+def bench_logging(calls: int = 50_000) -> Dict:
+    import io
+    import logging
+    import logging_setup
+
+    class SlowStream(io.StringIO):
+        """Simula un stdout bloqueado (tubería llena, disco lento)"""
+
+        def write(self, s):
+            time.sleep(0.00002)
+            return super().write(s)
+
+    results = {'calls': calls}
+    log = logging.getLogger('bench.logging')
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    logging_setup.set_update_context(12345, 678, "me arde al orinar")
+    try:
+        # Referencia: handler síncrono sobre el mismo stream lento
+        direct = logging.StreamHandler(SlowStream())
+        direct.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        root.handlers[:] = [direct]
+        root.setLevel(logging.INFO)
+        results['sync_ns_per_call'] = round(time_per_op(lambda: log.info("respuesta %s", 42), calls // 10), 1)
+
+        listener = logging_setup.configure_logging('INFO', 'json', {'bench.sampled': 0.1}, stream=SlowStream())
+        sampled = logging.getLogger('bench.sampled')
+        results['queued_ns_per_call'] = round(time_per_op(lambda: log.info("respuesta %s", 42), calls), 1)
+        results['redacted_ns_per_call'] = round(
+            time_per_op(lambda: log.info("texto recibido: %s", "me arde al orinar"), calls), 1)
+        results['sampled_ns_per_call'] = round(time_per_op(lambda: sampled.info("respuesta %s", 42), calls), 1)
+        results['disabled_debug_ns_per_call'] = round(time_per_op(lambda: log.debug("respuesta %s", 42), calls), 1)
+        start = time.perf_counter()
+        listener.stop()
+        results['drain_s'] = round(time.perf_counter() - start, 2)
+    finally:
+        logging_setup.set_update_context(None, None)
+        root.handlers[:], level = saved
+        root.setLevel(level)
+    return results
+
+
+def synthetic_update_batch(updates: int):
+    from fake_bot_api import make_message_update, make_callback_update
+
+    script = [
+        lambda i, user: make_message_update(i, user, '/start'),
+        lambda i, user: make_message_update(i, user, 'me arde al orinar y tengo flujo'),
+        lambda i, user: make_callback_update(i, user, 'encyclopedia'),
+        lambda i, user: make_callback_update(i, user, 'emergency'),
+        lambda i, user: make_message_update(i, user, '/ayuda'),
+        lambda i, user: make_message_update(i, user, '¿cuánto tarda en aparecer la sífilis?'),
+    ]
+    # Un usuario distinto por update: sin límite de ritmo y con correlación exacta
+    return [script[i % len(script)](i + 1, 50_000 + i) for i in range(updates)]
+
+
+def run_against_fake_api(batch, rate: float, mode: str = 'webhook', concurrent_updates: int = 0,
+                         faults=None, profile_fraction: Optional[float] = None,
+                         shadow: Optional[Dict] = None, prepare: Optional[Callable] = None) -> Dict:
+    """Arranca el bot real contra fake_bot_api, empuja `batch` y espera todas las respuestas
+
+    Con `profile_fraction` se perfila esa fracción de updates durante toda la carga; con
+    `shadow` (argumentos de ShadowRunner) se evalúan candidatos en sombra. `prepare(bot)`
+    se llama antes de arrancar, para sembrar estado o sustituir componentes.
+    """
+    import asyncio
+    import logging
+    import os
+    import socket
+    import tempfile
+
+    os.environ.setdefault('REMINDERS_PATH', os.path.join(tempfile.mkdtemp(), 'reminders.journal'))
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    import ets_bot
+    import shadow as shadow_module
+    from fake_bot_api import FakeBotAPI, FaultPlan
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        webhook_port = probe.getsockname()[1]
+
+    async def run() -> Dict:
+        api = FakeBotAPI(faults or FaultPlan(latency=0.002, jitter=0.003, seed=36))
+        await api.start()
+        bot = ets_bot.ETSBotAdvanced('123:abc', base_url=api.base_url, concurrent_updates=concurrent_updates)
+        if shadow is not None:
+            bot.shadow_runner = shadow_module.ShadowRunner(**shadow)
+        if prepare is not None:
+            prepare(bot)
+        app = bot.application
+        await app.initialize()
+        await bot.render_pool.start()
+        await bot.shadow_runner.start()
+        await app.start()
+        if mode == 'polling':
+            await app.updater.start_polling(timeout=10, allowed_updates=ets_bot.POLLED_UPDATE_TYPES)
+        else:
+            await app.updater.start_webhook(listen='127.0.0.1', port=webhook_port, url_path='123:abc',
+                                            webhook_url=f"http://127.0.0.1:{webhook_port}/123:abc")
+        profile = {}
+        try:
+            if profile_fraction is not None:
+                bot.profile_dir = tempfile.mkdtemp()
+                bot.start_profiling(3600, profile_fraction)
+            start = time.perf_counter()
+            await api.push_updates(batch, rate)
+            drained = await api.wait_idle(timeout=120)
+            elapsed = time.perf_counter() - start
+            if profile_fraction is not None:
+                await bot.stop_profiling()
+                profiler = bot.sampling_profiler
+                profile = {'profile': profiler.summary(),
+                           'profile_top': profiler.top(3),
+                           'profile_share': {name: round(profiler.inclusive(name) / max(1, profiler.stats['samples']), 3)
+                                             for name in ('handle_text', 'analyze_symptoms_advanced',
+                                                          'process_update')}}
+            if shadow is not None:
+                await bot.shadow_runner.wait_idle(timeout=120)
+                profile['shadow'] = bot.shadow_runner.summary()
+        finally:
+            await bot.shadow_runner.stop()
+            bot.render_pool.shutdown()
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            await api.stop()
+        summary = api.summary()
+        assert drained and summary['answered_updates'] == len(batch), summary
+        return {'throughput_per_s': round(len(batch) / elapsed, 1), **summary, **profile}
+
+    return asyncio.run(run())
+
+
+@benchmark("bot_api_e2e")
+def bench_bot_api_e2e(updates: int = 1_000, rate: float = 200.0) -> Dict:
+    batch = synthetic_update_batch(updates)
+    return {'updates': updates, 'target_rate': rate, **run_against_fake_api(batch, rate)}
+
+
+@benchmark("bot_modes")
+def bench_bot_modes(updates: int = 1_000, rate: float = 400.0) -> Dict:
+    batch = synthetic_update_batch(updates)
+    results = {'updates': updates, 'target_rate': rate}
+    for mode in ('webhook', 'polling'):
+        for concurrent_updates in (0, 32):
+            summary = run_against_fake_api(batch, rate, mode, concurrent_updates)
+            results[f'{mode}_c{concurrent_updates}'] = (
+                f"{summary['throughput_per_s']}/s p50={summary['p50_ms']}ms p99={summary['p99_ms']}ms"
+            )
+    return results
+
+@benchmark("user_ordering")
+def bench_user_ordering(flood: int = 40, handler_s: float = 0.05, concurrent_updates: int = 4) -> Dict:
+    """Un usuario inunda la cola; la update de otro usuario no debe esperar a toda la inundación"""
+    import asyncio
+    import logging
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, TypeHandler
+    from ets_bot import UserOrderedApplication
+    from fake_bot_api import FakeBotAPI, FaultPlan, make_message_update
+
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+
+    async def run() -> Dict:
+        api = FakeBotAPI(FaultPlan())
+        await api.start()
+        app = (ApplicationBuilder().token('123:abc').base_url(api.base_url)
+               .application_class(UserOrderedApplication).concurrent_updates(concurrent_updates).build())
+        finished = {}
+        order = []
+
+        async def handle(update: Update, context):
+            user_id = update.effective_user.id
+            order.append((user_id, update.update_id))
+            await asyncio.sleep(handler_s)
+            finished[update.update_id] = time.perf_counter()
+
+        app.add_handler(TypeHandler(Update, handle))
+        await app.initialize()
+        await app.start()
+        try:
+            start = time.perf_counter()
+            for update_id in range(1, flood + 1):
+                await app.update_queue.put(Update.de_json(make_message_update(update_id, 1, 'hola'), app.bot))
+            await app.update_queue.put(Update.de_json(make_message_update(flood + 1, 2, 'hola'), app.bot))
+            await app.update_queue.join()
+        finally:
+            await app.stop()
+            await app.shutdown()
+            await api.stop()
+        other_ms = (finished[flood + 1] - start) * 1000
+        flood_order = [update_id for user_id, update_id in order if user_id == 1]
+        assert flood_order == sorted(flood_order), flood_order
+        # Con el hueco tomado antes del turno, el otro usuario esperaba casi toda la inundación
+        assert other_ms < 5 * handler_s * 1000, other_ms
+        return {
+            'flood_updates': flood,
+            'concurrent_updates': concurrent_updates,
+            'other_user_ms': round(other_ms, 1),
+            'flood_total_ms': round((max(finished.values()) - start) * 1000, 1),
+            'flood_in_order': True,
+        }
+
+    return asyncio.run(run())
+
+
+@benchmark("redeploy")
+def bench_redeploy(updates: int = 600, rate: float = 100.0, downtime: float = 0.5) -> Dict:
+    """Reinicio a mitad de carga: SIGTERM a la instancia A, hueco, arranque de B"""
+    import asyncio
+    import logging
+    import os
+    import socket
+    import tempfile
+
+    os.environ.setdefault('REMINDERS_PATH', os.path.join(tempfile.mkdtemp(), 'reminders.journal'))
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    import ets_bot
+    from fake_bot_api import FakeBotAPI, FaultPlan
+    from lifecycle import WebhookLifecycle
+
+    def free_port() -> int:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            return probe.getsockname()[1]
+
+    def instance(api, drop_pending: bool):
+        started_at = time.perf_counter()
+        bot = ets_bot.ETSBotAdvanced('123:abc', base_url=api.base_url, concurrent_updates=32)
+        port = free_port()
+        lifecycle = WebhookLifecycle(bot.application, '127.0.0.1', port, '123:abc',
+                                     f"http://127.0.0.1:{port}/123:abc", drain_timeout=10,
+                                     before_drain=bot.prepare_shutdown, started_at=started_at)
+        if drop_pending:
+            # Comportamiento anterior: run_webhook(drop_pending_updates=True)
+            original = bot.application.updater.start_webhook
+
+            async def start_webhook(**kwargs):
+                return await original(**{**kwargs, 'drop_pending_updates': True})
+            bot.application.updater.start_webhook = start_webhook
+        return lifecycle
+
+    async def scenario(drop_pending: bool) -> Dict:
+        api = FakeBotAPI(FaultPlan(latency=0.002, jitter=0.003, seed=38))
+        await api.start()
+        first = instance(api, drop_pending)
+        await first.start()
+        pushing = asyncio.ensure_future(api.push_updates(synthetic_update_batch(updates), rate))
+        await asyncio.sleep(updates / rate / 2)
+        await first.stop()
+        await asyncio.sleep(downtime)
+        second = instance(api, drop_pending)
+        await second.start()
+        await pushing
+        await api.wait_idle(timeout=30)
+        await second.stop()
+        await api.stop()
+        summary = api.summary()
+        return {
+            'answered': summary['answered_updates'],
+            'lost': updates - summary['answered_updates'],
+            'first_drain_s': round(first.timings['drain_s'], 3),
+            'second_time_to_ready_s': round(second.timings['time_to_ready_s'], 3),
+            'second_prewarm_s': round(second.timings['prewarm_s'], 3),
+            'p99_ms': summary['p99_ms'],
+        }
+
+    results = {'updates': updates, 'rate': rate, 'downtime_s': downtime}
+    for label, drop_pending in (('drop_pending', True), ('graceful', False)):
+        outcome = asyncio.run(scenario(drop_pending))
+        results.update({f'{label}_{key}': value for key, value in outcome.items()})
+    assert results['graceful_lost'] == 0, results
+    return results
+
+
+# Presupuesto de memoria por usuario activo (sesión + perfil + estado de control)
+PER_USER_BUDGET = 3_072
+
+
+@benchmark("memory_budget")
+def bench_memory_budget(users: int = 20_000) -> Dict:
+    import os
+    import tempfile
+
+    os.environ.setdefault('REMINDERS_PATH', os.path.join(tempfile.mkdtemp(), 'reminders.journal'))
+    import ets_bot
+    from memory_report import format_report
+    from message_cache import render_hashes
+
+    bot = ets_bot.ETSBotAdvanced('123:abc')
+    sessions = bot.session_manager
+    rng = random.Random(39)
+    texts = ["me arde al orinar", "tengo una llaga que no duele", "¿cuánto tarda la sífilis?",
+             "secreción amarilla desde hace 3 días", "hola"]
+    genders = ['Masculino', 'Femenino', 'No binario', None]
+
+    def replay(user_id: int):
+        sessions.update_session(user_id, {'current_flow': 'main_menu'})
+        sessions.update_profile(user_id, language=rng.choice(('es', 'en')), age=rng.randint(16, 60),
+                                gender=rng.choice(genders))
+        menu = bot.get_main_menu(user_id)
+        # Textos únicos por usuario, como en producción
+        text = f"{rng.choice(texts)} ({user_id})"
+        sessions.update_session(user_id, {'last_message': text})
+        sessions.get_user_data(user_id)['last_symptoms'] = [text.lower()]
+        sessions.update_profile(user_id, risk_level=rng.choice(('low', 'medium', 'high')))
+        bot.rate_limiter.check(user_id)
+        bot.message_cache.remember(user_id, 1, *render_hashes(text, 'Markdown', menu))
+
+    # El primer usuario calienta cachés compartidas (menús por idioma, ...)
+    replay(0)
+    _, delta = measure_memory(lambda: [replay(user_id) for user_id in range(1, users + 1)])
+    per_user = delta / users
+    footprints = bot.memory_footprints()
+    print(format_report({name: footprints[name] for name in ('sessions', 'user_data', 'rate_limiter',
+                                                             'message_cache')}, {}, users + 1))
+    assert per_user <= PER_USER_BUDGET, f"{per_user:.0f} B/usuario supera el presupuesto de {PER_USER_BUDGET} B"
+    return {'users': users, 'bytes_per_user': round(per_user), 'budget': PER_USER_BUDGET}
+
+
+@benchmark("compact_encoding")
+def bench_compact_encoding(records: int = 100_000, presses: int = 500_000) -> Dict:
+    import json
+    from codes import CallbackCodec, compact_profile
+
+    # Perfiles como llegan de una importación NDJSON: cada valor es una cadena nueva
+    rng = random.Random(40)
+    lines = [json.dumps({'age': rng.randint(16, 60), 'gender': rng.choice(['Masculino', 'Femenino', 'No binario']),
+                         'risk_level': rng.choice(['unknown', 'low', 'medium', 'high']),
+                         'language': rng.choice(['es', 'en']), 'last_symptoms': [], 'preferences': {}})
+             for _ in range(records)]
+    _, plain_bytes = measure_memory(lambda: [json.loads(line) for line in lines])
+    _, compact_bytes = measure_memory(lambda: [compact_profile(json.loads(line)) for line in lines])
+
+    db = load_reference_database()
+    routes = ("menu", "encyclopedia", "test_guide", "find_centers", "emergency", "quick_symptoms",
+              "free_chat", "profile", "skip_setup")
+    cities = ("ciudad_mexico", "guadalajara", "monterrey")
+    codec = CallbackCodec()
+    for route in routes:
+        codec.add_route(route)
+    codec.add_family("ets_detail", "e", db, legacy_prefix="ets_detail_")
+    codec.add_family("city", "c", cities, legacy_prefix="city_")
+    codec.add_family("rating", "r", "12345", legacy_prefix="rating_")
+
+    legacy_stream = [rng.choice([*routes, *(f"ets_detail_{key}" for key in db), *(f"city_{c}" for c in cities),
+                                 *(f"rating_{n}" for n in "12345")]) for _ in range(1_000)]
+    compact_stream = [codec.encode(*codec.decode(data)) for data in legacy_stream]
+
+    def legacy_parse(data):
+        # Lógica anterior de handle_callback
+        handlers = dict.fromkeys(routes)
+        if data in handlers:
+            route = data
+        else:
+            route = next((prefix.rstrip('_') for prefix in ("ets_detail_", "rating_", "city_")
+                          if data.startswith(prefix)), 'unknown')
+        if data.startswith("ets_detail_"):
+            return route, data.replace("ets_detail_", "")
+        if data.startswith("rating_"):
+            return route, int(data.replace("rating_", ""))
+        if data.startswith("city_"):
+            return route, data.replace("city_", "")
+        return route, None
+
+    legacy_iter = iter(legacy_stream * (presses // len(legacy_stream) + 1))
+    compact_iter = iter(compact_stream * (presses // len(compact_stream) + 1))
+    decode = codec.decode
+    return {
+        'records': records,
+        'profile_bytes_per_record_plain': round(plain_bytes / records),
+        'profile_bytes_per_record_compact': round(compact_bytes / records),
+        'callback_ns_legacy': round(time_per_op(lambda: legacy_parse(next(legacy_iter)), presses), 1),
+        'callback_ns_codec': round(time_per_op(lambda: decode(next(compact_iter)), presses), 1),
+        'payload_bytes_legacy': round(sum(map(len, legacy_stream)) / len(legacy_stream), 1),
+        'payload_bytes_codec': round(sum(map(len, compact_stream)) / len(compact_stream), 1),
+    }
+
+
+@benchmark("broadcast")
+def bench_broadcast(users: int = 3_000, rate: float = 500.0, latency: float = 0.02,
+                    late_joiners: int = 100) -> Dict:
+    import asyncio
+    import os
+    import tempfile
+    from collections import Counter
+    from telegram.error import Forbidden, RetryAfter
+    from broadcast import Broadcast, Segment, read_checkpoint
+
+    rng = random.Random(41)
+    user_data = {user_id: {'age': rng.randint(16, 60), 'risk_level': rng.choice(['low', 'medium', 'high']),
+                           'city': rng.choice(['ciudad_mexico', 'guadalajara', 'monterrey'])}
+                 for user_id in rng.sample(range(10**6, 10**7), users)}
+    blockers = set(rng.sample(sorted(user_data), users // 50))
+    throttled_once = {sorted(user_data)[users // 3]}
+    received = Counter()
+
+    async def send(user_id, profile):
+        await asyncio.sleep(latency)
+        if user_id in throttled_once:
+            throttled_once.discard(user_id)
+            raise RetryAfter(1)
+        if user_id in blockers:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        received[user_id] += 1
+
+    def blocked(user_id):
+        user_data[user_id]['blocked'] = True
+
+    async def scenario(path):
+        # Campaña completa a ritmo objetivo
+        begin = time.perf_counter()
+        full = await Broadcast("testing_week", Segment(), user_data, send, rate=rate, workers=16,
+                               checkpoint_path=path, on_blocked=blocked).run()
+        full_elapsed = time.perf_counter() - begin
+
+        # Segunda campaña a un segmento, interrumpida a mitad y reanudada desde el checkpoint
+        received.clear()
+        segment = Segment.parse(['riesgo=high,medium'])
+        expected = {user_id for user_id, profile in user_data.items()
+                    if segment.matches(profile) and not profile.get('blocked')}
+        first = Broadcast("vph", segment, user_data, send, rate=rate, workers=16, checkpoint_path=path,
+                          checkpoint_every=50, on_blocked=blocked)
+        task = asyncio.ensure_future(first.run())
+        # Usuarios nuevos durante la campaña: se añaden al final y también deben recibirla
+        for user_id in range(late_joiners):
+            user_data[user_id] = {'age': 30, 'risk_level': 'high', 'city': 'guadalajara'}
+            await asyncio.sleep(0.002)
+        while sum(received.values()) < len(expected) // 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        sent_before_crash = sum(received.values())
+        resumed = await Broadcast.resume(read_checkpoint(path), user_data, send, rate=rate, workers=16,
+                                         checkpoint_path=path).run()
+        expected.update(range(late_joiners))
+        return full, full_elapsed, expected, sent_before_crash, resumed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full, full_elapsed, expected, sent_before_crash, resumed = asyncio.run(
+            scenario(os.path.join(tmp, 'broadcast.checkpoint.json')))
+
+    # Una pausa de 1s por el RetryAfter inyectado
+    ideal = users / rate + 1
+    return {
+        'users': users,
+        'target_per_s': rate,
+        'sent': full['sent'],
+        'blocked': full['blocked'],
+        'achieved_per_s': round(users / full_elapsed, 1),
+        'elapsed_vs_ideal': round(full_elapsed / ideal, 2),
+        'resume_sent_before_crash': sent_before_crash,
+        'resume_expected': len(expected),
+        'late_joiners': late_joiners,
+        'resume_all_reached': set(received) == expected,
+        'resume_max_per_user': max(received.values()),
+        'resume_duplicates': sum(count - 1 for count in received.values()),
+        'resume_stats': resumed,
+    }
+
+
+@benchmark("appointments")
+def bench_appointments(clinics: int = 5_000, cities: int = 50, queries: int = 100_000,
+                       threads: int = 8, bookings: int = 20_000) -> Dict:
+    import asyncio
+    import threading
+    from collections import Counter
+    from itertools import cycle
+    from appointments import SlotEngine
+
+    rng = random.Random(42)
+    hours = ["Lun-Vie 8:00-20:00", "Lun-Vie 7:00-15:00", "Lun-Vie 8:00-14:00", "Lun-Sáb 9:00-13:00, 15:00-19:00"]
+    services = [["Pruebas VIH", "Consulta gratuita"], ["Consulta general"], ["Pruebas ETS completas"]]
+    centers = {f"ciudad_{city}": {'nombre': f"Ciudad {city}", 'centros': []} for city in range(cities)}
+    for clinic in range(clinics):
+        centers[f"ciudad_{clinic % cities}"]['centros'].append({
+            'nombre': f"Centro {clinic}", 'servicios': rng.choice(services), 'horarios': rng.choice(hours),
+            'consultorios': rng.randint(1, 3)})
+
+    begin = time.perf_counter()
+    engine, engine_bytes = measure_memory(lambda: SlotEngine.from_medical_centers(centers))
+    build_s = time.perf_counter() - begin
+    free_slots = sum(len(clinic.free) for clinic in engine.clinics.values())
+
+    city_names = list(centers)
+    next_city = cycle([rng.choice(city_names) for _ in range(1_000)]).__next__
+    clinic_ids = list(engine.clinics)
+
+    # Reservar y cancelar el primer turno libre de centros al azar
+    targets = [(clinic_id, engine.clinics[clinic_id].free[0]) for clinic_id in rng.sample(clinic_ids, 1_000)]
+    next_target = cycle(targets).__next__
+
+    def reserve_cancel():
+        clinic_id, slot = next_target()
+        engine.reserve(clinic_id, slot)
+        engine.cancel(clinic_id, slot)
+
+    # Contención entre hilos: todos compiten por el próximo turno de pruebas en las mismas 3 ciudades
+    hot_cities = city_names[:3]
+    granted = Counter()
+    conflicts = [0] * threads
+
+    def client(worker: int):
+        local = random.Random(worker)
+        for _ in range(bookings // threads):
+            while True:
+                found = engine.next_free('pruebas', local.choice(hot_cities))
+                if found is None:
+                    return
+                slot, clinic_id = found
+                if engine.reserve(clinic_id, slot):
+                    granted[clinic_id, slot] += 1
+                    break
+                conflicts[worker] += 1
+
+    begin = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(worker,)) for worker in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    threaded_s = time.perf_counter() - begin
+    overbooked = sum(1 for (clinic_id, slot), count in granted.items()
+                     if count > engine.clinics[clinic_id].capacity
+                     or engine.clinics[clinic_id].booked.get(slot) != count)
+
+    # Contención en el event loop: 2000 usuarios piden el mismo turno y reservan tras un await
+    async def user(city):
+        attempts = 0
+        while True:
+            slot, clinic_id = engine.next_free('consulta', city)
+            await asyncio.sleep(0)
+            attempts += 1
+            if engine.reserve(clinic_id, slot):
+                return attempts
+
+    async def stampede():
+        return await asyncio.gather(*(user(city_names[-1]) for _ in range(2_000)))
+
+    attempts = asyncio.run(stampede())
+
+    # El mismo pico con búsqueda y reserva atómicas (botón "primer turno disponible")
+    begin = time.perf_counter()
+    atomic = [engine.reserve_next('consulta', city_names[-2]) for _ in range(2_000)]
+    atomic_s = time.perf_counter() - begin
+    return {
+        'clinics': clinics,
+        'free_slots': free_slots,
+        'build_s': round(build_s, 2),
+        'engine_mb': round(engine_bytes / 2**20, 1),
+        'next_free_city_ns': round(time_per_op(lambda: engine.next_free('pruebas', next_city()), queries)),
+        'next_free_any_ns': round(time_per_op(lambda: engine.next_free('pruebas'), queries)),
+        'earliest_3_ns': round(time_per_op(lambda: engine.earliest_per_clinic('consulta', next_city()), queries)),
+        'reserve_cancel_ns': round(time_per_op(reserve_cancel, queries)),
+        'threaded_bookings': sum(granted.values()),
+        'threaded_per_s': round(sum(granted.values()) / threaded_s),
+        'threaded_conflicts': sum(conflicts),
+        'threaded_overbooked': overbooked,
+        'stampede_users': len(attempts),
+        'stampede_max_attempts': max(attempts),
+        'stampede_mean_attempts': round(sum(attempts) / len(attempts), 2),
+        'reserve_next_ns': round(atomic_s / len(atomic) * 1e9),
+        'reserve_next_overbooked': sum(1 for (slot, clinic_id), count in Counter(atomic).items()
+                                       if count > engine.clinics[clinic_id].capacity),
+    }
+
+
+@benchmark("opening_hours")
+def bench_opening_hours(clinics: int = 5_000, queries: int = 200) -> Dict:
+    from datetime import datetime, timedelta
+    from opening_hours import OpeningIndex, parse_horarios
+
+    rng = random.Random(43)
+    hours = ["Lun-Vie 8:00-20:00", "Lun-Vie 7:00-15:00", "Lun-Sáb 9:00-13:00, 15:00-19:00", "Diario 24 horas",
+             "Vie-Dom 22:00-2:00", "Lunes a viernes 8:30-14:30; Sáb 9-12"]
+    # Textos distintos por centro, como en datos reales (la caché de parse_horarios no ayuda)
+    texts = [f"{rng.choice(hours)}; Dom {rng.randint(7, 11)}:{rng.randint(0, 59):02d}-{rng.randint(12, 18)}:00"
+             for _ in range(clinics)]
+    keys = [f"ciudad/{position}" for position in range(clinics)]
+
+    begin = time.perf_counter()
+    index = OpeningIndex()
+    for key, text in zip(keys, texts):
+        index.add(key, text)
+    compile_s = time.perf_counter() - begin
+    _, bitmap_bytes = measure_memory(lambda: [int(bitmap) | 0 for bitmap in index.bitmaps.values()])
+
+    moments = [datetime(2026, 10, 19) + timedelta(minutes=rng.randrange(7 * 24 * 60)) for _ in range(queries)]
+    next_moment = iter(moments * 10).__next__
+
+    def naive_open_now():
+        # Interpretar el texto en cada consulta y recorrer sus intervalos
+        moment = next_moment()
+        minute = moment.weekday() * 1440 + moment.hour * 60 + moment.minute
+        parse_horarios.cache_clear()
+        return [key for key, text in zip(keys, texts)
+                if any(start <= minute < end for start, end in parse_horarios(text))]
+
+    return {
+        'clinics': clinics,
+        'compile_us_per_clinic': round(compile_s / clinics * 1e6, 1),
+        'bitmap_bytes_per_clinic': round(bitmap_bytes / clinics),
+        'naive_open_now_ns_per_clinic': round(time_per_op(naive_open_now, 3) / clinics),
+        'open_now_ns_per_clinic': round(time_per_op(lambda: index.rank(keys, next_moment(), 0), 20) / clinics),
+        'open_within_2h_ns_per_clinic': round(time_per_op(lambda: index.rank(keys, next_moment(), 2), 20) / clinics),
+        'rank_all_ns_per_clinic': round(time_per_op(lambda: index.rank(keys, next_moment()), 20) / clinics),
+    }
+
+
+@benchmark("multi_tenant")
+def bench_multi_tenant(tenants: int = 4, updates: int = 400, rate: float = 100.0) -> Dict:
+    import asyncio
+    import logging
+    import os
+    import socket
+    import tempfile
+
+    os.environ.setdefault('REMINDERS_PATH', os.path.join(tempfile.mkdtemp(), 'reminders.journal'))
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    import ets_bot
+    from fake_bot_api import FakeBotAPI, FaultPlan
+    from tenants import TenantConfig, TenantLifecycle, build_tenants
+
+    regional = {'norte': {'nombre': 'Norte', 'centros': [dict(ets_bot.MEDICAL_CENTERS['guadalajara']['centros'][0])]}}
+    configs = [TenantConfig(f"t{index}", f"{index + 1}00:tenant", language='en' if index % 2 else None,
+                            medical_centers=regional if index % 2 else None) for index in range(tenants)]
+
+    # Memoria de N bots: recursos compartidos frente a una copia por bot (un contenedor por bot)
+    _, shared_bytes = measure_memory(lambda: build_tenants(configs))
+    _, separate_bytes = measure_memory(lambda: [build_tenants([config]) for config in configs])
+    _, resources_bytes = measure_memory(ets_bot.SharedResources)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    async def run() -> Dict:
+        apis = [FakeBotAPI(FaultPlan(latency=0.002, jitter=0.003, seed=44 + index)) for index in range(tenants)]
+        for api in apis:
+            await api.start()
+        # Cada tenant habla con su propia Bot API falsa; los recursos se comparten como en build_tenants
+        shared = ets_bot.SharedResources()
+        bots = [build_tenants([config], shared, base_url=api.base_url)[0] for config, api in zip(configs, apis)]
+        lifecycle = TenantLifecycle(configs, bots, f"http://127.0.0.1:{port}", '127.0.0.1', port)
+        await lifecycle.start()
+        try:
+            batches = [synthetic_update_batch(updates) for _ in range(tenants)]
+            start = time.perf_counter()
+            await asyncio.gather(*(api.push_updates(batch, rate) for api, batch in zip(apis, batches)))
+            drained = all(await asyncio.gather(*(api.wait_idle(timeout=120) for api in apis)))
+            elapsed = time.perf_counter() - start
+        finally:
+            await lifecycle.stop()
+            for api in apis:
+                await api.stop()
+        summaries = [api.summary() for api in apis]
+        assert drained and all(summary['answered_updates'] == updates for summary in summaries), summaries
+        return {
+            'aggregate_per_s': round(tenants * updates / elapsed, 1),
+            'per_tenant': {config.name: {'p50_ms': summary['p50_ms'], 'p99_ms': summary['p99_ms'],
+                                         'answered': summary['answered_updates']}
+                           for config, summary in zip(configs, summaries)},
+        }
+
+    return {
+        'tenants': tenants,
+        'shared_resources_kb': round(resources_bytes / 1024),
+        'bytes_per_tenant_shared': round(shared_bytes / tenants),
+        'bytes_per_tenant_separate': round(separate_bytes / tenants),
+        'updates_per_tenant': updates,
+        'rate_per_tenant': rate,
+        **asyncio.run(run()),
+    }
+
+
+@benchmark("flows")
+def bench_flows(lengths: Tuple[int, ...] = (3, 30, 300), steps: int = 20_000) -> Dict:
+    from flows import END, Flow, load_flows
+
+    def definition(length: int) -> Dict:
+        questions = []
+        for number in range(length):
+            if number % 2:
+                questions.append({'id': f"q{number}", 'text': f"Pregunta {number}",
+                                  'options': [{'label': label, 'value': label} for label in ('Sí', 'No', 'A veces')]})
+            else:
+                questions.append({'id': f"q{number}", 'text': f"Pregunta {number}",
+                                  'validator': {'type': 'int_range', 'minimum': 0, 'maximum': 100}})
+        return {'name': f"sintetico{length}", 'tag': 'x', 'questions': questions}
+
+    results = {}
+    for length in lengths:
+        begin = time.perf_counter()
+        flow = Flow.compile(definition(length))
+        compile_ms = (time.perf_counter() - begin) * 1000
+        inputs = [(None, f"{flow.tag}{state:x}:1") if state % 2 else ('42', None) for state in range(length)]
+        progress = {'state': flow.start, 'answers': flow.begin({})[1]}
+
+        def step():
+            # Responde la pregunta actual y vuelve a empezar al terminar
+            state = progress['state']
+            text, data = inputs[state]
+            transition = flow.advance(state, progress['answers'], {}, text=text, data=data)
+            progress['state'] = flow.start if transition.state == END else transition.state
+
+        _, progress_bytes = measure_memory(lambda: [flow.name, length - 1, list(flow.begin({})[1])])
+        results[f"len_{length}"] = {
+            'compile_ms': round(compile_ms, 2),
+            'ns_per_step': round(time_per_op(step, steps)),
+            'progress_bytes_per_user': progress_bytes,
+        }
+
+    assessment = load_flows()['assessment']
+    walk = [('30', None), (None, 'a1:3'), ('Agénero', None), ('dolor y ardor', None)]
+
+    def full_assessment():
+        state, answers = assessment.begin({})
+        for text, data in walk:
+            state = assessment.advance(state, answers, {}, text=text, data=data).state
+        return state
+
+    assert full_assessment() == END
+    results['assessment_us_per_walk'] = round(time_per_op(full_assessment, 5_000) / 1000, 2)
+    return results
+
+
+@benchmark("markup")
+def bench_markup(names: int = 20_000, renders: int = 200_000) -> Dict:
+    import itertools
+    from i18n import LOCALES_DIR, MessageCatalog
+    from markup import MARKDOWN, MARKDOWN_V2, HTML, MarkupError, escape, validate
+
+    begin = time.perf_counter()
+    catalog = MessageCatalog.load(LOCALES_DIR)
+    templates = sum(len(pack.messages) for pack in catalog.packs.values())
+    compile_ms = (time.perf_counter() - begin) * 1000
+
+    # Nombres de Telegram con los caracteres que rompen el Markdown
+    rng = random.Random(46)
+    alphabet = "abcdefghij _*`[]()~>#+-=|{}.!\\<&"
+    hostile = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 16))) for _ in range(names)]
+    source = catalog.pack('es').messages['start.welcome']
+    raw_source = ''.join(literal + ('{}' if index < len(source.fields) else '')
+                         for index, literal in enumerate(source.literals))
+
+    def rejected(texts, parse_mode) -> int:
+        failures = 0
+        for text in texts:
+            try:
+                validate(text, parse_mode)
+            except MarkupError:
+                failures += 1
+        return failures
+
+    next_name = itertools.cycle(hostile).__next__
+    return {
+        'templates': templates,
+        'compile_validate_ms': round(compile_ms, 2),
+        'render_ns': round(time_per_op(lambda: catalog.text('es', 'start.welcome', first_name=next_name()), renders)),
+        'fstring_ns': round(time_per_op(lambda: raw_source.format(next_name()), renders)),
+        'escape_ns': {parse_mode: round(time_per_op(lambda: escape(next_name(), parse_mode), renders))
+                      for parse_mode in (MARKDOWN, MARKDOWN_V2, HTML)},
+        'parse_errors_fstring': rejected((raw_source.format(name) for name in hostile), MARKDOWN),
+        'parse_errors_escaped': rejected((catalog.text('es', 'start.welcome', first_name=name) for name in hostile),
+                                         MARKDOWN),
+        'parse_errors_escaped_v2': rejected((f"*Hola {escape(name, MARKDOWN_V2)}*\\!" for name in hostile),
+                                            MARKDOWN_V2),
+        'parse_errors_escaped_html': rejected((f"<b>Hola {escape(name, HTML)}</b>" for name in hostile), HTML),
+    }
+
+
+def keystroke_batch(users: int, phrases=("sífilis", "clínica guadalajara", "herpes genital", "pruebas vih",
+                                         "gonorrea tratamiento", "centro ciudad de méxico")):
+    """Cada usuario escribe una frase letra a letra: una inline query por pulsación"""
+    from fake_bot_api import make_inline_query_update
+
+    typed = [[phrases[user % len(phrases)][:length] for length in range(1, len(phrases[user % len(phrases)]) + 1)]
+             for user in range(users)]
+    # Usuarios intercalados, como en producción
+    batch = []
+    for position in range(max(len(queries) for queries in typed)):
+        for user, queries in enumerate(typed):
+            if position < len(queries):
+                batch.append(make_inline_query_update(len(batch) + 1, 70_000 + user, queries[position]))
+    return batch
+
+
+@benchmark("inline_search")
+def bench_inline_search(clinics: int = 5_000, cities: int = 50, diseases: int = 1_000,
+                        keystrokes: int = 100_000, users: int = 60, rate: float = 50.0) -> Dict:
+    from itertools import cycle
+    from fake_bot_api import percentile
+    from inline_search import InlineIndex
+
+    rng = random.Random(47)
+    services = [["Pruebas VIH", "Consulta gratuita"], ["Consulta general"], ["Pruebas ETS completas"]]
+    centers = {f"ciudad_{city}": {'nombre': f"Ciudad {city}", 'centros': []} for city in range(cities)}
+    for clinic in range(clinics):
+        centers[f"ciudad_{clinic % cities}"]['centros'].append({
+            'nombre': f"Centro {clinic}", 'direccion': f"Calle {clinic}", 'servicios': rng.choice(services),
+            'horarios': "Lun-Vie 8:00-20:00"})
+    database = synthetic_knowledge_base(diseases)
+
+    begin = time.perf_counter()
+    index, index_bytes = measure_memory(lambda: InlineIndex.build(database, centers, cache_size=0))
+    build_ms = (time.perf_counter() - begin) * 1000
+
+    queries = [update['inline_query']['query'] for update in keystroke_batch(600)]
+    queries += [f"centro {rng.randrange(clinics)}"[:rng.randint(2, 12)] for _ in range(600)]
+    next_query = cycle(queries).__next__
+
+    def timed(index) -> List[float]:
+        samples = []
+        for _ in range(keystrokes // 10):
+            query = next_query()
+            start = time.perf_counter()
+            index.answer(query)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    uncached = timed(index)
+    index.cache_size = 10_000
+    cached = timed(index)
+
+    e2e = run_against_fake_api(keystroke_batch(users), rate)
+    return {
+        'documents': len(index.articles),
+        'build_ms': round(build_ms),
+        'index_mb': round(index_bytes / 2 ** 20, 1),
+        'uncached_p50_us': round(percentile(uncached, 0.50) * 1e6, 1),
+        'uncached_p99_us': round(percentile(uncached, 0.99) * 1e6, 1),
+        'cached_p50_us': round(percentile(cached, 0.50) * 1e6, 1),
+        'cached_p99_us': round(percentile(cached, 0.99) * 1e6, 1),
+        'cache_hit_rate': round(index.stats['hits'] / (index.stats['hits'] + index.stats['misses']), 3),
+        'e2e_keystrokes': e2e['answered_updates'],
+        'e2e_throughput_per_s': e2e['throughput_per_s'],
+        'e2e_p50_ms': e2e['p50_ms'],
+        'e2e_p99_ms': e2e['p99_ms'],
+    }
+
+
+@benchmark("profiler")
+def bench_profiler(updates: int = 600, rate: float = 60.0, calls: int = 200_000) -> Dict:
+    import asyncio
+    from profiler import SamplingProfiler
+
+    class Application:
+        async def process_update(self, update):
+            return update
+
+    # Costo del envoltorio por update: sin perfilado no hay ninguno
+    app = Application()
+    profiler = SamplingProfiler()
+    loop = asyncio.new_event_loop()
+
+    def dispatch_ns() -> float:
+        async def run():
+            begin = time.perf_counter()
+            for update in range(calls):
+                await app.process_update(update)
+            return (time.perf_counter() - begin) / calls * 1e9
+        return loop.run_until_complete(run())
+
+    off_ns = dispatch_ns()
+    profiler.start(3600, 0.1)
+    profiler.attach(app)
+    sampled_ns = dispatch_ns()
+    profiler.detach(app)
+    profiler.stop()
+    detached_ns = dispatch_ns()
+    loop.close()
+
+    batch = synthetic_update_batch(updates)
+    baseline = run_against_fake_api(batch, rate)
+    profiled = run_against_fake_api(batch, rate, profile_fraction=1.0)
+    return {
+        'dispatch_ns_off': round(off_ns),
+        'dispatch_ns_sampling_10pct': round(sampled_ns),
+        'dispatch_ns_after_detach': round(detached_ns),
+        'e2e_p50_ms_off': baseline['p50_ms'],
+        'e2e_p99_ms_off': baseline['p99_ms'],
+        'e2e_p50_ms_profiling': profiled['p50_ms'],
+        'e2e_p99_ms_profiling': profiled['p99_ms'],
+        'profile': profiled['profile'],
+        'profile_top': profiled['profile_top'],
+        'profile_share': profiled['profile_share'],
+    }
+
+
+# Candidatos de ejemplo para la evaluación en sombra; se importan desde sus procesos
+_shadow_context = None
+
+
+def _shadow_bot():
+    """Lo que usan analyze_symptoms_advanced y route_text, construido una vez por proceso"""
+    global _shadow_context
+    if _shadow_context is None:
+        from types import SimpleNamespace
+        import ets_bot
+        shared = ets_bot.SharedResources()
+        _shadow_context = SimpleNamespace(risk_factors=ets_bot.RISK_FACTORS, symptom_index=shared.symptom_index,
+                                          search_index=shared.search_index, catalog=shared.catalog)
+    return _shadow_context
+
+
+def shadow_symptoms_same(text: str, profile: Dict) -> Dict:
+    import ets_bot
+    return ets_bot.ETSBotAdvanced.analyze_symptoms_advanced(_shadow_bot(), text, profile)
+
+
+def shadow_symptoms_strict(text: str, profile: Dict) -> Dict:
+    """Variante: sin fiebre, 'high' baja a 'medium' aunque haya varias categorías de síntomas"""
+    analysis = shadow_symptoms_same(text, profile)
+    if analysis['risk_level'] == 'high' and 'fiebre' not in text:
+        analysis['risk_level'] = 'medium'
+    return analysis
+
+
+def shadow_chat_same(text: str, profile: Dict) -> str:
+    import ets_bot
+    bot = _shadow_bot()
+    intent = bot.catalog.detect_intent(profile.get('language'), text)
+    return ets_bot.ETSBotAdvanced.route_text(bot, text, intent)[0]
+
+
+def shadow_chat_no_search(text: str, profile: Dict) -> str:
+    """Variante: sin respuestas desde la enciclopedia"""
+    return _shadow_bot().catalog.detect_intent(profile.get('language'), text)
+
+
+@benchmark("shadow")
+def bench_shadow(updates: int = 600, rate: float = 50.0, offers: int = 2000) -> Dict:
+    import asyncio
+    import os
+    import tempfile
+    from itertools import cycle
+    import shadow
+
+    candidates = shadow.parse_candidates(
+        "symptoms=benchmarks:shadow_symptoms_same,symptoms=benchmarks:shadow_symptoms_strict,"
+        "chat=benchmarks:shadow_chat_same,chat=benchmarks:shadow_chat_no_search"
+    )
+    texts = cycle([
+        "me arde al orinar y tengo flujo", "tengo una llaga leve", "dolor intenso y fiebre",
+        "picazón ocasional", "secreción y ampollas y ganglios",
+    ])
+    production = {'risk_level': 'low', 'conditions': []}
+
+    async def offer_costs() -> Dict:
+        # Costo en el handler: muestra descartada por la fracción, encolada y con la cola llena
+        skipped = shadow.ShadowRunner(candidates, sample_rate=1e-9, seed=1)
+        full = shadow.ShadowRunner(candidates, sample_rate=1.0, queue_size=1, seed=1)
+        profile = {'gender': 'mujer', 'language': 'es', 'age': 30, 'last_symptoms': ['x']}
+        skip_ns = time_per_op(lambda: skipped.offer(shadow.SYMPTOMS, next(texts), profile, production), 50_000)
+        full.offer(shadow.SYMPTOMS, next(texts), profile, production)
+        drop_ns = time_per_op(lambda: full.offer(shadow.SYMPTOMS, next(texts), profile, production), 50_000)
+        await skipped.stop()
+        await full.stop()
+
+        # Precisión: análisis de producción real frente a los candidatos, en un log temporal
+        log_path = os.path.join(tempfile.mkdtemp(), 'shadow.jsonl')
+        runner = shadow.ShadowRunner(candidates, sample_rate=1.0, queue_size=offers, log_path=log_path, seed=1)
+        bot = _shadow_bot()
+        import ets_bot
+        begin = time.perf_counter()
+        for _ in range(offers):
+            text = next(texts)
+            analysis = ets_bot.ETSBotAdvanced.analyze_symptoms_advanced(bot, text, {})
+            runner.offer(shadow.SYMPTOMS, text, profile,
+                         {'risk_level': analysis['risk_level'], 'conditions': analysis['conditions']})
+        enqueue_us = (time.perf_counter() - begin) / offers * 1e6
+        await runner.wait_idle(timeout=300)
+        summary = runner.summary()
+        await runner.stop()
+        with open(log_path, encoding='utf-8') as f:
+            log_lines = sum(1 for _ in f)
+        return {'offer_ns_not_sampled': round(skip_ns), 'offer_ns_queue_full': round(drop_ns),
+                'analyze_and_offer_us': round(enqueue_us, 1), 'symptoms': summary['candidates'],
+                'log_lines': log_lines}
+
+    costs = asyncio.run(offer_costs())
+    batch = synthetic_update_batch(updates)
+    baseline = run_against_fake_api(batch, rate)
+    shadowed = run_against_fake_api(batch, rate, shadow={'candidates': candidates, 'sample_rate': 1.0,
+                                                          'queue_size': 64, 'seed': 1})
+    chat = shadowed['shadow']
+    return {
+        **{key: value for key, value in costs.items() if key != 'symptoms'},
+        'symptoms_same': costs['symptoms']['benchmarks:shadow_symptoms_same'],
+        'symptoms_strict': costs['symptoms']['benchmarks:shadow_symptoms_strict'],
+        'e2e_p50_ms_off': baseline['p50_ms'],
+        'e2e_p99_ms_off': baseline['p99_ms'],
+        'e2e_p50_ms_shadow': shadowed['p50_ms'],
+        'e2e_p99_ms_shadow': shadowed['p99_ms'],
+        'e2e_shadow': {key: chat[key] for key in ('sampled', 'dropped', 'compared')},
+        'chat_same': chat['candidates']['benchmarks:shadow_chat_same'],
+        'chat_no_search': chat['candidates']['benchmarks:shadow_chat_no_search'],
+    }
+
+
+@benchmark("appointment_summary")
+def bench_appointment_summary(users: int = 100, repeats: int = 3, rate: float = 50.0) -> Dict:
+    import printable
+    from fake_bot_api import make_callback_update, make_message_update
+
+    def seed_profiles(bot):
+        for index in range(users):
+            user_id = 60_000 + index
+            bot.session_manager.update_profile(user_id, age=20 + index % 40, gender=('hombre', 'mujer')[index % 2])
+            bot.session_manager.get_user_data(user_id)['last_symptoms'] = [f"ardor y flujo desde hace {index % 9 + 1} días"]
+            analysis = bot.analyze_symptoms_advanced("me arde al orinar y tengo flujo", {})
+            bot.session_manager.update_profile(user_id, risk_level=analysis['risk_level'], last_assessment={
+                'at': 1_700_000_000, 'risk_level': analysis['risk_level'],
+                'conditions': analysis['possible_conditions'], 'recommendations': analysis['recommendations']})
+
+    class InlinePool:
+        """Renderizado en el propio event loop, como referencia"""
+        async def start(self):
+            pass
+
+        async def render(self, document):
+            return printable.render_pdf(document)
+
+        def shutdown(self):
+            pass
+
+    bots = []
+
+    def prepare(inline: bool):
+        def setup(bot):
+            seed_profiles(bot)
+            if inline:
+                bot.render_pool = InlinePool()
+            bots.append(bot)
+        return setup
+
+    # Render aislado: lo que bloquearía el loop si se hiciera en el handler
+    import ets_bot
+    bot = ets_bot.ETSBotAdvanced('123:abc')
+    seed_profiles(bot)
+    document = bot.appointment_summary(60_000)
+    pdf = printable.render_pdf(document)
+    render_us = time_per_op(lambda: printable.render_pdf(document), 200) / 1000
+    version_us = time_per_op(lambda: printable.document_version(bot.appointment_summary(60_000)), 2000) / 1000
+
+    # Carga mixta: peticiones de resumen repetidas y mensajes de chat de otros usuarios
+    batch = []
+    for round_ in range(repeats):
+        for index in range(users):
+            update_id = len(batch) + 1
+            batch.append(make_callback_update(update_id, 60_000 + index, "appointment_summary"))
+            batch.append(make_message_update(update_id + 1, 70_000 + len(batch), '¿cuánto tarda en aparecer la sífilis?'))
+
+    results = {}
+    for name, inline in (('inline', True), ('pool', False)):
+        summary = run_against_fake_api(batch, rate, prepare=prepare(inline))
+        stats = bots[-1].summary_files.stats
+        results[name] = {'p50_ms': summary['p50_ms'], 'p99_ms': summary['p99_ms'], 'max_ms': summary['max_ms'],
+                         'send_document': summary['methods'].get('sendDocument', 0),
+                         'renders': stats['renders'], 'reused': stats['reused'],
+                         'uploaded_kb': round(summary['uploaded_bytes'] / 1024, 1)}
+    return {
+        'pdf_bytes': len(pdf),
+        'render_pdf_us': round(render_us, 1),
+        'build_and_version_us': round(version_us, 1),
+        'e2e_inline_render': results['inline'],
+        'e2e_process_pool': results['pool'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del bot ETS")
+    parser.add_argument("names", nargs="*", help="Benchmarks a ejecutar")
+    parser.add_argument("--list", action="store_true", help="Lista los benchmarks disponibles")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Benchmarks desconocidos: {', '.join(unknown)}")
+
+    for name in names:
+        started = time.perf_counter()
+        results = BENCHMARKS[name]()
+        elapsed = time.perf_counter() - started
+        print(f"== {name} ({elapsed:.2f}s)")
+        for key, value in results.items():
+            print(f"   {key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Difusión de campañas
+Recorre los perfiles en orden de inserción con un generador, filtra por
+segmento y envía con varios workers limitados por un token bucket global.
+Los usuarios que bloquearon el bot se marcan para excluirlos; un checkpoint
+atómico permite reanudar tras una caída sin repetir envíos.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Container, Dict, FrozenSet, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from personalization import age_bucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram admite ~30 mensajes/s por bot hacia chats distintos
+DEFAULT_RATE = 25.0
+
+
+class Segment(NamedTuple):
+    """Filtro de destinatarios; un conjunto vacío no restringe"""
+    risk_levels: FrozenSet[str] = frozenset()
+    age_buckets: FrozenSet[str] = frozenset()
+    cities: FrozenSet[str] = frozenset()
+
+    # Nombres de los argumentos de /campana
+    FIELDS = {'riesgo': 'risk_levels', 'edad': 'age_buckets', 'ciudad': 'cities'}
+
+    @classmethod
+    def parse(cls, args: Iterable[str]) -> 'Segment':
+        """['riesgo=high,medium', 'ciudad=guadalajara'] → Segment"""
+        values = {}
+        for arg in args:
+            name, _, items = arg.partition('=')
+            if name not in cls.FIELDS or not items:
+                raise ValueError(f"Filtro no válido: {arg!r}")
+            values[cls.FIELDS[name]] = frozenset(item.strip() for item in items.split(',') if item.strip())
+        return cls(**values)
+
+    def matches(self, profile: Dict) -> bool:
+        if self.risk_levels and profile.get('risk_level') not in self.risk_levels:
+            return False
+        if self.age_buckets and age_bucket(profile.get('age')) not in self.age_buckets:
+            return False
+        if self.cities and profile.get('city') not in self.cities:
+            return False
+        return True
+
+    def to_json(self) -> Dict:
+        return {field: sorted(values) for field, values in self._asdict().items() if values}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Segment':
+        return cls(**{field: frozenset(values) for field, values in data.items()})
+
+
+def iter_recipients(user_data: Dict[int, Dict], segment: Segment, after: int = -1,
+                    skip: Container[int] = ()) -> Iterator[Tuple[int, int, Dict]]:
+    """(posición, user_id, perfil) del segmento tras la posición `after`, sin bloqueados
+
+    Recorre user_data en orden de inserción sin copiarlo ni ordenarlo. Los
+    perfiles nunca se borran, los nuevos van al final y la exportación los
+    reimporta en el mismo orden, así que la posición sirve para reanudar.
+    """
+    position = after + 1
+    while True:
+        try:
+            for user_id, profile in itertools.islice(user_data.items(), position, None):
+                current, position = position, position + 1
+                if current in skip or profile.get('blocked') or not segment.matches(profile):
+                    continue
+                yield current, user_id, profile
+            return
+        except RuntimeError:
+            # Llegó un perfil nuevo mientras se enviaba: seguir desde la misma posición
+            continue
+
+
+class TokenBucket:
+    """Ritmo medio `rate` con ráfagas de hasta `capacity`; `pause` detiene a todos (429)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate / 10)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = self.clock()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = 0.0
+
+
+def _write_checkpoint(path: str, checkpoint: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def read_checkpoint(path: Optional[str]) -> Optional[Dict]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Broadcast:
+    """Una campaña en curso: productor, workers, progreso y checkpoint"""
+
+    def __init__(self, campaign: str, segment: Segment, user_data: Dict[int, Dict],
+                 send: Callable[[int, Dict], Awaitable[None]], rate: float = DEFAULT_RATE, workers: int = 8,
+                 checkpoint_path: Optional[str] = None, checkpoint_every: int = 200, max_retries: int = 3,
+                 on_blocked: Optional[Callable[[int], None]] = None,
+                 on_progress: Optional[Callable[[Dict], Awaitable[None]]] = None, progress_interval: float = 5.0):
+        self.campaign = campaign
+        self.segment = segment
+        self.user_data = user_data
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.max_retries = max_retries
+        self.on_blocked = on_blocked
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.stats = {'sent': 0, 'blocked': 0, 'failed': 0, 'retried': 0}
+        # Reanudación por posición en user_data: todo lo <= watermark está resuelto,
+        # más las posiciones de `done_above`
+        self.watermark = -1
+        self.done_above = set()
+        self._pending = set()
+        self._last_issued = -1
+        self._since_checkpoint = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finished = False
+        # Resueltos antes de reanudar: no cuentan para el ritmo de esta ejecución
+        self._resolved_before = 0
+
+    @classmethod
+    def resume(cls, checkpoint: Dict, user_data: Dict[int, Dict], send, **kwargs) -> 'Broadcast':
+        broadcast = cls(checkpoint['campaign'], Segment.from_json(checkpoint['segment']), user_data, send, **kwargs)
+        broadcast.watermark = checkpoint['watermark']
+        broadcast.done_above = set(checkpoint['done_above'])
+        broadcast.stats.update(checkpoint['stats'])
+        broadcast._resolved_before = broadcast._resolved()
+        return broadcast
+
+    def _resolved(self) -> int:
+        return self.stats['sent'] + self.stats['blocked'] + self.stats['failed']
+
+    def progress(self) -> Dict:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at if self.started_at else 0.0
+        done = self._resolved() - self._resolved_before
+        return {'campaign': self.campaign, **self.stats, 'elapsed': round(elapsed, 1),
+                'per_second': round(done / elapsed, 1) if elapsed else 0.0, 'finished': self.finished}
+
+    def checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        _write_checkpoint(self.checkpoint_path, {
+            'campaign': self.campaign,
+            'segment': self.segment.to_json(),
+            'watermark': self.watermark,
+            'done_above': sorted(self.done_above),
+            'stats': self.stats,
+            'finished': self.finished,
+        })
+        self._since_checkpoint = 0
+
+    def _complete(self, position: int):
+        self._pending.discard(position)
+        self.done_above.add(position)
+        # El watermark avanza hasta el menor envío aún en curso
+        limit = min(self._pending) - 1 if self._pending else self._last_issued
+        if limit > self.watermark:
+            self.watermark = limit
+            self.done_above = {done for done in self.done_above if done > limit}
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    async def _deliver(self, user_id: int, profile: Dict):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.send(user_id, profile)
+                self.stats['sent'] += 1
+                return
+            except RetryAfter as e:
+                # Límite global: pausa a todos los workers y reintenta sin gastar intentos
+                self.bucket.pause(e.retry_after)
+                self.stats['retried'] += 1
+            except Forbidden:
+                self._blocked(user_id)
+                return
+            except BadRequest as e:
+                if 'chat not found' in e.message.lower():
+                    self._blocked(user_id)
+                else:
+                    logger.warning(f"Campaña {self.campaign}: envío a {user_id} rechazado: {e}")
+                    self.stats['failed'] += 1
+                return
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.warning(f"Campaña {self.campaign}: envío a {user_id} fallido: {e}")
+                    self.stats['failed'] += 1
+                    return
+                self.stats['retried'] += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    def _blocked(self, user_id: int):
+        self.stats['blocked'] += 1
+        if self.on_blocked:
+            self.on_blocked(user_id)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            position, user_id, profile = item
+            try:
+                await self._deliver(user_id, profile)
+            finally:
+                self._complete(position)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self.on_progress(self.progress())
+
+    async def run(self) -> Dict:
+        self.started_at = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.ensure_future(self._worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.ensure_future(self._report()) if self.on_progress else None
+        try:
+            for item in iter_recipients(self.user_data, self.segment, self.watermark, self.done_above):
+                self._pending.add(item[0])
+                self._last_issued = item[0]
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self.finished = True
+            self.finished_at = time.monotonic()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if reporter:
+                reporter.cancel()
+            self.checkpoint()
+        if self.on_progress:
+            await self.on_progress(self.progress())
+        return self.progress()
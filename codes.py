@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Codificación compacta
+Enums de texto para los campos categóricos de los perfiles (un único objeto
+por valor en todo el proceso) y un códec de callback_data con etiqueta de
+tipo + id corto que se decodifica con una tabla precalculada.
+"""
+
+import sys
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class _Code(str, Enum):
+    """Miembro que se comporta como su valor en comparaciones, hashes, f-strings y JSON"""
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+
+class Gender(_Code):
+    MALE = 'Masculino'
+    FEMALE = 'Femenino'
+    NONBINARY = 'No binario'
+
+
+class RiskLevel(_Code):
+    UNKNOWN = 'unknown'
+    LOW = 'low'
+    MEDIUM = 'medium'
+    HIGH = 'high'
+
+
+class Language(_Code):
+    ES = 'es'
+    EN = 'en'
+
+
+_PROFILE_CODES = {
+    'gender': {member.value: member for member in Gender},
+    'risk_level': {member.value: member for member in RiskLevel},
+    'language': {member.value: member for member in Language},
+}
+
+
+def compact_profile(profile: Dict) -> Dict:
+    """Sustituye en el sitio los valores categóricos por su miembro compartido"""
+    for field, members in _PROFILE_CODES.items():
+        value = profile.get(field)
+        if value is None or type(value) is not str:
+            continue
+        member = members.get(value)
+        if member is not None:
+            profile[field] = member
+        elif field == 'language':
+            # Idiomas añadidos al catálogo sin miembro propio: conjunto acotado
+            profile[field] = sys.intern(value)
+    return profile
+
+
+# ----------------- CALLBACK DATA -----------------
+UNKNOWN_ROUTE = 'unknown'
+
+
+class CallbackCodec:
+    """callback_data ⇄ (ruta, argumento)
+
+    Las familias con argumento se codifican como "<etiqueta>:<id hex>" ("e:3" en
+    lugar de "ets_detail_sifilis"); el id es la posición del valor al
+    registrarlo, así que los valores nuevos deben añadirse al final para no
+    cambiar los botones ya enviados. Los formatos antiguos con prefijo siguen
+    decodificándose.
+    """
+
+    def __init__(self):
+        self._decode: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._encode: Dict[Tuple[str, Optional[str]], str] = {}
+
+    def _add(self, data: str, target: Tuple[str, Optional[str]]):
+        if data in self._decode and self._decode[data] != target:
+            raise ValueError(f"callback_data duplicado: {data!r}")
+        if len(data.encode('utf-8')) > 64:
+            raise ValueError(f"callback_data supera 64 bytes: {data!r}")
+        self._decode[data] = target
+
+    def add_route(self, route: str):
+        self._add(route, (route, None))
+        self._encode[(route, None)] = route
+
+    def add_family(self, route: str, tag: str, values: Iterable[str], legacy_prefix: Optional[str] = None):
+        for index, value in enumerate(values):
+            data = f"{tag}:{index:x}"
+            self._add(data, (route, value))
+            self._encode[(route, value)] = data
+            if legacy_prefix is not None:
+                self._add(f"{legacy_prefix}{value}", (route, value))
+
+    def encode(self, route: str, value: Optional[str] = None) -> str:
+        return self._encode[(route, value)]
+
+    def decode(self, data: Optional[str]) -> Tuple[str, Optional[str]]:
+        return self._decode.get(data, (UNKNOWN_ROUTE, None))
@@ -5,47 +5,375 @@ Chatbot ETS Avanzado para Webhook (Render)
 Versión mejorada con funcionalidades avanzadas
 """
 
+import argparse
+import asyncio
+import contextlib
+import html
 import logging
 import os
 import json
 import re
+import time
+import weakref
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler, 
-    MessageHandler, filters, ContextTypes, ConversationHandler
+    Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, 
+    MessageHandler, filters, ContextTypes, ConversationHandler, TypeHandler, InlineQueryHandler
 )
 
-# Configurar logging más detallado
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from appointments import SlotEngine, slot_datetime
+from broadcast import Broadcast, Segment, TokenBucket, read_checkpoint
+from codes import CallbackCodec, RiskLevel, Language, compact_profile
+from lifecycle import WebhookLifecycle
+from memory_report import MemoryProfiler, subsystem_footprints, format_bytes, format_report
+from profiler import SamplingProfiler
+from rate_limiter import SlidingWindowRateLimiter, ALLOW, DELAY, WARN
+import analytics
+import printable
+import shadow
+import user_migration
+from scheduler import ReminderQueue
+from i18n import load_catalog
+from inline_search import InlineIndex
+from markup import escape
+from flows import END as FLOW_END, callback_pattern as flow_callback_pattern, load_flows
+from search import EncyclopediaIndex, SearchHit
+from symptom_index import SymptomIndex
+import personalization
+import logging_setup
+from opening_hours import DAY_NAMES, OpeningIndex, clinic_key
+from message_cache import MessageStateCache, render_hashes, UNCHANGED, MARKUP_ONLY
+
 logger = logging.getLogger(__name__)
 
 # Cargar variables de entorno
 TOKEN = os.environ.get("TELEGRAM_TOKEN")
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
-
-# Estados para conversaciones (reducidos)
-(ASKING_AGE, ASKING_GENDER, SYMPTOM_DETAIL, APPOINTMENT_BOOKING) = range(4)
+# Modo de recepción: "webhook" (Render) o "polling" (local / hosts sin URL pública)
+BOT_MODE = os.environ.get("BOT_MODE", "webhook")
+
+# Updates procesadas en paralelo (las de un mismo usuario siguen en orden)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 32))
+
+# Long polling: segundos que Telegram retiene cada getUpdates vacío y pausa entre lotes
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", 30))
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", 0))
+POLLED_UPDATE_TYPES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Usuarios con acceso a comandos de administración (ids separados por comas)
+ADMIN_IDS = frozenset(int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip())
+
+# Campañas: mensajes/s (Telegram admite ~30), envíos en paralelo y checkpoint para reanudar
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 8))
+BROADCAST_CHECKPOINT = os.environ.get("BROADCAST_CHECKPOINT", "broadcast.checkpoint.json")
+
+# Filtro "abren pronto" del listado de centros, en horas
+OPEN_SOON_HOURS = float(os.environ.get("OPEN_SOON_HOURS", 2))
+
+# Segundos que Telegram guarda cada respuesta inline; los resultados no dependen del usuario
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))
+
+# Segundos para terminar las updates en curso tras SIGTERM (Render mata a los 30s)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 25))
+
+# Bot API alternativa (p. ej. fake_bot_api.py en pruebas de carga); el token se añade detrás
+BOT_API_URL = os.environ.get("BOT_API_URL")
+
+# Control de flujo por usuario
+RATE_LIMIT_MESSAGES = int(os.environ.get("RATE_LIMIT_MESSAGES", 8))
+RATE_LIMIT_WINDOW = float(os.environ.get("RATE_LIMIT_WINDOW", 10))
+RATE_LIMIT_POLICY = os.environ.get("RATE_LIMIT_POLICY", "warn")
+RATE_LIMIT_IDLE_TTL = float(os.environ.get("RATE_LIMIT_IDLE_TTL", 300))
+
+# Analítica (sin ruta solo se agregan métricas en memoria)
+ANALYTICS_PATH = os.environ.get("ANALYTICS_PATH")
+
+# Migración de perfiles entre hosts
+USER_IMPORT_DIR = os.environ.get("USER_IMPORT_DIR")
+USER_EXPORT_DIR = os.environ.get("USER_EXPORT_DIR")
+
+# Perfilado por muestreo (/profiler): carpeta de los .folded y duración máxima de la ventana
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 300))
+
+# Evaluación en sombra: candidatos ("symptoms=modulo:funcion,chat=modulo:funcion"), fracción de
+# mensajes copiados, cola (lleno = se descarta), procesos y log de discrepancias
+SHADOW_CANDIDATES = os.environ.get("SHADOW_CANDIDATES", "")
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", 0.05))
+SHADOW_QUEUE_SIZE = int(os.environ.get("SHADOW_QUEUE_SIZE", 256))
+SHADOW_WORKERS = int(os.environ.get("SHADOW_WORKERS", 1))
+SHADOW_LOG_PATH = os.environ.get("SHADOW_LOG_PATH", "shadow.jsonl")
+
+# Resumen imprimible para la cita: procesos que renderizan y file_ids de Telegram recordados
+SUMMARY_RENDER_WORKERS = int(os.environ.get("SUMMARY_RENDER_WORKERS", 1))
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", 10000))
+
+# Tareas programadas
+SESSION_TTL_HOURS = float(os.environ.get("SESSION_TTL_HOURS", 24))
+REMINDERS_PATH = os.environ.get("REMINDERS_PATH", "reminders.journal")
+FOLLOW_UP_DAYS = int(os.environ.get("FOLLOW_UP_DAYS", 90))
+# Envío de recordatorios: ritmo propio (mensajes/s) y tiempo máximo por pasada del job
+REMINDER_RATE = float(os.environ.get("REMINDER_RATE", 10))
+REMINDER_JOB_BUDGET = float(os.environ.get("REMINDER_JOB_BUDGET", 20))
+
+# Puntuación BM25 mínima para responder desde la enciclopedia
+SEARCH_MIN_SCORE = float(os.environ.get("SEARCH_MIN_SCORE", 2.0))
+
+# Logging: formato json|text y muestreo por logger ("telegram:0.1,ets_bot:0.5")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")
+
+# Estados para conversaciones: los cuestionarios de flows/ avanzan dentro de QUESTIONNAIRE
+(QUESTIONNAIRE, APPOINTMENT_BOOKING) = range(2)
+
+# Tipos de cita: etiqueta y categoría de servicio que debe ofrecer el centro
+APPOINTMENT_TYPES = {
+    'appt_symptoms': ('Evaluación de síntomas', 'consulta'),
+    'appt_tests': ('Pruebas de ETS', 'pruebas'),
+    'appt_followup': ('Seguimiento de tratamiento', 'consulta'),
+    'appt_prevention': ('Consulta preventiva', 'consulta'),
+}
+# Posición de cada tipo en los callback_data "book:"; los tipos nuevos van al final
+APPOINTMENT_TYPE_CODES = list(APPOINTMENT_TYPES)
+
+# Base de conocimientos expandida y estructurada
+ETS_DATABASE = {
+    "clamidia": {
+        "nombre": "Clamidia",
+        "tipo": "bacteriana",
+        "prevalencia": "alta",
+        "sintomas": {
+            "comunes": ["secreción anormal", "dolor al orinar", "dolor pélvico"],
+            "hombres": ["secreción del pene", "dolor testicular"],
+            "mujeres": ["sangrado entre períodos", "dolor durante relaciones"],
+            "asintomatico": 70
+        },
+        "info": "Infección bacteriana muy común y fácilmente tratable con antibióticos.",
+        "tratamiento": "Antibióticos (azitromicina o doxiciclina)",
+        "prevencion": ["preservativos", "pruebas regulares", "pareja única"],
+        "tiempo_sintomas": "1-3 semanas después de exposición",
+        "complicaciones": ["EIP", "infertilidad", "embarazo ectópico"]
+    },
+    "gonorrea": {
+        "nombre": "Gonorrea",
+        "tipo": "bacteriana",
+        "prevalencia": "alta",
+        "sintomas": {
+            "comunes": ["secreción purulenta", "dolor intenso al orinar"],
+            "hombres": ["secreción amarilla-verdosa del pene"],
+            "mujeres": ["sangrado vaginal anormal", "dolor pélvico"],
+            "asintomatico": 50
+        },
+        "info": "Infección bacteriana que puede causar resistencia a antibióticos.",
+        "tratamiento": "Antibióticos específicos (ceftriaxona + azitromicina)",
+        "prevencion": ["preservativos", "pruebas regulares"],
+        "tiempo_sintomas": "2-7 días después de exposición",
+        "complicaciones": ["EIP", "artritis", "problemas cardíacos"]
+    },
+    "herpes": {
+        "nombre": "Herpes Genital (HSV-1/HSV-2)",
+        "tipo": "viral",
+        "prevalencia": "muy alta",
+        "sintomas": {
+            "comunes": ["ampollas dolorosas", "picazón", "ardor", "fiebre"],
+            "primer_brote": ["síntomas similares a gripe", "ganglios inflamados"],
+            "recurrencias": ["síntomas más leves", "duración menor"],
+            "asintomatico": 80
+        },
+        "info": "Infección viral crónica con brotes recurrentes, manejable con antivirales.",
+        "tratamiento": "Antivirales (aciclovir, valaciclovir)",
+        "prevencion": ["preservativos", "evitar contacto durante brotes"],
+        "tiempo_sintomas": "2-12 días después de exposición",
+        "complicaciones": ["recurrencias frecuentes", "transmisión neonatal"]
+    },
+    "vph": {
+        "nombre": "Virus del Papiloma Humano (VPH)",
+        "tipo": "viral",
+        "prevalencia": "muy alta",
+        "sintomas": {
+            "comunes": ["verrugas genitales", "a menudo asintomático"],
+            "alto_riesgo": ["cambios cervicales", "sin síntomas visibles"],
+            "bajo_riesgo": ["verrugas genitales visibles"],
+            "asintomatico": 90
+        },
+        "info": "Virus muy común, algunas cepas pueden causar cáncer cervical.",
+        "tratamiento": "Tratamiento de verrugas, seguimiento médico",
+        "prevencion": ["vacuna VPH", "preservativos", "Papanicolaou regular"],
+        "tiempo_sintomas": "semanas a años después de exposición",
+        "complicaciones": ["cáncer cervical", "cáncer genital"]
+    },
+    "sifilis": {
+        "nombre": "Sífilis",
+        "tipo": "bacteriana",
+        "prevalencia": "media",
+        "sintomas": {
+            "primaria": ["chancro indoloro", "una lesión"],
+            "secundaria": ["erupción", "fiebre", "ganglios inflamados"],
+            "latente": ["sin síntomas visibles"],
+            "terciaria": ["daño a órganos", "problemas neurológicos"],
+            "asintomatico": 30
+        },
+        "info": "Infección bacteriana que progresa en etapas si no se trata.",
+        "tratamiento": "Penicilina",
+        "prevencion": ["preservativos", "pruebas regulares"],
+        "tiempo_sintomas": "10-90 días después de exposición",
+        "complicaciones": ["daño neurológico", "problemas cardíacos", "muerte"]
+    }
+}
+
+# Sistema de evaluación de riesgo
+RISK_FACTORS = {
+    'high': {
+        'keywords': ['múltiples parejas', 'sin preservativo', 'síntomas graves', 'fiebre'],
+        'message': '🔴 **RIESGO ALTO** - Se recomienda consulta médica urgente'
+    },
+    'medium': {
+        'keywords': ['nueva pareja', 'síntomas leves', 'exposición reciente'],
+        'message': '🟡 **RIESGO MODERADO** - Considera hacerte pruebas pronto'
+    },
+    'low': {
+        'keywords': ['pareja estable', 'uso de preservativo', 'sin síntomas'],
+        'message': '🟢 **RIESGO BAJO** - Mantén prácticas seguras'
+    }
+}
+
+RISK_LABELS = {'high': 'Alto', 'medium': 'Moderado', 'low': 'Bajo'}
+
+# Centros médicos por ubicación (ejemplo México)
+MEDICAL_CENTERS = {
+    "ciudad_mexico": {
+        "nombre": "Ciudad de México",
+        "centros": [
+            {
+                "nombre": "Clínica Condesa",
+                "direccion": "Av. Insurgentes Sur 136, Roma Norte",
+                "telefono": "55-4114-4000",
+                "servicios": ["Pruebas VIH", "Pruebas ETS completas", "Consulta gratuita"],
+                "horarios": "Lun-Vie 8:00-20:00"
+            },
+            {
+                "nombre": "Centro de Salud T-III Dr. Gustavo A. Rovirosa",
+                "direccion": "Av. Universidad 1321, Del Valle",
+                "telefono": "55-5534-3428",
+                "servicios": ["Consulta general", "Pruebas básicas de ETS"],
+                "horarios": "Lun-Vie 7:00-15:00"
+            }
+        ]
+    },
+    "guadalajara": {
+        "nombre": "Guadalajara",
+        "centros": [
+            {
+                "nombre": "Clínica de VIH del Hospital Civil",
+                "direccion": "Hospital 278, Guadalajara Centro",
+                "telefono": "33-3614-7043",
+                "servicios": ["Pruebas VIH", "Consulta especializada"],
+                "horarios": "Lun-Vie 8:00-14:00"
+            }
+        ]
+    }
+}
+
+# Selector de ciudades; Monterrey aparece aunque aún no tiene centros (muestra la ayuda genérica)
+CITY_BUTTONS = {
+    "ciudad_mexico": "🏙️ Ciudad de México",
+    "guadalajara": "🌆 Guadalajara",
+    "monterrey": "🏘️ Monterrey",
+}
+
+def scoped_path(path: Optional[str], name: Optional[str]) -> Optional[str]:
+    """'reminders.journal' → 'reminders.<tenant>.journal'; sin tenant no cambia"""
+    if not path or not name:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
+
+class SharedResources:
+    """Datos de solo lectura que comparten todos los bots de un mismo proceso"""
+    def __init__(self, ets_database: Dict = ETS_DATABASE):
+        self.ets_database = ets_database
+        # Índice de búsqueda de texto libre sobre la enciclopedia
+        self.search_index = EncyclopediaIndex.build(ets_database)
+        self.symptom_index = SymptomIndex.build(ets_database)
+        self.catalog = load_catalog()
+        # Cuestionarios compilados (tablas de transiciones inmutables)
+        self.flows = load_flows()
+        self.personalization = personalization.PersonalizationTables(self.catalog)
+        # Menú principal por idioma; los teclados son inmutables
+        self.main_menus: Dict[str, InlineKeyboardMarkup] = {}
+        # Procesos que renderizan los resúmenes imprimibles (no son datos, pero tampoco hace falta un pool por bot)
+        self.render_pool = printable.RenderPool(SUMMARY_RENDER_WORKERS)
+
+class UserOrderedApplication(Application):
+    """Procesa updates de distintos usuarios en paralelo y las de cada usuario en orden
+
+    PTB ocupa un hueco de `concurrent_updates` antes de llamar a process_update;
+    ese semáforo se sustituye por uno propio que se toma después del turno del
+    usuario, para que las updates en espera de un usuario no retengan huecos.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._user_locks = weakref.WeakValueDictionary()
+        self._update_slots = self._concurrent_updates_sem
+        self._concurrent_updates_sem = contextlib.nullcontext()
+
+    async def process_update(self, update: object) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None or not self.concurrent_updates:
+            async with self._update_slots:
+                await super().process_update(update)
+            return
+        lock = self._user_locks.get(user.id)
+        if lock is None:
+            lock = self._user_locks[user.id] = asyncio.Lock()
+        # asyncio.Lock atiende en orden de llegada: primero el turno, luego un hueco
+        async with lock:
+            async with self._update_slots:
+                await super().process_update(update)
 
 class UserSessionManager:
     """Gestiona las sesiones de usuario en memoria"""
-    def __init__(self):
-        self.sessions = {}
+    def __init__(self, language: str = Language.ES):
+        self.language = compact_profile({'language': language})['language']
+        # Ordenadas por última actividad: las más antiguas quedan al frente
+        self.sessions = OrderedDict()
         self.user_data = {}
     
     def get_session(self, user_id: int) -> Dict:
+        now = datetime.now()
         if user_id not in self.sessions:
             self.sessions[user_id] = {
-                'started_at': datetime.now(),
+                'started_at': now,
                 'current_flow': None,
                 'context': {},
                 'interaction_count': 0
             }
-        return self.sessions[user_id]
+        else:
+            self.sessions.move_to_end(user_id)
+        session = self.sessions[user_id]
+        session['last_activity'] = now
+        return session
+    
+    def sweep_expired(self, max_idle: timedelta, limit: int = 500, deadline: Optional[float] = None) -> int:
+        """Elimina sesiones inactivas desde el frente; se detiene al agotar `limit` o `deadline`"""
+        cutoff = datetime.now() - max_idle
+        removed = 0
+        while self.sessions and removed < limit:
+            user_id, session = next(iter(self.sessions.items()))
+            if session.get('last_activity', session['started_at']) > cutoff:
+                break
+            del self.sessions[user_id]
+            removed += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return removed
     
     def update_session(self, user_id: int, data: Dict):
         session = self.get_session(user_id)
@@ -57,168 +385,155 @@ class UserSessionManager:
             self.user_data[user_id] = {
                 'age': None,
                 'gender': None,
-                'risk_level': 'unknown',
+                'risk_level': RiskLevel.UNKNOWN,
                 'last_symptoms': [],
                 'preferences': {},
-                'language': 'es'
+                'language': self.language,
+                'language_checked': False
             }
+            self.user_data[user_id]['profile_key'] = personalization.profile_key(self.user_data[user_id])
         return self.user_data[user_id]
+    
+    def update_profile(self, user_id: int, **changes) -> Dict:
+        """Actualiza el perfil y recalcula su clave de personalización"""
+        user_data = self.get_user_data(user_id)
+        user_data.update(compact_profile(changes))
+        user_data['profile_key'] = personalization.profile_key(user_data)
+        return user_data
+    
+    def iter_records(self):
+        """Recorre perfiles y sesiones como registros serializables, sin copiarlos"""
+        for user_id, profile in self.user_data.items():
+            yield {'user_id': user_id, 'profile': profile, 'session': self.sessions.get(user_id)}
+        for user_id, session in self.sessions.items():
+            if user_id not in self.user_data:
+                yield {'user_id': user_id, 'profile': None, 'session': session}
+    
+    def restore_record(self, record: Dict):
+        user_id = record['user_id']
+        if record.get('profile') is not None:
+            profile = compact_profile(record['profile'])
+            profile['profile_key'] = personalization.profile_key(profile)
+            self.user_data[user_id] = profile
+        if record.get('session') is not None:
+            self.sessions[user_id] = record['session']
 
 class ETSBotAdvanced:
-    def __init__(self, token):
+    def __init__(self, token, base_url: Optional[str] = BOT_API_URL,
+                 concurrent_updates: int = CONCURRENT_UPDATES, shared: Optional[SharedResources] = None,
+                 name: Optional[str] = None, language: Optional[str] = None,
+                 medical_centers: Optional[Dict] = None):
         self.token = token
-        self.application = ApplicationBuilder().token(token).build()
-        self.session_manager = UserSessionManager()
-
-        # Base de conocimientos expandida y estructurada
-        self.ets_database = {
-            "clamidia": {
-                "nombre": "Clamidia",
-                "tipo": "bacteriana",
-                "prevalencia": "alta",
-                "sintomas": {
-                    "comunes": ["secreción anormal", "dolor al orinar", "dolor pélvico"],
-                    "hombres": ["secreción del pene", "dolor testicular"],
-                    "mujeres": ["sangrado entre períodos", "dolor durante relaciones"],
-                    "asintomatico": 70
-                },
-                "info": "Infección bacteriana muy común y fácilmente tratable con antibióticos.",
-                "tratamiento": "Antibióticos (azitromicina o doxiciclina)",
-                "prevencion": ["preservativos", "pruebas regulares", "pareja única"],
-                "tiempo_sintomas": "1-3 semanas después de exposición",
-                "complicaciones": ["EIP", "infertilidad", "embarazo ectópico"]
-            },
-            "gonorrea": {
-                "nombre": "Gonorrea",
-                "tipo": "bacteriana",
-                "prevalencia": "alta",
-                "sintomas": {
-                    "comunes": ["secreción purulenta", "dolor intenso al orinar"],
-                    "hombres": ["secreción amarilla-verdosa del pene"],
-                    "mujeres": ["sangrado vaginal anormal", "dolor pélvico"],
-                    "asintomatico": 50
-                },
-                "info": "Infección bacteriana que puede causar resistencia a antibióticos.",
-                "tratamiento": "Antibióticos específicos (ceftriaxona + azitromicina)",
-                "prevencion": ["preservativos", "pruebas regulares"],
-                "tiempo_sintomas": "2-7 días después de exposición",
-                "complicaciones": ["EIP", "artritis", "problemas cardíacos"]
-            },
-            "herpes": {
-                "nombre": "Herpes Genital (HSV-1/HSV-2)",
-                "tipo": "viral",
-                "prevalencia": "muy alta",
-                "sintomas": {
-                    "comunes": ["ampollas dolorosas", "picazón", "ardor", "fiebre"],
-                    "primer_brote": ["síntomas similares a gripe", "ganglios inflamados"],
-                    "recurrencias": ["síntomas más leves", "duración menor"],
-                    "asintomatico": 80
-                },
-                "info": "Infección viral crónica con brotes recurrentes, manejable con antivirales.",
-                "tratamiento": "Antivirales (aciclovir, valaciclovir)",
-                "prevencion": ["preservativos", "evitar contacto durante brotes"],
-                "tiempo_sintomas": "2-12 días después de exposición",
-                "complicaciones": ["recurrencias frecuentes", "transmisión neonatal"]
-            },
-            "vph": {
-                "nombre": "Virus del Papiloma Humano (VPH)",
-                "tipo": "viral",
-                "prevalencia": "muy alta",
-                "sintomas": {
-                    "comunes": ["verrugas genitales", "a menudo asintomático"],
-                    "alto_riesgo": ["cambios cervicales", "sin síntomas visibles"],
-                    "bajo_riesgo": ["verrugas genitales visibles"],
-                    "asintomatico": 90
-                },
-                "info": "Virus muy común, algunas cepas pueden causar cáncer cervical.",
-                "tratamiento": "Tratamiento de verrugas, seguimiento médico",
-                "prevencion": ["vacuna VPH", "preservativos", "Papanicolaou regular"],
-                "tiempo_sintomas": "semanas a años después de exposición",
-                "complicaciones": ["cáncer cervical", "cáncer genital"]
-            },
-            "sifilis": {
-                "nombre": "Sífilis",
-                "tipo": "bacteriana",
-                "prevalencia": "media",
-                "sintomas": {
-                    "primaria": ["chancro indoloro", "una lesión"],
-                    "secundaria": ["erupción", "fiebre", "ganglios inflamados"],
-                    "latente": ["sin síntomas visibles"],
-                    "terciaria": ["daño a órganos", "problemas neurológicos"],
-                    "asintomatico": 30
-                },
-                "info": "Infección bacteriana que progresa en etapas si no se trata.",
-                "tratamiento": "Penicilina",
-                "prevencion": ["preservativos", "pruebas regulares"],
-                "tiempo_sintomas": "10-90 días después de exposición",
-                "complicaciones": ["daño neurológico", "problemas cardíacos", "muerte"]
-            }
+        # Nombre del tenant cuando varios bots comparten proceso; separa sus ficheros de estado
+        self.name = name
+        builder = (
+            ApplicationBuilder()
+            .token(token)
+            .application_class(UserOrderedApplication)
+            .concurrent_updates(concurrent_updates)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+        )
+        if base_url:
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
+        
+        self.shared = shared or SharedResources()
+        self.catalog = self.shared.catalog
+        self.flows = self.shared.flows
+        self.personalization = self.shared.personalization
+        self.ets_database = self.shared.ets_database
+        self.search_index = self.shared.search_index
+        self.symptom_index = self.shared.symptom_index
+        self.main_menus = self.shared.main_menus
+        self.render_pool = self.shared.render_pool
+        # Los file_id solo valen para el bot que subió el archivo
+        self.summary_files = printable.FileIdCache(SUMMARY_CACHE_SIZE)
+        # Idioma para quien no trae uno soportado por el catálogo
+        self.language = self.catalog.resolve(language)
+        
+        self.session_manager = UserSessionManager(self.language)
+        self.message_cache = MessageStateCache()
+        self.rate_limiter = SlidingWindowRateLimiter(
+            max_events=RATE_LIMIT_MESSAGES,
+            window=RATE_LIMIT_WINDOW,
+            policy=RATE_LIMIT_POLICY,
+            idle_ttl=RATE_LIMIT_IDLE_TTL
+        )
+        # update_id → (temporizador, update) de las diferidas por la política 'delay'
+        self._deferred_updates: Dict[int, tuple] = {}
+        self.analytics = analytics.AnalyticsLog(scoped_path(ANALYTICS_PATH, name))
+        self.reminders = ReminderQueue(scoped_path(REMINDERS_PATH, name))
+        self.reminder_bucket = TokenBucket(REMINDER_RATE)
+        self.broadcast_checkpoint = scoped_path(BROADCAST_CHECKPOINT, name)
+        self.import_dir = os.path.join(USER_IMPORT_DIR, name) if USER_IMPORT_DIR and name else USER_IMPORT_DIR
+        self.export_dir = os.path.join(USER_EXPORT_DIR, name) if USER_EXPORT_DIR and name else USER_EXPORT_DIR
+        self.memory_profiler = MemoryProfiler()
+        self.sampling_profiler = SamplingProfiler()
+        self.profile_task: Optional[asyncio.Task] = None
+        self.profile_dir = os.path.join(PROFILE_DIR, name) if name else PROFILE_DIR
+        self.shadow_runner = shadow.ShadowRunner(
+            shadow.parse_candidates(SHADOW_CANDIDATES),
+            sample_rate=SHADOW_SAMPLE_RATE,
+            queue_size=SHADOW_QUEUE_SIZE,
+            workers=SHADOW_WORKERS,
+            log_path=scoped_path(SHADOW_LOG_PATH, name)
+        )
+        self.broadcast: Optional[Broadcast] = None
+        self.broadcast_task: Optional[asyncio.Task] = None
+
+        self.risk_factors = RISK_FACTORS
+        # Centros médicos por ubicación; cada tenant puede tener los suyos
+        self.medical_centers = MEDICAL_CENTERS if medical_centers is None else medical_centers
+        self.city_buttons = CITY_BUTTONS if medical_centers is None else {
+            city: f"🏙️ {city_data['nombre']}" for city, city_data in medical_centers.items()
         }
 
-        # Sistema de evaluación de riesgo
-        self.risk_factors = {
-            'high': {
-                'keywords': ['múltiples parejas', 'sin preservativo', 'síntomas graves', 'fiebre'],
-                'message': '🔴 **RIESGO ALTO** - Se recomienda consulta médica urgente'
-            },
-            'medium': {
-                'keywords': ['nueva pareja', 'síntomas leves', 'exposición reciente'],
-                'message': '🟡 **RIESGO MODERADO** - Considera hacerte pruebas pronto'
-            },
-            'low': {
-                'keywords': ['pareja estable', 'uso de preservativo', 'sin síntomas'],
-                'message': '🟢 **RIESGO BAJO** - Mantén prácticas seguras'
-            }
-        }
+        # Turnos de cita por centro, generados a partir de sus horarios
+        self.appointments = SlotEngine.from_medical_centers(self.medical_centers)
+        self.opening_hours = OpeningIndex.from_medical_centers(self.medical_centers)
+        # Modo inline: "@bot sífilis", "@bot clínica guadalajara"
+        self.inline_index = InlineIndex.build(self.ets_database, self.medical_centers)
 
-        # Centros médicos por ubicación (ejemplo México)
-        self.medical_centers = {
-            "ciudad_mexico": {
-                "nombre": "Ciudad de México",
-                "centros": [
-                    {
-                        "nombre": "Clínica Condesa",
-                        "direccion": "Av. Insurgentes Sur 136, Roma Norte",
-                        "telefono": "55-4114-4000",
-                        "servicios": ["Pruebas VIH", "Pruebas ETS completas", "Consulta gratuita"],
-                        "horarios": "Lun-Vie 8:00-20:00"
-                    },
-                    {
-                        "nombre": "Centro de Salud T-III Dr. Gustavo A. Rovirosa",
-                        "direccion": "Av. Universidad 1321, Del Valle",
-                        "telefono": "55-5534-3428",
-                        "servicios": ["Consulta general", "Pruebas básicas de ETS"],
-                        "horarios": "Lun-Vie 7:00-15:00"
-                    }
-                ]
-            },
-            "guadalajara": {
-                "nombre": "Guadalajara",
-                "centros": [
-                    {
-                        "nombre": "Clínica de VIH del Hospital Civil",
-                        "direccion": "Hospital 278, Guadalajara Centro",
-                        "telefono": "33-3614-7043",
-                        "servicios": ["Pruebas VIH", "Consulta especializada"],
-                        "horarios": "Lun-Vie 8:00-14:00"
-                    }
-                ]
-            }
+        # Rutas de callback y formato compacto de callback_data
+        self.callback_handlers = {
+            "menu": self.show_main_menu_callback,
+            "encyclopedia": self.show_encyclopedia,
+            "test_guide": self.show_test_guide,
+            "find_centers": self.show_location_options,
+            "emergency": self.show_emergency_info,
+            "quick_symptoms": self.show_quick_symptoms,
+            "free_chat": self.show_free_chat_info,
+            "profile": self.show_profile_callback,
+            "skip_setup": self.show_main_menu_callback,
+            "cancel_appointment": self.cancel_appointment,
+            "appointment_summary": self.send_appointment_summary
         }
+        # Qué hacer con las respuestas de cada cuestionario al completarlo
+        self.flow_completions = {'assessment': self.complete_assessment}
+        self.callbacks = CallbackCodec()
+        for route in self.callback_handlers:
+            self.callbacks.add_route(route)
+        self.callbacks.add_family("ets_detail", "e", self.ets_database, legacy_prefix="ets_detail_")
+        self.callbacks.add_family("city", "c", self.city_buttons, legacy_prefix="city_")
+        self.callbacks.add_family("rating", "r", ("1", "2", "3", "4", "5"), legacy_prefix="rating_")
+        self.callbacks.add_family("open_now", "o", self.medical_centers)
+        self.callbacks.add_family("open_soon", "s", self.medical_centers)
 
         # Configurar conversación estructurada
         conv_handler = ConversationHandler(
             entry_points=[
-                CallbackQueryHandler(self.start_assessment, pattern="^full_assessment$"),
-                CallbackQueryHandler(self.start_appointment, pattern="^book_appointment$")
+                CallbackQueryHandler(self.start_assessment, pattern="^(full_assessment|setup_profile)$"),
+                CallbackQueryHandler(self.start_appointment, pattern="^book_appointment$"),
+                # Turnos mostrados antes de un reinicio siguen siendo reservables
+                CallbackQueryHandler(self.handle_appointment, pattern="^book:")
             ],
             states={
-                ASKING_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_age)],
-                ASKING_GENDER: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_gender),
-                    CallbackQueryHandler(self.collect_gender)
+                QUESTIONNAIRE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.throttled(self.handle_flow_step)),
+                    # Solo opciones de cuestionario; el resto de botones sigue al handler global
+                    CallbackQueryHandler(self.handle_flow_step, pattern=flow_callback_pattern(self.flows))
                 ],
-                SYMPTOM_DETAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_symptoms)],
                 APPOINTMENT_BOOKING: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_appointment),
                     CallbackQueryHandler(self.handle_appointment)
@@ -228,29 +543,152 @@ class ETSBotAdvanced:
         )
 
         # Configurar handlers
+        self.application.add_handler(TypeHandler(Update, self.bind_log_context), group=-1)
         self.application.add_handler(conv_handler)
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("perfil", self.profile_command))
         self.application.add_handler(CommandHandler("ayuda", self.help_command))
         self.application.add_handler(CommandHandler("emergencia", self.emergency))
-        self.application.add_handler(CallbackQueryHandler(self.handle_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        self.application.add_handler(CommandHandler("memoria", self.memory_command))
+        self.application.add_handler(CommandHandler("profiler", self.profiler_command))
+        self.application.add_handler(CommandHandler("sombra", self.shadow_command))
+        self.application.add_handler(CommandHandler("campana", self.campaign_command))
+        self.application.add_handler(CallbackQueryHandler(self.throttled(self.handle_callback)))
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.throttled(self.handle_text)))
         self.application.add_handler(MessageHandler(filters.LOCATION, self.handle_location))
+        # Sin rate limit: cada pulsación de tecla es una consulta y descartarla deja resultados viejos
+        self.application.add_handler(InlineQueryHandler(self.handle_inline_query))
+        
+        self.setup_jobs()
+
+    # ----------------- CONTROL DE FLUJO -----------------
+    async def bind_log_context(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Asocia los logs de esta update a su usuario; el texto recibido se redacta"""
+        user = update.effective_user
+        message = update.effective_message
+        logging_setup.set_update_context(
+            user.id if user else None,
+            update.update_id,
+            message.text if message else None
+        )
+
+    def throttled(self, handler):
+        """Aplica el rate limit por usuario antes de ejecutar el handler"""
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user
+            if user is None:
+                return await handler(update, context)
+
+            # Updates diferidas por la política 'delay': cuentan ahora, en la ventana en que corren
+            if self._deferred_updates.pop(update.update_id, None) is not None:
+                self.rate_limiter.release(user.id)
+                return await handler(update, context)
+
+            action, wait = self.rate_limiter.check(user.id)
+            if action == ALLOW:
+                return await handler(update, context)
+
+            if action == DELAY:
+                # Reencolar sin bloquear el procesamiento de otros usuarios
+                timer = asyncio.get_running_loop().call_later(
+                    wait, context.application.update_queue.put_nowait, update
+                )
+                self._deferred_updates[update.update_id] = (timer, update)
+            elif action == WARN:
+                await self.send_rate_limit_warning(update)
+
+            logger.debug("Update %s de %s limitada (%s)", update.update_id, user.id, action)
+            # None mantiene el estado actual dentro de ConversationHandler
+            return None
+
+        return wrapper
+
+    async def prepare_shutdown(self):
+        """Antes de drenar: libera las updates diferidas y pausa la campaña en curso"""
+        await self.release_deferred_updates()
+        await self.stop_broadcast()
+        await self.stop_profiling()
+        await self.shadow_runner.stop()
+
+    async def release_deferred_updates(self):
+        """Encola ya las updates diferidas para que entren en el drenado de la parada"""
+        loop = asyncio.get_running_loop()
+        for timer, update in list(self._deferred_updates.values()):
+            # Las que ya vencieron están en la cola
+            if timer.when() > loop.time():
+                timer.cancel()
+                self.application.update_queue.put_nowait(update)
+
+    async def send_rate_limit_warning(self, update: Update):
+        language = self.session_manager.get_user_data(update.effective_user.id).get('language')
+        text = self.catalog.text(language, 'rate_limit.warning')
+        if update.callback_query:
+            await update.callback_query.answer(text)
+        elif update.effective_message:
+            await update.effective_message.reply_text(text)
+
+    # ----------------- EDICIÓN INCREMENTAL DE MENSAJES -----------------
+    async def edit_message(self, query, text: str, parse_mode: Optional[str] = None, reply_markup=None):
+        """Edita el mensaje del callback solo si el texto o el teclado cambiaron"""
+        message = query.message
+        if message is None:
+            # Mensajes de modo inline: no hay chat_id/message_id para seguir su estado
+            await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+            return
+        
+        text_hash, markup_hash = render_hashes(text, parse_mode, reply_markup)
+        state = self.message_cache.compare(message.chat_id, message.message_id, text_hash, markup_hash)
+        stats = self.message_cache.stats
+        
+        if state == UNCHANGED:
+            stats['skipped'] += 1
+            return
+        
+        try:
+            if state == MARKUP_ONLY:
+                stats['markup_edits'] += 1
+                await query.edit_message_reply_markup(reply_markup=reply_markup)
+            else:
+                stats['edits'] += 1
+                await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+            stats['not_modified_errors'] += 1
+        
+        self.message_cache.remember(message.chat_id, message.message_id, text_hash, markup_hash)
+
+    def remember_sent(self, message, text: str, parse_mode: Optional[str] = None, reply_markup=None):
+        """Registra el render de un mensaje recién enviado para futuras ediciones"""
+        self.message_cache.remember(message.chat_id, message.message_id,
+                                    *render_hashes(text, parse_mode, reply_markup))
 
     # ----------------- MENÚS Y RESPUESTAS MEJORADOS -----------------
     def get_main_menu(self, user_id: int = None):
         user_data = self.session_manager.get_user_data(user_id) if user_id else {}
+        return self.get_main_menu_for_language(user_data.get('language') or self.language)
+
+    def get_main_menu_for_language(self, language: str):
+        menu = self.main_menus.get(language)
+        if menu is None:
+            menu = self.main_menus[language] = self.build_main_menu(language)
+        return menu
+
+    def build_main_menu(self, language: str):
+        messages = self.catalog.pack(language).messages
+        
+        def button(action):
+            return InlineKeyboardButton(messages[f'menu.{action}'].render(), callback_data=action)
         
         keyboard = [
-            [InlineKeyboardButton("🎯 Evaluación Completa", callback_data="full_assessment")],
-            [InlineKeyboardButton("🔍 Síntomas Rápidos", callback_data="quick_symptoms")],
-            [InlineKeyboardButton("📚 Enciclopedia ETS", callback_data="encyclopedia")],
-            [InlineKeyboardButton("🧪 Guía de Pruebas", callback_data="test_guide")],
-            [InlineKeyboardButton("🏥 Encontrar Centros", callback_data="find_centers")],
-            [InlineKeyboardButton("📅 Agendar Cita", callback_data="book_appointment")],
-            [InlineKeyboardButton("💬 Chat Libre", callback_data="free_chat")],
-            [InlineKeyboardButton("⚙️ Mi Perfil", callback_data="profile"), 
-             InlineKeyboardButton("🆘 Emergencia", callback_data="emergency")]
+            [button("full_assessment")],
+            [button("quick_symptoms")],
+            [button("encyclopedia")],
+            [button("test_guide")],
+            [button("find_centers")],
+            [button("book_appointment")],
+            [button("free_chat")],
+            [button("profile"), button("emergency")]
         ]
         return InlineKeyboardMarkup(keyboard)
 
@@ -269,56 +707,62 @@ class ETSBotAdvanced:
         
         # Actualizar sesión
         self.session_manager.update_session(user_id, {'current_flow': 'main_menu'})
+        # Volver a escribir /start implica que desbloqueó el bot
+        self.session_manager.get_user_data(user_id).pop('blocked', None)
         
-        welcome_text = f"""
-🏥 **¡Hola {user.first_name}!** Bienvenido/a a tu Asistente Inteligente de Salud Sexual
-
-🤖 **Funciones Avanzadas:**
-• Evaluación personalizada de síntomas
-• Recomendaciones basadas en tu perfil
-• Localización de centros médicos
-• Seguimiento de tu salud sexual
-
-🔒 **100% Privado y Confidencial**
-⚠️ **Complementa, no reemplaza la consulta médica**
-🆘 **Emergencias: 911**
-
-*¿Es tu primera vez? Te haré algunas preguntas básicas para personalizar la experiencia.*
-        """
+        # Idioma inicial según Telegram; el primer mensaje de texto puede refinarlo
+        user_data = self.session_manager.get_user_data(user_id)
+        if not user_data.get('language_checked'):
+            self.session_manager.update_profile(user_id, language=self.catalog.resolve(user.language_code, self.language))
+        language = user_data['language']
+        
+        welcome_text = self.catalog.text(language, 'start.welcome', first_name=user.first_name)
         
         # Verificar si es usuario nuevo
-        user_data = self.session_manager.get_user_data(user_id)
         if not user_data.get('age'):
             keyboard = [
-                [InlineKeyboardButton("✅ Configurar mi perfil", callback_data="setup_profile")],
-                [InlineKeyboardButton("⏭️ Saltar por ahora", callback_data="skip_setup")]
+                [InlineKeyboardButton(self.catalog.text(language, 'start.setup_profile'), callback_data="setup_profile")],
+                [InlineKeyboardButton(self.catalog.text(language, 'start.skip_setup'), callback_data="skip_setup")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
         else:
             reply_markup = self.get_main_menu(user_id)
             
-        await update.message.reply_text(
+        message = await update.message.reply_text(
             welcome_text,
-            parse_mode='Markdown',
+            parse_mode=self.catalog.parse_mode,
             reply_markup=reply_markup
         )
+        self.remember_sent(message, welcome_text, self.catalog.parse_mode, reply_markup)
 
     async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
+        profile_text, reply_markup = self.get_profile_view(update.effective_user.id)
+        await update.message.reply_text(
+            profile_text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+
+    async def show_profile_callback(self, query):
+        profile_text, reply_markup = self.get_profile_view(query.from_user.id)
+        await self.edit_message(query, profile_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+    def get_profile_view(self, user_id: int):
         user_data = self.session_manager.get_user_data(user_id)
         session = self.session_manager.get_session(user_id)
         
+        # Género personalizado y síntomas son texto del usuario: se escapan para no romper el Markdown
         profile_text = f"""
 👤 **Mi Perfil de Salud Sexual**
 
 **Información básica:**
 • Edad: {user_data.get('age', 'No especificada')}
-• Género: {user_data.get('gender', 'No especificado')}
+• Género: {escape(user_data.get('gender', 'No especificado'))}
 • Nivel de riesgo: {user_data.get('risk_level', 'Por evaluar')}
 
 **Actividad:**
 • Interacciones: {session.get('interaction_count', 0)}
-• Última consulta: {user_data.get('last_symptoms', ['Ninguna'])[0] if user_data.get('last_symptoms') else 'Ninguna'}
+• Última consulta: {escape(user_data['last_symptoms'][0]) if user_data.get('last_symptoms') else 'Ninguna'}
 
 **Recomendaciones personalizadas:**
 {self.get_personalized_recommendations(user_data)}
@@ -327,150 +771,76 @@ class ETSBotAdvanced:
         keyboard = [
             [InlineKeyboardButton("✏️ Editar perfil", callback_data="edit_profile")],
             [InlineKeyboardButton("📊 Ver estadísticas", callback_data="view_stats")],
+            [InlineKeyboardButton("📄 Resumen para el médico", callback_data="appointment_summary")],
             [InlineKeyboardButton("🏠 Menú principal", callback_data="menu")]
         ]
-        
-        await update.message.reply_text(
-            profile_text,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        return profile_text, InlineKeyboardMarkup(keyboard)
 
     def get_personalized_recommendations(self, user_data: Dict) -> str:
-        age = user_data.get('age', 0)
-        risk_level = user_data.get('risk_level', 'unknown')
-        
-        recommendations = []
-        
-        if age and age < 25:
-            recommendations.append("• Vacuna VPH recomendada")
-        if risk_level == 'high':
-            recommendations.append("• Pruebas cada 3-6 meses")
-        elif risk_level == 'medium':
-            recommendations.append("• Pruebas anuales recomendadas")
-        else:
-            recommendations.append("• Pruebas según actividad sexual")
-            
-        recommendations.append("• Uso consistente de preservativos")
-        
-        return "\n".join(recommendations) if recommendations else "• Mantén prácticas sexuales seguras"
+        return self.personalization.recommendations[self.personalization.key_for(user_data)]
 
-    # ----------------- EVALUACIÓN AVANZADA DE SÍNTOMAS -----------------
-    async def start_assessment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        query = update.callback_query
-        await query.answer()
-        
+    # ----------------- CUESTIONARIOS -----------------
+    async def start_flow(self, query, name: str):
+        """Empieza un cuestionario de flows/, saltando lo que el perfil ya tiene"""
         user_id = query.from_user.id
-        user_data = self.session_manager.get_user_data(user_id)
-        
-        if not user_data.get('age'):
-            text = """
-📝 **Evaluación Completa de Salud Sexual**
-
-Para brindarte la mejor orientación, necesito conocer algunos datos básicos.
-
-*Esta información es completamente confidencial y se usa solo para personalizar las recomendaciones.*
-
-**Pregunta 1/3:** ¿Cuál es tu edad?
-(Escribe solo el número)
-            """
-            await query.edit_message_text(text, parse_mode='Markdown')
-            return ASKING_AGE
-        else:
-            return await self.start_symptom_collection(query)
-
-    async def collect_age(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        age_text = update.message.text.strip()
-        
-        try:
-            age = int(age_text)
-            if 13 <= age <= 100:  # Rango válido
-                user_data = self.session_manager.get_user_data(user_id)
-                user_data['age'] = age
-                
-                text = """
-✅ **Edad registrada**
-
-**Pregunta 2/3:** ¿Cuál es tu género?
-
-Selecciona una opción o escribe tu respuesta:
-                """
-                keyboard = [
-                    [InlineKeyboardButton("👨 Masculino", callback_data="gender_male")],
-                    [InlineKeyboardButton("👩 Femenino", callback_data="gender_female")],
-                    [InlineKeyboardButton("🏳️‍⚧️ No binario", callback_data="gender_nonbinary")],
-                    [InlineKeyboardButton("✏️ Otro (escribir)", callback_data="gender_other")]
-                ]
-                await update.message.reply_text(
-                    text, 
-                    parse_mode='Markdown', 
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-                return ASKING_GENDER
-            else:
-                await update.message.reply_text(
-                    "⚠️ Por favor, ingresa una edad válida (13-100 años):"
-                )
-                return ASKING_AGE
-        except ValueError:
-            await update.message.reply_text(
-                "⚠️ Por favor, ingresa solo números para tu edad:"
-            )
-            return ASKING_AGE
-
-    async def collect_gender(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        flow = self.flows[name]
+        state, answers = flow.begin(self.session_manager.get_user_data(user_id))
+        if state == FLOW_END:
+            return await self.flow_completions[name](query.message, user_id, flow.results(answers))
+        # Progreso compacto: [cuestionario, estado, vector de respuestas]
+        self.session_manager.get_session(user_id)['questionnaire'] = [name, state, answers]
+        step = flow.step(state)
+        await self.edit_message(query, step.text, parse_mode=flow.parse_mode, reply_markup=step.keyboard)
+        return QUESTIONNAIRE
+
+    async def handle_flow_step(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Un paso de cualquier cuestionario: validar, guardar y pasar a la pregunta siguiente"""
         user_id = update.effective_user.id
-        
-        if update.callback_query:
-            query = update.callback_query
+        query = update.callback_query
+        if query:
             await query.answer()
-            
-            gender_map = {
-                'gender_male': 'Masculino',
-                'gender_female': 'Femenino', 
-                'gender_nonbinary': 'No binario',
-                'gender_other': 'other_input'
-            }
-            
-            if query.data == 'gender_other':
-                await query.edit_message_text(
-                    "✏️ **Género personalizado**\n\nEscribe cómo te identificas:"
-                )
-                return ASKING_GENDER
-            else:
-                user_data = self.session_manager.get_user_data(user_id)
-                user_data['gender'] = gender_map[query.data]
-                return await self.start_symptom_collection(query)
+        session = self.session_manager.get_session(user_id)
+        progress = session.get('questionnaire')
+        if not progress:
+            # Sesión expirada a mitad de cuestionario
+            return ConversationHandler.END
+        name, state, answers = progress
+        flow = self.flows[name]
+        profile = self.session_manager.get_user_data(user_id)
+        if query:
+            transition = flow.advance(state, answers, profile, data=query.data)
         else:
-            # Input de texto para género personalizado
-            user_data = self.session_manager.get_user_data(user_id)
-            user_data['gender'] = update.message.text.strip()
-            
-            text = "✅ **Perfil configurado**\n\nAhora, describe tus síntomas o preocupaciones:"
-            await update.message.reply_text(text, parse_mode='Markdown')
-            return SYMPTOM_DETAIL
-
-    async def start_symptom_collection(self, query):
-        text = """
-✅ **Perfil configurado**
-
-**Pregunta 3/3:** Describe detalladamente tus síntomas o preocupaciones:
-
-Puedes mencionar:
-• Síntomas específicos que experimentas
-• Cuándo comenzaron
-• Situaciones de riesgo recientes
-• Cualquier otra preocupación
+            transition = flow.advance(state, answers, profile, text=update.message.text)
+        if transition.error:
+            await update.message.reply_text(transition.error)
+            return QUESTIONNAIRE
+        if transition.state == state:
+            # Botón que no pertenece a la pregunta actual
+            return QUESTIONNAIRE
+
+        step = transition.step
+        if step.profile and transition.value is not None:
+            self.session_manager.update_profile(user_id, **{step.field: transition.value})
+        if transition.state == FLOW_END:
+            del session['questionnaire']
+            return await self.flow_completions[name](update.effective_message, user_id, flow.results(answers))
+
+        progress[1] = transition.state
+        next_step = flow.step(transition.state)
+        if query:
+            await self.edit_message(query, next_step.text, parse_mode=flow.parse_mode, reply_markup=next_step.keyboard)
+        else:
+            await update.message.reply_text(next_step.text, parse_mode=flow.parse_mode, reply_markup=next_step.keyboard)
+        return QUESTIONNAIRE
 
-*Sé lo más específico/a posible para una mejor evaluación.*
-        """
-        await query.edit_message_text(text, parse_mode='Markdown')
-        return SYMPTOM_DETAIL
+    # ----------------- EVALUACIÓN AVANZADA DE SÍNTOMAS -----------------
+    async def start_assessment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        return await self.start_flow(query, 'assessment')
 
-    async def collect_symptoms(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        symptoms_text = update.message.text.lower()
+    async def complete_assessment(self, message, user_id: int, answers: Dict):
+        symptoms_text = answers['symptoms']
         
         # Guardar síntomas
         user_data = self.session_manager.get_user_data(user_id)
@@ -479,7 +849,20 @@ Puedes mencionar:
         # Análisis inteligente de síntomas
         analysis = self.analyze_symptoms_advanced(symptoms_text, user_data)
         risk_level = analysis['risk_level']
-        user_data['risk_level'] = risk_level
+        self.session_manager.update_profile(user_id, risk_level=risk_level, last_assessment={
+            'at': int(time.time()),
+            'risk_level': risk_level,
+            'conditions': analysis['possible_conditions'],
+            'recommendations': analysis['recommendations']
+        })
+        self.analytics.record(analytics.RISK, user_id, risk_level, analytics.RISK_SCORES[risk_level])
+        self.shadow_runner.offer(shadow.SYMPTOMS, symptoms_text, user_data,
+                                 {'risk_level': risk_level, 'conditions': analysis['conditions']})
+        
+        # Seguimiento para usuarios de alto riesgo ("Repetir en 3 meses")
+        if risk_level == 'high':
+            due = time.time() + FOLLOW_UP_DAYS * 86400
+            self.reminders.schedule(user_id, 'seguimiento', due)
         
         response_text = f"""
 🔍 **Análisis de Síntomas Completado**
@@ -503,7 +886,7 @@ Puedes mencionar:
             [InlineKeyboardButton("🏠 Menú principal", callback_data="menu")]
         ]
         
-        await update.message.reply_text(
+        await message.reply_text(
             response_text,
             parse_mode='Markdown',
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -511,14 +894,14 @@ Puedes mencionar:
         
         # Solicitar feedback
         feedback_keyboard = [
-            [InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data="rating_5")],
-            [InlineKeyboardButton("⭐⭐⭐⭐", callback_data="rating_4")],
-            [InlineKeyboardButton("⭐⭐⭐", callback_data="rating_3")],
-            [InlineKeyboardButton("⭐⭐", callback_data="rating_2")],
-            [InlineKeyboardButton("⭐", callback_data="rating_1")]
+            [InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data=self.callbacks.encode("rating", "5"))],
+            [InlineKeyboardButton("⭐⭐⭐⭐", callback_data=self.callbacks.encode("rating", "4"))],
+            [InlineKeyboardButton("⭐⭐⭐", callback_data=self.callbacks.encode("rating", "3"))],
+            [InlineKeyboardButton("⭐⭐", callback_data=self.callbacks.encode("rating", "2"))],
+            [InlineKeyboardButton("⭐", callback_data=self.callbacks.encode("rating", "1"))]
         ]
         
-        await update.message.reply_text(
+        await message.reply_text(
             "💭 **¿Qué tan útil fue esta evaluación?**",
             reply_markup=InlineKeyboardMarkup(feedback_keyboard)
         )
@@ -573,34 +956,34 @@ Puedes mencionar:
         
         # Recomendaciones específicas basadas en síntomas
         recommendations = []
-        possible_conditions = []
         
         if 'dolor' in found_symptoms:
             recommendations.append("• Evita automedicarte con antibióticos")
             recommendations.append("• Mantén buena higiene íntima")
-            possible_conditions.extend(["Clamidia", "Gonorrea", "ITU"])
         
         if 'secrecion' in found_symptoms:
             recommendations.append("• Observa color, olor y consistencia")
             recommendations.append("• Evita duchas vaginales")
-            possible_conditions.extend(["Clamidia", "Gonorrea", "Tricomoniasis"])
         
         if 'lesiones' in found_symptoms:
             recommendations.append("• No toques las lesiones")
             recommendations.append("• Evita contacto sexual hasta diagnóstico")
-            possible_conditions.extend(["Herpes genital", "Sífilis", "VPH"])
+        
+        # Condiciones candidatas según los síntomas de la base de conocimientos
+        conditions = self.symptom_index.condition_names(symptoms_text, user_data.get('gender'), k=3)
         
         if not recommendations:
             recommendations = ["• Consulta médica para evaluación completa", "• Mantén prácticas sexuales seguras"]
         
-        if not possible_conditions:
-            possible_conditions = ["Evaluación médica necesaria para diagnóstico"]
+        possible_conditions = conditions or ["Evaluación médica necesaria para diagnóstico"]
         
         return {
             'risk_level': risk_level,
             'assessment': assessment,
             'recommendations': '\n'.join(recommendations[:3]),  # Máximo 3 recomendaciones
-            'possible_conditions': ', '.join(list(set(possible_conditions))[:3])  # Máximo 3 condiciones únicas
+            'possible_conditions': ', '.join(possible_conditions),
+            # Tal cual salen del índice, para comparar versiones del análisis
+            'conditions': conditions
         }
 
     # ----------------- LOCALIZACIÓN DE CENTROS MÉDICOS -----------------
@@ -616,11 +999,31 @@ Puedes mencionar:
         if 19.3 <= latitude <= 19.5 and -99.2 <= longitude <= -99.0:
             city = "ciudad_mexico"
         else:
-            city = "ciudad_mexico"  # Default
+            city = next(iter(self.medical_centers), "ciudad_mexico")  # Default: primera ciudad con centros
         
+        self.session_manager.update_profile(user_id, city=city)
         await self.show_medical_centers_for_city(update, city, is_location=True)
 
-    async def show_medical_centers_for_city(self, update, city_key: str, is_location: bool = False):
+    def opening_status(self, key: str, now: datetime) -> str:
+        minutes = self.opening_hours.minutes_until_open(key, now)
+        if minutes is None:
+            return ""
+        if minutes == 0:
+            closes = self.opening_hours.minutes_until_close(key, now)
+            if closes is None:
+                return "🟢 Abierto ahora"
+            return f"🟢 Abierto ahora · cierra a las {now + timedelta(minutes=closes):%H:%M}"
+        opens = now + timedelta(minutes=minutes)
+        if minutes < 60:
+            return f"🟡 Abre en {minutes} min"
+        if minutes <= OPEN_SOON_HOURS * 60:
+            return f"🟡 Abre a las {opens:%H:%M}"
+        if opens.date() == now.date():
+            return f"🔴 Cerrado · abre hoy a las {opens:%H:%M}"
+        return f"🔴 Cerrado · abre {DAY_NAMES[opens.weekday()]} {opens:%H:%M}"
+
+    async def show_medical_centers_for_city(self, update, city_key: str, is_location: bool = False,
+                                            within_hours: Optional[float] = None):
         if city_key not in self.medical_centers:
             text = """
 🏥 **Centros Médicos**
@@ -638,25 +1041,43 @@ No tengo información específica de centros médicos en tu área, pero puedes:
             keyboard = [[InlineKeyboardButton("⬅️ Volver", callback_data="menu")]]
         else:
             city_data = self.medical_centers[city_key]
+            centers = city_data['centros']
+            # Abiertos primero, luego por lo que falta para abrir
+            now = datetime.now()
+            ranked = self.opening_hours.rank((clinic_key(city_key, position) for position in range(len(centers))),
+                                             now, within_hours)
             text = f"""
 🏥 **Centros Médicos - {city_data['nombre']}**
 
 Centros recomendados cerca de ti:
             """
+            if within_hours is not None and not ranked:
+                text += "\nNingún centro abierto ahora." if within_hours == 0 else \
+                    f"\nNingún centro abre en las próximas {within_hours:g} horas."
             
             keyboard = []
-            for i, center in enumerate(city_data['centros'][:3]):  # Máximo 3 centros
+            for _, key in ranked[:3]:  # Máximo 3 centros
+                center = centers[int(key.rsplit('/', 1)[1])]
+                status = self.opening_status(key, now)
                 text += f"""
 
 **{center['nombre']}**
 📍 {center['direccion']}
 📞 {center['telefono']}
-🕒 {center['horarios']}
+🕒 {center['horarios']}{chr(10) + status if status else ''}
 🏥 Servicios: {', '.join(center['servicios'])}
                 """
                 keyboard.append([InlineKeyboardButton(f"📞 Llamar a {center['nombre']}", 
                                                     url=f"tel:{center['telefono']}")])
             
+            if within_hours is None:
+                keyboard.append([
+                    InlineKeyboardButton("🟢 Abiertos ahora", callback_data=self.callbacks.encode("open_now", city_key)),
+                    InlineKeyboardButton(f"🟡 Abren en {OPEN_SOON_HOURS:g} h",
+                                         callback_data=self.callbacks.encode("open_soon", city_key))
+                ])
+            else:
+                keyboard.append([InlineKeyboardButton("🏥 Ver todos", callback_data=self.callbacks.encode("city", city_key))])
             keyboard.extend([
                 [InlineKeyboardButton("🗺️ Ver más centros", callback_data=f"more_centers_{city_key}")],
                 [InlineKeyboardButton("📅 Agendar cita", callback_data="book_appointment")],
@@ -668,7 +1089,7 @@ Centros recomendados cerca de ti:
         if is_location:
             await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
         else:
-            await update.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+            await self.edit_message(update, text, parse_mode='Markdown', reply_markup=reply_markup)
 
     # ----------------- ENCICLOPEDIA INTERACTIVA -----------------
     async def show_encyclopedia(self, update):
@@ -685,7 +1106,7 @@ Explora información detallada sobre las infecciones de transmisión sexual más
             prevalence_emoji = "🔴" if ets['prevalencia'] == 'muy alta' else "🟡" if ets['prevalencia'] == 'alta' else "🟢"
             keyboard.append([InlineKeyboardButton(
                 f"{prevalence_emoji} {ets['nombre']}", 
-                callback_data=f"ets_detail_{key}"
+                callback_data=self.callbacks.encode("ets_detail", key)
             )])
         
         keyboard.extend([
@@ -694,7 +1115,7 @@ Explora información detallada sobre las infecciones de transmisión sexual más
             [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
         ])
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode='Markdown', 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
 
     async def show_ets_detail(self, update, ets_key: str):
@@ -707,13 +1128,13 @@ Explora información detallada sobre las infecciones de transmisión sexual más
         
         # Determinar síntomas según género del usuario si está disponible
         user_data = self.session_manager.get_user_data(query.from_user.id)
-        gender = user_data.get('gender', '').lower()
+        gender = self.personalization.key_for(user_data).gender
         
         sintomas_text = f"**Síntomas comunes:**\n• {chr(10).join(ets['sintomas']['comunes'])}\n"
         
-        if 'hombres' in ets['sintomas'] and 'masculino' in gender:
+        if 'hombres' in ets['sintomas'] and gender == personalization.GENDER_MALE:
             sintomas_text += f"\n**Específicos en hombres:**\n• {chr(10).join(ets['sintomas']['hombres'])}\n"
-        elif 'mujeres' in ets['sintomas'] and 'femenino' in gender:
+        elif 'mujeres' in ets['sintomas'] and gender == personalization.GENDER_FEMALE:
             sintomas_text += f"\n**Específicos en mujeres:**\n• {chr(10).join(ets['sintomas']['mujeres'])}\n"
         
         text = f"""
@@ -748,7 +1169,7 @@ Explora información detallada sobre las infecciones de transmisión sexual más
             [InlineKeyboardButton("🏠 Menú principal", callback_data="menu")]
         ]
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode='Markdown', 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
 
     # ----------------- GUÍA DE PRUEBAS MÉDICAS -----------------
@@ -798,39 +1219,19 @@ Explora información detallada sobre las infecciones de transmisión sexual más
             [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
         ]
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode='Markdown', 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
 
     def get_recommended_tests(self, user_data: Dict) -> str:
-        age = user_data.get('age', 0)
-        gender = user_data.get('gender', '').lower()
-        risk_level = user_data.get('risk_level', 'unknown')
-        
-        tests = []
-        
-        # Pruebas básicas para todos
-        tests.append("• Panel básico de ETS (Clamidia, Gonorrea, Sífilis, VIH)")
-        
-        if age and age <= 26:
-            tests.append("• Considerrar vacuna VPH si no la has recibido")
-        
-        if 'femenino' in gender:
-            tests.append("• Papanicolaou (detección VPH)")
-            tests.append("• Cultivo vaginal si hay síntomas")
-        
-        if risk_level == 'high':
-            tests.append("• Panel completo incluyendo Hepatitis B/C")
-            tests.append("• Repetir en 3 meses")
-        
-        return "\n".join(tests) if tests else "• Consulta con médico para recomendación personalizada"
+        return self.personalization.tests[self.personalization.key_for(user_data)]
 
     # ----------------- SISTEMA DE CITAS -----------------
-    async def start_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def start_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = ""):
         query = update.callback_query
         await query.answer()
         
-        text = """
-📅 **Agendar Cita Médica**
+        text = f"""
+{notice}📅 **Agendar Cita Médica**
 
 Te ayudo a preparar tu cita médica. ¿Qué tipo de consulta necesitas?
         """
@@ -843,22 +1244,133 @@ Te ayudo a preparar tu cita médica. ¿Qué tipo de consulta necesitas?
             [InlineKeyboardButton("❌ Cancelar", callback_data="menu")]
         ]
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode='Markdown', 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
         return APPOINTMENT_BOOKING
 
     async def handle_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if update.callback_query:
-            query = update.callback_query
-            appointment_type = {
-                'appt_symptoms': 'Evaluación de síntomas',
-                'appt_tests': 'Pruebas de ETS',
-                'appt_followup': 'Seguimiento de tratamiento',
-                'appt_prevention': 'Consulta preventiva'
-            }.get(query.data, 'Consulta general')
-            
-            text = f"""
-📋 **Preparación para tu cita: {appointment_type}**
+        if not update.callback_query:
+            return ConversationHandler.END
+        
+        query = update.callback_query
+        if query.data.startswith("book:"):
+            booking = self.parse_booking(query.data)
+            if booking is None:
+                # Botón de antes de que el tipo de cita viajara en callback_data
+                return await self.start_appointment(update, context, notice="⚠️ Vuelve a elegir el tipo de cita. ")
+            return await self.book_appointment(query, *booking)
+        if query.data not in APPOINTMENT_TYPES:
+            await self.handle_callback(update, context)
+            return ConversationHandler.END
+        
+        await query.answer()
+        return await self.show_appointment_slots(query, query.data)
+
+    @staticmethod
+    def parse_booking(data: str) -> Optional[Tuple[str, Optional[str], Optional[int]]]:
+        """'book:<tipo>:<centro>:<turno>' o 'book:<tipo>:next' → (tipo, centro, turno); None si no es válido"""
+        parts = data.split(":")
+        try:
+            appointment_type = APPOINTMENT_TYPE_CODES[int(parts[1], 16)]
+            if len(parts) == 3 and parts[2] == "next":
+                return appointment_type, None, None
+            if len(parts) == 4:
+                return appointment_type, parts[2], int(parts[3], 16)
+        except (ValueError, IndexError):
+            pass
+        return None
+
+    @staticmethod
+    def format_slot(slot: int) -> str:
+        moment = slot_datetime(slot)
+        return f"{DAY_NAMES[moment.weekday()]} {moment:%d/%m %H:%M}"
+
+    def appointment_city(self, user_id: int) -> Optional[str]:
+        city = self.session_manager.get_user_data(user_id).get('city')
+        return city if city in self.medical_centers else None
+
+    async def show_appointment_slots(self, query, appointment_type: str, notice: str = ""):
+        """Próximos turnos libres para el tipo de cita, primero en la ciudad del usuario"""
+        label, category = APPOINTMENT_TYPES[appointment_type]
+        city = self.appointment_city(query.from_user.id)
+        
+        options = self.appointments.earliest_per_clinic(category, city)
+        if not options and city:
+            options = self.appointments.earliest_per_clinic(category)
+        if not options:
+            await self.edit_message(
+                query,
+                f"📅 **{label}**\n\nNo hay turnos disponibles en las próximas semanas. "
+                "Puedes llamar directamente a los centros:",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🏥 Ver centros médicos", callback_data="find_centers")],
+                    [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
+                ])
+            )
+            return ConversationHandler.END
+        
+        # Con pocos centros, completar con los siguientes turnos del más próximo
+        if len(options) < 3:
+            first_clinic = options[0][1]
+            options += [(slot, first_clinic)
+                        for slot in self.appointments.free_slots(first_clinic, after=options[0][0] + 1,
+                                                                 limit=3 - len(options))]
+        
+        code = APPOINTMENT_TYPE_CODES.index(appointment_type)
+        keyboard = []
+        for slot, clinic_id in sorted(options):
+            center = self.appointments.clinics[clinic_id].center
+            keyboard.append([InlineKeyboardButton(f"{self.format_slot(slot)} · {center['nombre']}",
+                                                  callback_data=f"book:{code:x}:{clinic_id}:{slot:x}")])
+        keyboard.append([InlineKeyboardButton("⚡ Primer turno disponible", callback_data=f"book:{code:x}:next")])
+        keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="menu")])
+        
+        text = f"""
+{notice}📅 **{label}**
+
+Elige uno de los próximos turnos disponibles:
+        """
+        await self.edit_message(query, text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+        return APPOINTMENT_BOOKING
+
+    async def book_appointment(self, query, appointment_type: str, clinic_id: Optional[str], slot: Optional[int]):
+        """Reserva el turno elegido o, sin centro, el primero libre del tipo de cita"""
+        user_id = query.from_user.id
+        
+        if clinic_id is None:
+            # Búsqueda y reserva atómicas: nunca compite con otro usuario por el mismo turno
+            category = APPOINTMENT_TYPES[appointment_type][1]
+            city = self.appointment_city(user_id)
+            found = self.appointments.reserve_next(category, city)
+            if found is None and city:
+                found = self.appointments.reserve_next(category)
+            if found is None:
+                await query.answer()
+                return await self.show_appointment_slots(query, appointment_type)
+            slot, clinic_id = found
+        else:
+            # Otro usuario pudo reservar el turno entre que se mostró y se pulsó
+            if not self.appointments.reserve(clinic_id, slot):
+                await query.answer("Ese turno acaba de ocuparse, elige otro", show_alert=True)
+                return await self.show_appointment_slots(query, appointment_type, notice="⚠️ Turno ocupado. ")
+        await query.answer()
+        
+        previous = self.session_manager.get_user_data(user_id).get('appointment')
+        if previous:
+            self.appointments.cancel(previous['clinic'], previous['slot'])
+        self.session_manager.update_profile(
+            user_id, appointment={'clinic': clinic_id, 'slot': slot, 'type': appointment_type}
+        )
+        
+        center = self.appointments.clinics[clinic_id].center
+        text = f"""
+✅ **Cita reservada: {APPOINTMENT_TYPES[appointment_type][0]}**
+
+🕒 {self.format_slot(slot)}
+🏥 {center['nombre']}
+📍 {center['direccion']}
+📞 {center['telefono']}
 
 **Información que debes preparar:**
 • Lista de síntomas y cuándo comenzaron
@@ -870,21 +1382,101 @@ Te ayudo a preparar tu cita médica. ¿Qué tipo de consulta necesitas?
 • Identificación oficial
 • Credencial de seguro médico (si aplica)
 • Resultados de pruebas previas
+        """
+        keyboard = [
+            [InlineKeyboardButton("📄 Resumen para el médico", callback_data="appointment_summary")],
+            [InlineKeyboardButton("❌ Cancelar cita", callback_data="cancel_appointment")],
+            [InlineKeyboardButton("⬅️ Menú principal", callback_data="menu")]
+        ]
+        await self.edit_message(query, text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+        return ConversationHandler.END
 
-**Lista de centros médicos cercanos:**
-            """
-            
-            keyboard = [
-                [InlineKeyboardButton("🏥 Ver centros médicos", callback_data="find_centers")],
-                [InlineKeyboardButton("📋 Lista de preparación", callback_data="appointment_checklist")],
-                [InlineKeyboardButton("💬 Preguntas frecuentes", callback_data="appointment_faq")],
-                [InlineKeyboardButton("✅ Listo, buscar centros", callback_data="find_centers")]
+    async def cancel_appointment(self, query):
+        appointment = self.session_manager.get_user_data(query.from_user.id).pop('appointment', None)
+        if appointment:
+            self.appointments.cancel(appointment['clinic'], appointment['slot'])
+            text = f"🗓️ Tu cita del {self.format_slot(appointment['slot'])} fue cancelada."
+        else:
+            text = "No tienes citas reservadas."
+        keyboard = [
+            [InlineKeyboardButton("📅 Agendar cita", callback_data="book_appointment")],
+            [InlineKeyboardButton("⬅️ Menú principal", callback_data="menu")]
+        ]
+        await self.edit_message(query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    def appointment_summary(self, user_id: int) -> Dict:
+        """Documento para imprimir: perfil, cita, última evaluación y pruebas recomendadas"""
+        user_data = self.session_manager.get_user_data(user_id)
+        sections = [("Datos del paciente", [
+            f"• Edad: {user_data.get('age') or 'No especificada'}",
+            f"• Género: {user_data.get('gender') or 'No especificado'}",
+            f"• Nivel de riesgo: {RISK_LABELS.get(user_data.get('risk_level'), 'Por evaluar')}",
+        ])]
+        
+        appointment = user_data.get('appointment')
+        if appointment and appointment['clinic'] in self.appointments.clinics:
+            center = self.appointments.clinics[appointment['clinic']].center
+            sections.append(("Cita", [
+                f"• {APPOINTMENT_TYPES[appointment['type']][0]}: {self.format_slot(appointment['slot'])}",
+                f"• {center['nombre']}, {center.get('direccion', '')}",
+                f"• Teléfono: {center.get('telefono', '-')}",
+            ]))
+        
+        lines = []
+        if user_data.get('last_symptoms'):
+            lines.append(f"• Síntomas referidos: {user_data['last_symptoms'][0]}")
+        assessment = user_data.get('last_assessment')
+        if assessment:
+            lines += [
+                f"• Fecha: {datetime.fromtimestamp(assessment['at']):%d/%m/%Y}",
+                f"• Riesgo orientativo: {RISK_LABELS.get(assessment['risk_level'], assessment['risk_level'])}",
+                f"• Posibles condiciones: {assessment['conditions']}",
+                "Recomendaciones:",
+                assessment['recommendations'],
             ]
-            
-            await query.edit_message_text(text, parse_mode='Markdown', 
-                                        reply_markup=InlineKeyboardMarkup(keyboard))
+        sections.append(("Última evaluación de síntomas", lines or ["Sin evaluación registrada"]))
+        sections.append(("Pruebas recomendadas", [str(self.get_recommended_tests(user_data))]))
+        sections.append(("Para completar antes de la cita", [
+            "• Cuándo comenzaron los síntomas: ..........",
+            "• Historial sexual reciente: ..........",
+            "• Medicamentos que tomas actualmente: ..........",
+            "• Preguntas para el médico: ..........",
+        ]))
+        return {
+            'title': "Resumen para la cita médica",
+            'subtitle': "Información orientativa recopilada por el bot ETS",
+            'sections': sections,
+            'footer': "Esta evaluación es orientativa. Solo un profesional médico puede realizar un diagnóstico."
+        }
+
+    async def send_appointment_summary(self, query):
+        """Envía el resumen en PDF; una versión ya subida se reenvía por su file_id"""
+        user_id = query.from_user.id
+        document = self.appointment_summary(user_id)
+        version = printable.document_version(document)
+        bot = self.application.bot
+        caption = "📄 Resumen para tu cita: imprímelo o muéstralo en la consulta"
+        
+        file_id = self.summary_files.get(version)
+        if file_id is not None:
+            try:
+                await bot.send_document(user_id, file_id, caption=caption)
+                self.summary_files.stats['reused'] += 1
+                return
+            except BadRequest as e:
+                logger.warning(f"file_id del resumen ya no es válido, se vuelve a subir: {e}")
+                self.summary_files.discard(version)
         
-        return ConversationHandler.END
+        try:
+            data = await self.render_pool.render(document)
+        except Exception as e:
+            logger.error(f"No se pudo generar el resumen de {user_id}: {e}")
+            await bot.send_message(user_id, "⚠️ No se pudo generar el resumen. Inténtalo de nuevo en unos minutos.")
+            return
+        self.summary_files.stats['renders'] += 1
+        message = await bot.send_document(user_id, data, filename="resumen-cita.pdf", caption=caption)
+        if message.document is not None:
+            self.summary_files.put(version, message.document.file_id)
 
     # ----------------- CHAT LIBRE INTELIGENTE -----------------
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -895,254 +1487,127 @@ Te ayudo a preparar tu cita médica. ¿Qué tipo de consulta necesitas?
         # Actualizar interacciones
         self.session_manager.update_session(user_id, {'last_message': text})
         
-        # Análisis avanzado del texto con respuestas contextuales
-        response = self.generate_intelligent_response(text, user_data)
+        # Detección de idioma en una sola pasada sobre el primer mensaje
+        if not user_data.get('language_checked'):
+            self.session_manager.update_profile(
+                user_id,
+                language=self.catalog.detect_language(text) or user_data.get('language'),
+                language_checked=True
+            )
         
-        await update.message.reply_text(
+        # Análisis avanzado del texto con respuestas contextuales
+        intent = self.detect_intent(text, user_data.get('language'))
+        self.analytics.record(analytics.INTENT, user_id, intent)
+        category, hit = self.route_text(text, intent)
+        self.shadow_runner.offer(shadow.CHAT, text, user_data, {'category': category})
+        response = self.render_response(category, hit, user_data)
+        
+        reply_markup = self.get_main_menu(user_id)
+        message = await update.message.reply_text(
             response, 
-            parse_mode='Markdown', 
-            reply_markup=self.get_main_menu(user_id)
+            parse_mode=self.catalog.parse_mode, 
+            reply_markup=reply_markup
         )
+        self.remember_sent(message, response, self.catalog.parse_mode, reply_markup)
 
-    def generate_intelligent_response(self, text: str, user_data: Dict) -> str:
-        """Genera respuestas inteligentes basadas en contexto y historial"""
-        
-        # Respuestas contextuales por categorías
-        responses = {
-            'dolor_sintomas': {
-                'keywords': ['dolor', 'duele', 'molestia', 'ardor', 'quema'],
-                'response': """
-⚠️ **Síntomas de Dolor**
-
-El dolor en la zona genital puede indicar:
-• **Infecciones bacterianas** (Clamidia, Gonorrea)
-• **Infecciones del tracto urinario**
-• **Irritación por productos químicos**
-
-**Recomendaciones inmediatas:**
-• Evita jabones perfumados en la zona íntima
-• Usa ropa interior de algodón
-• Mantén buena hidratación
-• {personalized_advice}
-
-🏥 **Busca atención médica si:**
-• El dolor empeora o persiste >48 horas
-• Hay fiebre asociada
-• Dificultad para orinar
-                """
-            },
-            'secrecion_flujo': {
-                'keywords': ['secreción', 'flujo', 'líquido', 'descarga', 'supura'],
-                'response': """
-🔍 **Secreción Genital Anormal**
-
-**Características a observar:**
-• **Color:** Normal (claro/blanco) vs. Anormal (amarillo/verde/gris)
-• **Olor:** Sin olor fuerte vs. Olor desagradable
-• **Consistencia:** Textura y cantidad
-
-**Posibles causas:**
-• **Bacterianas:** Clamidia, Gonorrea
-• **Por hongos:** Candidiasis
-• **Parasitarias:** Tricomoniasis
-
-**No hagas:**
-• Duchas vaginales
-• Automedicación con antibióticos
-• Ignorar cambios persistentes
-
-{personalized_advice}
-                """
-            },
-            'lesiones_heridas': {
-                'keywords': ['ampolla', 'llaga', 'herida', 'úlcera', 'roncha', 'verruga'],
-                'response': """
-🚨 **Lesiones Genitales - Atención Prioritaria**
-
-**Tipos de lesiones y posibles causas:**
-• **Ampollas dolorosas:** Herpes genital
-• **Úlceras indoloras:** Sífilis primaria  
-• **Verrugas:** VPH (Virus del Papiloma Humano)
-• **Lesiones irregulares:** Requieren evaluación urgente
-
-**⚠️ IMPORTANTE:**
-• No toques ni revientes las lesiones
-• Evita contacto sexual hasta diagnóstico
-• Lávate las manos después del contacto
-
-**Busca atención médica URGENTE - estas lesiones requieren evaluación profesional inmediata.**
-
-{personalized_advice}
-                """
-            },
-            'prevencion': {
-                'keywords': ['prevenir', 'evitar', 'proteger', 'cuidar', 'seguro'],
-                'response': """
-🛡️ **Prevención Efectiva de ETS**
-
-**Métodos más efectivos:**
-1. **Preservativos** - 98% efectividad si se usan correctamente
-2. **Comunicación** - Hablar abiertamente con parejas
-3. **Pruebas regulares** - Detectar infecciones asintomáticas
-4. **Vacunación** - VPH y Hepatitis B disponibles
-
-**Estrategias personalizadas para ti:**
-{personalized_advice}
+    def detect_intent(self, text: str, language: Optional[str] = None) -> str:
+        """Devuelve la primera categoría cuyas palabras clave aparecen en el texto"""
+        return self.catalog.detect_intent(language, text)
 
-**¿Sabías que?** Muchas ETS son asintomáticas, por eso las pruebas regulares son clave.
-                """
-            },
-            'pruebas_tests': {
-                'keywords': ['prueba', 'test', 'examen', 'análisis', 'laboratorio'],
-                'response': """
-🧪 **Guía de Pruebas de ETS**
-
-**Recomendaciones según tu perfil:**
-{personalized_advice}
-
-**Tipos de pruebas principales:**
-• **Sangre:** VIH, Sífilis, Hepatitis (3-12 semanas post-exposición)
-• **Orina:** Clamidia, Gonorrea (1-2 semanas post-exposición)
-• **Hisopado:** Herpes, VPH (inmediato si hay síntomas)
-
-**Ventana de detección:** Tiempo necesario para que una prueba sea confiable después de la exposición.
-
-💡 **Tip:** Las pruebas son más precisas después del período de ventana.
-                """
-            }
-        }
-        
-        # Buscar categoría más relevante
-        for category, data in responses.items():
-            if any(keyword in text for keyword in data['keywords']):
-                # Personalizar respuesta
-                personalized = self.get_personalized_advice(category, user_data)
-                response = data['response'].format(personalized_advice=personalized)
-                return response
+    def generate_intelligent_response(self, text: str, user_data: Dict, intent: Optional[str] = None) -> str:
+        """Genera respuestas inteligentes basadas en contexto y historial"""
+        if intent is None:
+            intent = self.detect_intent(text, user_data.get('language'))
+        category, hit = self.route_text(text, intent)
+        return self.render_response(category, hit, user_data)
+    
+    def route_text(self, text: str, intent: str) -> Tuple[str, Optional[SearchHit]]:
+        """Categoría que responde: la intención o 'search:<ets>.<campo>' si contesta la enciclopedia"""
+        # Preguntas libres: buscar la respuesta en la enciclopedia
+        if intent == 'general':
+            hits = self.search_index.search(text, k=1)
+            if hits and hits[0].score >= SEARCH_MIN_SCORE:
+                return f"search:{hits[0].ets_key}.{hits[0].field}", hits[0]
+        return intent, None
+    
+    def render_response(self, category: str, hit: Optional[SearchHit], user_data: Dict) -> str:
+        language = user_data.get('language')
+        if hit is not None:
+            return self.render_search_answer(hit, language)
         
         # Respuestas generales inteligentes
-        if any(word in text for word in ['hola', 'buenos', 'buenas']):
-            return f"""
-¡Hola! 👋 
-
-Soy tu asistente de salud sexual. Puedo ayudarte con:
-• Evaluación de síntomas
-• Información sobre ETS
-• Guía de pruebas médicas
-• Localización de centros médicos
-
-**{self.get_personalized_greeting(user_data)}**
-
-¿En qué puedo ayudarte hoy?
-            """
-        
-        elif any(word in text for word in ['gracias', 'thank']):
-            return """
-¡De nada! 😊
-
-Recuerda que tu salud sexual es importante. Si tienes más dudas o necesitas orientación, estoy aquí para ayudarte.
-
-🔒 Todo es completamente confidencial.
-            """
+        if category == 'saludo':
+            return self.catalog.text(language, 'intent.saludo',
+                                     greeting=self.get_personalized_greeting(user_data))
+        
+        elif category == 'agradecimiento':
+            return self.catalog.text(language, 'intent.agradecimiento')
+        
+        # Respuestas contextuales por categoría (incluye la respuesta por defecto 'general')
+        personalized = self.get_personalized_advice(category, user_data)
+        return self.catalog.text(language, f'intent.{category}', personalized_advice=personalized)
+
+    def render_search_answer(self, hit, language: Optional[str]) -> str:
+        ets = self.ets_database[hit.ets_key]
+        field = hit.field
+        value = ets[field]
+        
+        if field == 'sintomas':
+            content = "\n".join(f"• {', '.join(items)}" for items in value.values() if isinstance(items, list))
+        elif isinstance(value, list):
+            content = "\n".join(f"• {item}" for item in value)
+        else:
+            content = value
         
-        # Respuesta por defecto más inteligente
-        return f"""
-💬 **Consulta de Salud Sexual**
-
-Entiendo que tienes dudas sobre salud sexual. 
-
-**Puedo ayudarte específicamente con:**
-• Análisis de síntomas que describas
-• Información sobre prevención
-• Orientación sobre pruebas médicas
-• Localización de centros de atención
-
-{self.get_personalized_advice('general', user_data)}
-
-💡 **Tip:** Sé específico/a con tus síntomas o preguntas para darte mejor orientación.
-        """
+        return self.catalog.text(language, 'search.answer', name=ets['nombre'],
+                                 field=self.catalog.text(language, f'search.field.{field}'),
+                                 content=content)
 
     def get_personalized_advice(self, category: str, user_data: Dict) -> str:
         """Genera consejos personalizados basados en el perfil del usuario"""
-        
-        age = user_data.get('age', 0)
-        gender = user_data.get('gender', '').lower()
-        risk_level = user_data.get('risk_level', 'unknown')
-        
-        advice = []
-        
-        if category == 'dolor_sintomas':
-            if risk_level == 'high':
-                advice.append("Dado tu nivel de riesgo, considera hacerte pruebas completas")
-            if age and age < 25:
-                advice.append("A tu edad, Clamidia y Gonorrea son más comunes")
-        
-        elif category == 'prevencion':
-            if age and age <= 26:
-                advice.append("La vacuna VPH es especialmente recomendada a tu edad")
-            if risk_level != 'low':
-                advice.append("Considera pruebas cada 3-6 meses dada tu situación")
-        
-        elif category == 'pruebas_tests':
-            if 'femenino' in gender:
-                advice.append("Incluye Papanicolaou para detección de VPH")
-            if age and age < 25:
-                advice.append("Enfócate en pruebas de Clamidia y Gonorrea")
-        
-        return " • ".join(advice) if advice else "Consulta médica para recomendación personalizada"
+        return self.personalization.advice_for(self.personalization.key_for(user_data), category)
 
     def get_personalized_greeting(self, user_data: Dict) -> str:
         """Genera saludos personalizados"""
-        
-        age = user_data.get('age')
-        if age:
-            if age < 25:
-                return "Veo que eres joven, la prevención es clave a tu edad"
-            elif age >= 25:
-                return "La salud sexual es importante a cualquier edad"
-        
-        return "Tu salud sexual es mi prioridad"
+        return self.personalization.greetings[self.personalization.key_for(user_data)]
 
     # ----------------- CALLBACKS Y NAVEGACIÓN -----------------
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         
-        callback_handlers = {
-            "menu": self.show_main_menu_callback,
-            "encyclopedia": self.show_encyclopedia,
-            "test_guide": self.show_test_guide,
-            "find_centers": self.show_location_options,
-            "emergency": self.show_emergency_info,
-            "quick_symptoms": self.show_quick_symptoms,
-            "free_chat": self.show_free_chat_info,
-            "profile": self.show_profile_callback,
-            "setup_profile": self.setup_profile_callback,
-            "skip_setup": self.skip_setup_callback
-        }
+        # Una búsqueda en tabla; solo rutas conocidas llegan a la analítica
+        route, argument = self.callbacks.decode(query.data)
+        self.analytics.record(analytics.CALLBACK, query.from_user.id, route)
         
         # Manejar callbacks específicos
-        if query.data.startswith("ets_detail_"):
-            ets_key = query.data.replace("ets_detail_", "")
-            await self.show_ets_detail(query, ets_key)
-        elif query.data.startswith("rating_"):
-            await self.handle_feedback_rating(query)
-        elif query.data.startswith("city_"):
-            city = query.data.replace("city_", "")
-            await self.show_medical_centers_for_city(query, city)
-        elif query.data in callback_handlers:
-            await callback_handlers[query.data](query)
+        if route == "ets_detail":
+            await self.show_ets_detail(query, argument)
+        elif route == "rating":
+            await self.handle_feedback_rating(query, int(argument))
+        elif route == "city":
+            self.session_manager.update_profile(query.from_user.id, city=argument)
+            await self.show_medical_centers_for_city(query, argument)
+        elif route == "open_now":
+            await self.show_medical_centers_for_city(query, argument, within_hours=0)
+        elif route == "open_soon":
+            await self.show_medical_centers_for_city(query, argument, within_hours=OPEN_SOON_HOURS)
+        elif route in self.callback_handlers:
+            await self.callback_handlers[route](query)
         else:
-            await query.edit_message_text(
+            await self.edit_message(
+                query,
                 "⚠️ Opción no reconocida. Volviendo al menú principal.",
                 reply_markup=self.get_main_menu(query.from_user.id)
             )
 
     async def show_main_menu_callback(self, query):
-        text = "🏥 **Menú Principal**\n\n¿En qué puedo ayudarte hoy?"
-        await query.edit_message_text(
+        language = self.session_manager.get_user_data(query.from_user.id).get('language')
+        text = self.catalog.text(language, 'menu.title')
+        await self.edit_message(
+            query,
             text, 
-            parse_mode='Markdown', 
+            parse_mode=self.catalog.parse_mode, 
             reply_markup=self.get_main_menu(query.from_user.id)
         )
 
@@ -1155,50 +1620,90 @@ Selecciona tu ubicación para encontrar centros especializados cerca de ti:
         
         keyboard = [
             [InlineKeyboardButton("📍 Compartir ubicación", callback_data="share_location")],
-            [InlineKeyboardButton("🏙️ Ciudad de México", callback_data="city_ciudad_mexico")],
-            [InlineKeyboardButton("🌆 Guadalajara", callback_data="city_guadalajara")],
-            [InlineKeyboardButton("🏘️ Monterrey", callback_data="city_monterrey")],
+            *([InlineKeyboardButton(label, callback_data=self.callbacks.encode("city", city))]
+              for city, label in self.city_buttons.items()),
             [InlineKeyboardButton("🏖️ Otras ciudades", callback_data="other_cities")],
             [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
         ]
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode='Markdown', 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
 
     async def show_emergency_info(self, query):
-        text = """
-🆘 **INFORMACIÓN DE EMERGENCIA**
-
-**¿Cuándo buscar atención inmediata?**
-• Dolor severo que no mejora
-• Fiebre alta (>38.5°C) con síntomas genitales
-• Sangrado abundante anormal
-• Lesiones genitales que crecen rápidamente
-• Dificultad severa para orinar
-
-**Números de emergencia México:**
-• **911** - Emergencias médicas
-• **065** - Cruz Roja Mexicana
-• **Locatel:** 56-58-1111 (CDMX)
-• **Tel-SIDA:** 800-712-0886
-
-**Centros de atención 24/7:**
-• Hospitales públicos de tu localidad
-• Clínicas privadas con urgencias
-• Centros de salud con guardia nocturna
-
-⚠️ **No esperes** si presentas síntomas graves.
-        """
+        language = self.session_manager.get_user_data(query.from_user.id).get('language')
+        text = self.catalog.text(language, 'emergency.text')
         
         keyboard = [
-            [InlineKeyboardButton("🏥 Centros médicos", callback_data="find_centers")],
-            [InlineKeyboardButton("📞 Más números útiles", callback_data="more_emergency_numbers")],
-            [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
+            [InlineKeyboardButton(self.catalog.text(language, 'emergency.centers'), callback_data="find_centers")],
+            [InlineKeyboardButton(self.catalog.text(language, 'emergency.more_numbers'), callback_data="more_emergency_numbers")],
+            [InlineKeyboardButton(self.catalog.text(language, 'common.back'), callback_data="menu")]
         ]
         
-        await query.edit_message_text(text, parse_mode='Markdown', 
+        await self.edit_message(query, text, parse_mode=self.catalog.parse_mode, 
                                     reply_markup=InlineKeyboardMarkup(keyboard))
 
+    async def show_quick_symptoms(self, query):
+        text = """
+🔍 **Síntomas Rápidos**
+
+Escríbeme en un mensaje lo que sientes, por ejemplo:
+• _"Me arde al orinar desde hace 3 días"_
+• _"Tengo una llaga que no duele"_
+
+Te diré qué condiciones son compatibles y qué pruebas considerar.
+Para una evaluación completa usa **🎯 Evaluación Completa**.
+        """
+        keyboard = [
+            [InlineKeyboardButton("🎯 Evaluación Completa", callback_data="full_assessment")],
+            [InlineKeyboardButton("⬅️ Volver", callback_data="menu")]
+        ]
+        await self.edit_message(query, text, parse_mode='Markdown',
+                                reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def show_free_chat_info(self, query):
+        text = """
+💬 **Chat Libre**
+
+Escribe tu pregunta con tus propias palabras: síntomas, prevención, pruebas o tratamientos.
+Busco la respuesta en la enciclopedia y la adapto a tu perfil.
+
+*La información es orientativa y no sustituye una consulta médica.*
+        """
+        keyboard = [[InlineKeyboardButton("⬅️ Volver", callback_data="menu")]]
+        await self.edit_message(query, text, parse_mode='Markdown',
+                                reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = """
+ℹ️ **Ayuda**
+
+**Comandos disponibles:**
+• /start - Menú principal
+• /perfil - Ver tu perfil de salud
+• /emergencia - Información de emergencia
+• /cancelar - Cancelar la conversación actual
+• /ayuda - Mostrar esta ayuda
+
+También puedes escribirme tus dudas directamente.
+        """
+        await update.message.reply_text(
+            text,
+            parse_mode='Markdown',
+            reply_markup=self.get_main_menu(update.effective_user.id)
+        )
+
+    async def emergency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        language = self.session_manager.get_user_data(update.effective_user.id).get('language')
+        keyboard = [
+            [InlineKeyboardButton(self.catalog.text(language, 'emergency.centers'), callback_data="find_centers")],
+            [InlineKeyboardButton(self.catalog.text(language, 'common.back'), callback_data="menu")]
+        ]
+        await update.message.reply_text(
+            self.catalog.text(language, 'emergency.text'),
+            parse_mode=self.catalog.parse_mode,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
     async def cancel_conversation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "❌ **Conversación cancelada**\n\nVolviendo al menú principal.",
@@ -1207,55 +1712,413 @@ Selecciona tu ubicación para encontrar centros especializados cerca de ti:
         )
         return ConversationHandler.END
 
-    async def handle_feedback_rating(self, query):
-        rating = int(query.data.replace("rating_", ""))
+    async def handle_feedback_rating(self, query, rating: int):
         user_id = query.from_user.id
         
         # Guardar rating (en producción usarías una base de datos)
         user_data = self.session_manager.get_user_data(user_id)
         user_data['last_rating'] = rating
-        
-        thank_you_messages = {
-            5: "¡Excelente! 🌟 Me alegra haber sido de gran ayuda.",
-            4: "¡Muy bien! 😊 Gracias por tu feedback positivo.",
-            3: "¡Bien! 👍 Seguiré mejorando para ayudarte mejor.",
-            2: "Gracias por tu honestidad. 💭 ¿Hay algo específico que pueda mejorar?",
-            1: "Lamento no haber cumplido tus expectativas. 😔 Tu feedback me ayuda a mejorar."
+        self.analytics.record(analytics.RATING, user_id, 'rating', rating)
+        
+        language = user_data.get('language')
+        await self.edit_message(
+            query,
+            self.catalog.text(language, 'rating.result', rating=rating,
+                              message=self.catalog.text(language, f'rating.{rating}')),
+            parse_mode=self.catalog.parse_mode
+        )
+
+    # ----------------- MODO INLINE -----------------
+    async def handle_inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        inline_query = update.inline_query
+        results, next_offset = self.inline_index.answer(inline_query.query, inline_query.offset)
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False,
+                                  next_offset=next_offset)
+
+    # ----------------- TAREAS PROGRAMADAS -----------------
+    def setup_jobs(self):
+        job_queue = self.application.job_queue
+        if job_queue is None:
+            logger.warning("JobQueue no disponible: instala python-telegram-bot[job-queue]")
+            return
+        job_queue.run_repeating(self.sweep_sessions_job, interval=60, first=60, name="session_sweep")
+        job_queue.run_repeating(self.send_reminders_job, interval=60, first=10, name="follow_up_reminders")
+        job_queue.run_repeating(self.advance_appointments_job, interval=60, first=60, name="appointment_calendar")
+
+    async def sweep_sessions_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Barrido incremental: porciones pequeñas con presupuesto de tiempo acotado"""
+        deadline = time.monotonic() + 0.005
+        removed = self.session_manager.sweep_expired(timedelta(hours=SESSION_TTL_HOURS), deadline=deadline)
+        self.rate_limiter.evict_idle(limit=500)
+        
+        if removed:
+            logger.debug(f"Sesiones expiradas eliminadas: {removed}")
+        # Si quedó trabajo pendiente, continuar en otra vuelta del event loop
+        if removed >= 500 or time.monotonic() >= deadline:
+            context.job_queue.run_once(self.sweep_sessions_job, when=0.1, name="session_sweep_continue")
+
+    async def advance_appointments_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Retira los turnos que ya empezaron y extiende el calendario"""
+        added = self.appointments.advance()
+        if added:
+            logger.debug(f"Turnos nuevos en el calendario: {added}")
+
+    async def send_reminders_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Envía por lotes todo lo vencido; si se agota el presupuesto, continúa en otra pasada
+
+        El ritmo lo marca reminder_bucket, no el intervalo del job.
+        """
+        deadline = time.monotonic() + REMINDER_JOB_BUDGET
+        batch_size = max(1, int(REMINDER_RATE))
+        while time.monotonic() < deadline:
+            batch = self.reminders.pop_due(limit=batch_size)
+            if not batch:
+                return
+            await asyncio.gather(*(self.send_reminder(context.bot, *item) for item in batch))
+        context.job_queue.run_once(self.send_reminders_job, when=0.1, name="follow_up_reminders_continue")
+
+    async def send_reminder(self, bot, due: float, user_id: int, kind: str):
+        language = self.session_manager.user_data.get(user_id, {}).get('language')
+        keyboard = [
+            [InlineKeyboardButton(self.catalog.text(language, 'reminder.find_centers'), callback_data="find_centers")],
+            [InlineKeyboardButton(self.catalog.text(language, 'reminder.new_assessment'), callback_data="full_assessment")]
+        ]
+        await self.reminder_bucket.acquire()
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=self.catalog.text(language, 'reminder.follow_up'),
+                parse_mode=self.catalog.parse_mode,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except Exception as e:
+            if isinstance(e, RetryAfter):
+                # Límite global de Telegram: frena también al resto del lote
+                self.reminder_bucket.pause(e.retry_after)
+            if self.reminders.retry(user_id, kind, due):
+                logger.warning(f"No se pudo enviar recordatorio {kind} a {user_id}, se reintentará: {e}")
+            else:
+                logger.warning(f"Recordatorio {kind} a {user_id} descartado tras varios intentos: {e}")
+        else:
+            self.reminders.complete(user_id, kind, due)
+
+    # ----------------- ADMINISTRACIÓN -----------------
+    def memory_footprints(self):
+        """Tamaño profundo por subsistema; lo compartido cuenta para el primero de la lista"""
+        app = self.application
+        return subsystem_footprints({
+            'sessions': self.session_manager.sessions,
+            'user_data': self.session_manager.user_data,
+            'rate_limiter': self.rate_limiter,
+            'message_cache': self.message_cache,
+            'reminders': self.reminders,
+            'analytics': self.analytics,
+            'ets_database': self.ets_database,
+            'search_index': self.search_index,
+            'symptom_index': self.symptom_index,
+            'catalog': self.catalog,
+            'personalization': self.personalization,
+            'appointments': self.appointments,
+            'inline_index': self.inline_index,
+            'summary_files': self.summary_files,
+            'ptb': (app.user_data, app.chat_data, app.bot_data, app.handlers),
+        })
+
+    async def memory_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/memoria [snapshot|diff|stop] - solo administradores"""
+        if update.effective_user.id not in ADMIN_IDS:
+            return
+        action = context.args[0].lower() if context.args else 'report'
+        profiler = self.memory_profiler
+        
+        if action == 'snapshot':
+            text = f"Snapshot tomado: {format_bytes(profiler.snapshot())} rastreados por tracemalloc"
+        elif action == 'diff':
+            lines = profiler.diff()
+            text = "\n".join(lines) if lines else "Sin línea base: snapshot tomado, repite /memoria diff"
+        elif action == 'stop':
+            profiler.stop()
+            text = "tracemalloc detenido"
+        else:
+            text = format_report(self.memory_footprints(), profiler.high_water(),
+                                 users=len(self.session_manager.user_data))
+        
+        # Los mensajes de Telegram admiten hasta 4096 caracteres
+        await update.message.reply_text(f"<pre>{html.escape(text[:3900])}</pre>", parse_mode='HTML')
+
+    def start_profiling(self, duration: float, fraction: float, chat_id: Optional[int] = None):
+        """Abre una ventana de muestreo; al cerrarse el .folded se guarda y se envía a `chat_id`"""
+        # Se llama desde el hilo del event loop, que es el que se muestrea
+        self.sampling_profiler.start(duration, fraction)
+        self.sampling_profiler.attach(self.application)
+
+        async def finish():
+            await asyncio.sleep(duration)
+            await self.stop_profiling(chat_id)
+
+        # Como las campañas, fuera de Application.create_task para no retrasar la parada
+        self.profile_task = asyncio.get_running_loop().create_task(finish())
+
+    async def stop_profiling(self, chat_id: Optional[int] = None) -> Optional[str]:
+        """Cierra la ventana en curso y escribe el .folded; devuelve su ruta"""
+        profiler = self.sampling_profiler
+        if not profiler.active:
+            return None
+        task, self.profile_task = self.profile_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        profiler.detach(self.application)
+        summary = profiler.stop()
+        path = profiler.write(self.profile_dir)
+        logger.info(f"Perfil guardado en {path}: {summary}")
+        if chat_id is not None:
+            top = "\n".join(f"{count:>6} {label}" for label, count in profiler.top(5))
+            caption = (f"{summary['samples']} muestras ({summary['idle_samples']} esperando red) de "
+                       f"{summary['sampled_updates']}/{summary['updates']} updates en {summary['elapsed']}s\n{top}")
+            try:
+                with open(path, 'rb') as f:
+                    await self.application.bot.send_document(chat_id, f, filename=os.path.basename(path),
+                                                             caption=caption[:1024])
+            except Exception as e:
+                logger.warning(f"No se pudo enviar el perfil a {chat_id}: {e}")
+        return path
+
+    async def profiler_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/profiler [segundos] [fracción] | stop | estado - solo administradores"""
+        if update.effective_user.id not in ADMIN_IDS:
+            return
+        args = context.args or []
+        profiler = self.sampling_profiler
+        
+        if args and args[0] == 'estado':
+            text = (f"Perfilando: {profiler.summary()}" if profiler.active
+                    else "Sin perfilado en curso")
+        elif args and args[0] == 'stop':
+            path = await self.stop_profiling(update.effective_chat.id)
+            text = f"Perfil guardado en {path}" if path else "Sin perfilado en curso"
+        elif profiler.active:
+            text = "⚠️ Ya hay un perfilado en curso: /profiler estado"
+        else:
+            try:
+                duration = min(float(args[0]) if args else 30.0, PROFILE_MAX_SECONDS)
+                fraction = float(args[1]) if len(args) > 1 else 0.1
+            except ValueError:
+                duration = fraction = 0
+            if duration <= 0 or not 0 < fraction <= 1:
+                await update.message.reply_text("Uso: /profiler [segundos] [fracción 0-1] | stop | estado")
+                return
+            self.start_profiling(duration, fraction, update.effective_chat.id)
+            text = f"🔬 Muestreando el {fraction:.0%} de las updates durante {duration:.0f}s"
+        await update.message.reply_text(text)
+
+    async def shadow_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/sombra - discrepancias de los analizadores candidatos; solo administradores"""
+        if update.effective_user.id not in ADMIN_IDS:
+            return
+        runner = self.shadow_runner
+        if not runner.candidates:
+            await update.message.reply_text("Sin candidatos en sombra (SHADOW_CANDIDATES)")
+            return
+        summary = runner.summary()
+        lines = [f"Muestreo {summary['sample_rate']:.1%}: {summary['compared']} comparadas, "
+                 f"{summary['dropped']} descartadas, {summary['queued']} en cola"]
+        for path, stats in summary['candidates'].items():
+            lines.append(f"{path}: acuerdo {stats['agreement']} en {stats['samples']} "
+                         f"(errores {stats['errors']}, {stats['mean_ms']} ms)")
+            lines.extend(f"  {field}: {count}" for field, count in stats['fields'].items())
+            lines.extend(f"  riesgo {change}: {count}" for change, count in stats['risk'].items())
+        text = "\n".join(lines)
+        await update.message.reply_text(f"<pre>{html.escape(text[:3900])}</pre>", parse_mode='HTML')
+
+    # ----------------- CAMPAÑAS -----------------
+    def campaign_sender(self, campaign: str):
+        async def send(user_id: int, profile: Dict):
+            language = profile.get('language')
+            keyboard = [[InlineKeyboardButton(self.catalog.text(language, 'campaign.find_centers'),
+                                              callback_data="find_centers")]]
+            await self.application.bot.send_message(
+                chat_id=user_id,
+                text=self.catalog.text(language, f'campaign.{campaign}'),
+                parse_mode=self.catalog.parse_mode,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        return send
+
+    def mark_blocked(self, user_id: int):
+        profile = self.session_manager.user_data.get(user_id)
+        if profile is not None:
+            profile['blocked'] = True
+
+    def broadcast_options(self, on_progress=None) -> Dict:
+        return {
+            'rate': BROADCAST_RATE,
+            'workers': BROADCAST_WORKERS,
+            'checkpoint_path': self.broadcast_checkpoint,
+            'on_blocked': self.mark_blocked,
+            'on_progress': on_progress,
         }
+
+    def start_broadcast(self, broadcast: Broadcast):
+        # Fuera de Application.create_task: la parada no debe esperar a toda la campaña
+        self.broadcast = broadcast
+        self.broadcast_task = asyncio.get_running_loop().create_task(broadcast.run())
+
+    async def stop_broadcast(self):
+        """Cancela la campaña en curso; su checkpoint permite reanudarla al arrancar"""
+        task, self.broadcast_task = self.broadcast_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    @staticmethod
+    def format_broadcast_progress(progress: Dict) -> str:
+        state = "terminada" if progress['finished'] else "en curso"
+        return (f"📣 Campaña {progress['campaign']} ({state})\n"
+                f"Enviados: {progress['sent']} · Bloqueados: {progress['blocked']} · "
+                f"Fallidos: {progress['failed']} · Reintentos: {progress['retried']}\n"
+                f"{progress['per_second']} msg/s en {progress['elapsed']}s")
+
+    async def campaign_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/campana <nombre> [riesgo=high,medium] [edad=under_25] [ciudad=guadalajara] | estado"""
+        if update.effective_user.id not in ADMIN_IDS:
+            return
+        args = context.args or []
+        running = self.broadcast_task is not None and not self.broadcast_task.done()
         
-        await query.edit_message_text(
-            f"⭐ **Rating: {rating}/5**\n\n{thank_you_messages[rating]}",
-            parse_mode='Markdown'
-        )
+        if not args or args[0] == 'estado':
+            text = (self.format_broadcast_progress(self.broadcast.progress()) if self.broadcast
+                    else "No hay campañas registradas")
+            await update.message.reply_text(text)
+            return
+        if running:
+            await update.message.reply_text("⚠️ Ya hay una campaña en curso: /campana estado")
+            return
+        
+        campaign = args[0]
+        if f'campaign.{campaign}' not in self.catalog.pack(None).messages:
+            await update.message.reply_text(f"⚠️ Campaña desconocida: {campaign}")
+            return
+        try:
+            segment = Segment.parse(args[1:])
+        except ValueError as e:
+            await update.message.reply_text(f"⚠️ {e}")
+            return
+        
+        status = await update.message.reply_text(f"📣 Iniciando campaña {campaign}...")
+        
+        async def on_progress(progress: Dict):
+            try:
+                await status.edit_text(self.format_broadcast_progress(progress))
+            except BadRequest:
+                pass
+        
+        self.start_broadcast(Broadcast(campaign, segment, self.session_manager.user_data,
+                                       self.campaign_sender(campaign), **self.broadcast_options(on_progress)))
+        logger.info(f"Campaña {campaign} iniciada (segmento {segment.to_json()})")
 
     # ----------------- EJECUCIÓN Y CONFIGURACIÓN -----------------
+    async def on_startup(self, application):
+        """Importa perfiles exportados por otro host y pre-calienta antes de recibir updates"""
+        if self.import_dir:
+            # Los perfiles viven en memoria: cada arranque carga entera la última exportación completa
+            checkpoint = user_migration.import_records(self.import_dir, self.session_manager.restore_record,
+                                                       resume=False)
+            logger.info(f"Perfiles importados desde {self.import_dir} "
+                        f"(generación {checkpoint['generation']}): {checkpoint['records']}")
+        restored = self.appointments.restore(
+            (profile['appointment']['clinic'], profile['appointment']['slot'])
+            for profile in self.session_manager.user_data.values() if profile.get('appointment')
+        )
+        if restored:
+            logger.info(f"Citas restauradas en el calendario: {restored}")
+        self.prewarm()
+        await self.render_pool.start()
+        await self.shadow_runner.start()
+        checkpoint = read_checkpoint(self.broadcast_checkpoint)
+        if checkpoint and not checkpoint['finished']:
+            logger.info(f"Reanudando campaña {checkpoint['campaign']} desde el usuario {checkpoint['watermark']}")
+            self.start_broadcast(Broadcast.resume(checkpoint, self.session_manager.user_data,
+                                                  self.campaign_sender(checkpoint['campaign']),
+                                                  **self.broadcast_options()))
+
+    def prewarm(self):
+        """Recorre una vez las rutas calientes para que la primera update no pague la carga"""
+        for language in self.catalog.languages:
+            self.get_main_menu_for_language(language)
+            self.generate_intelligent_response("¿cuánto tarda en aparecer la sífilis?", {'language': language})
+        self.analyze_symptoms_advanced("me arde al orinar", {})
+
+    async def on_shutdown(self, application):
+        """Vacía los buffers pendientes al detener la aplicación"""
+        await self.stop_broadcast()
+        await self.stop_profiling()
+        await self.shadow_runner.stop()
+        self.render_pool.shutdown()
+        self.analytics.flush()
+        self.reminders.close()
+        logger.info(f"Ediciones evitadas: {self.message_cache.saved_calls} ({self.message_cache.stats})")
+        if self.export_dir:
+            checkpoint = user_migration.export_records(self.session_manager.iter_records(), self.export_dir)
+            logger.info(f"Perfiles exportados a {self.export_dir} "
+                        f"(generación {checkpoint['generation']}): {checkpoint['records']}")
+
     def run_webhook(self):
-        """Ejecuta el bot usando webhook para Render"""
+        """Ejecuta el bot usando webhook para Render; SIGTERM drena antes de salir"""
         port = int(os.environ.get("PORT", 5000))
         
         # Configurar webhook
-        self.application.run_webhook(
+        lifecycle = WebhookLifecycle(
+            self.application,
             listen="0.0.0.0",
             port=port,
             url_path=self.token,
             webhook_url=f"{WEBHOOK_URL}/{self.token}",
-            drop_pending_updates=True
+            drain_timeout=SHUTDOWN_DRAIN_TIMEOUT,
+            before_drain=self.prepare_shutdown
+        )
+        logger.info(f"Iniciando en puerto {port} con webhook {WEBHOOK_URL}")
+        asyncio.run(lifecycle.run())
+
+    def run_polling(self):
+        """Ejecuta el bot con long polling; al detenerse termina las updates ya recibidas"""
+        logger.info(f"Long polling (timeout {POLL_TIMEOUT}s, {CONCURRENT_UPDATES} updates en paralelo)")
+        self.application.run_polling(
+            poll_interval=POLL_INTERVAL,
+            timeout=POLL_TIMEOUT,
+            allowed_updates=POLLED_UPDATE_TYPES,
+            drop_pending_updates=False
         )
-        
-        logger.info(f"Bot iniciado en puerto {port} con webhook {WEBHOOK_URL}")
 
-def main():
+def main(argv=None):
     """Función principal"""
-    if not TOKEN or not WEBHOOK_URL:
+    parser = argparse.ArgumentParser(description="Chatbot ETS")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--polling", dest="mode", action="store_const", const="polling",
+                      help="Usar long polling (no requiere WEBHOOK_URL)")
+    mode.add_argument("--webhook", dest="mode", action="store_const", const="webhook")
+    args = parser.parse_args(argv)
+    bot_mode = args.mode or BOT_MODE
+
+    log_listener = logging_setup.configure_logging(
+        LOG_LEVEL, LOG_FORMAT, logging_setup.parse_sampling(LOG_SAMPLING)
+    )
+    if not TOKEN or (bot_mode == "webhook" and not WEBHOOK_URL):
         logger.error("Faltan variables de entorno requeridas")
+        log_listener.stop()
         return
     
     try:
         bot = ETSBotAdvanced(TOKEN)
-        logger.info("Bot iniciado correctamente")
-        bot.run_webhook()
+        logger.info(f"Bot iniciado correctamente (modo {bot_mode})")
+        if bot_mode == "polling":
+            bot.run_polling()
+        else:
+            bot.run_webhook()
     except Exception as e:
         logger.error(f"Error al iniciar el bot: {e}")
+    finally:
+        # Escribe los registros que sigan en la cola
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
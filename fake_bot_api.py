@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bot API local para pruebas de carga e integración
+Servidor HTTP (tornado sobre asyncio) que imita los métodos de la Bot API que
+usa el bot, con latencia, errores y 429 inyectables. Empuja updates al webhook
+registrado (o las encola para getUpdates) a un ritmo objetivo y guarda cada
+llamada recibida para medir throughput, latencia de cola y corrección.
+
+Uso con el bot: BOT_API_URL=http://127.0.0.1:8081/bot y WEBHOOK_URL=http://127.0.0.1:5000
+(o BOT_MODE=polling)
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+BOT_USER = {
+    'id': 1000000001, 'is_bot': True, 'first_name': 'ETS Bot', 'username': 'ets_local_bot',
+    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': True,
+}
+
+# Métodos sujetos a fallos inyectados; los de control (getMe, setWebhook, ...) nunca fallan
+FAULTY_METHODS = frozenset({'sendMessage', 'editMessageText', 'answerCallbackQuery', 'answerInlineQuery'})
+
+
+class FaultPlan:
+    """Latencia (fija + jitter uniforme) y probabilidad de error 500 o 429 por llamada"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+    def draw(self) -> Tuple[float, Optional[int]]:
+        """(segundos de espera, código HTTP inyectado o None)"""
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        roll = self._random.random()
+        if roll < self.throttle_rate:
+            return delay, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+
+class CallRecord(NamedTuple):
+    method: str
+    params: Dict
+    received_at: float
+    status: int
+    # Segundos desde que se empujó la update hasta esta primera respuesta del bot
+    update_latency: Optional[float]
+
+
+def make_message_update(update_id: int, user_id: int, text: str, language_code: str = 'es') -> Dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Usuario{user_id}', 'language_code': language_code}
+    message = {
+        'message_id': update_id, 'date': int(time.time()), 'text': text, 'from': user,
+        'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Usuario{user_id}', 'language_code': 'es'}
+    message = {
+        'message_id': message_id, 'date': int(time.time()), 'text': '...', 'from': BOT_USER,
+        'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+    }
+    return {
+        'update_id': update_id,
+        'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                           'data': data, 'message': message},
+    }
+
+
+def make_inline_query_update(update_id: int, user_id: int, query: str, offset: str = '') -> Dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Usuario{user_id}', 'language_code': 'es'}
+    return {
+        'update_id': update_id,
+        'inline_query': {'id': str(update_id), 'from': user, 'query': query, 'offset': offset},
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    """POST /bot<token>/<método>"""
+
+    def initialize(self, api: 'FakeBotAPI'):
+        self.api = api
+
+    def check_xsrf_cookie(self):
+        pass
+
+    async def post(self, token: str, method: str):
+        params = self._parse_params()
+        status, payload = await self.api.handle(token, method, params)
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(payload))
+
+    get = post
+
+    def _parse_params(self) -> Dict:
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(self.request.body or b'{}')
+        params = {}
+        for key, values in self.request.arguments.items():
+            value = values[-1].decode('utf-8')
+            # PTB envía los objetos anidados (reply_markup, ...) como JSON dentro del formulario
+            if value[:1] in '{[':
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        # Archivos subidos: solo interesan nombre y tamaño
+        for key, files in self.request.files.items():
+            params[key] = {'filename': files[-1].filename, 'size': len(files[-1].body)}
+        return params
+
+
+class FakeBotAPI:
+    """Imitación en proceso de api.telegram.org"""
+
+    def __init__(self, faults: Optional[FaultPlan] = None, host: str = '127.0.0.1', port: int = 0):
+        self.faults = faults or FaultPlan()
+        self.host = host
+        self.port = port
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        self.calls: List[CallRecord] = []
+        self.push_statuses: Counter = Counter()
+        self._webhook_generation = 0
+        self._message_ids = defaultdict(lambda: itertools.count(1_000_000))
+        self._file_ids = itertools.count(1)
+        self.uploaded_bytes = 0
+        # Updates empujadas aún sin respuesta: chat_id → instantes, callback_id/inline_query_id → instante
+        self._pending_chats: Dict[int, deque] = defaultdict(deque)
+        self._pending_callbacks: Dict[str, float] = {}
+        self._pending_inline: Dict[str, float] = {}
+        # Updates para getUpdates cuando no hay webhook
+        self._poll_queue: deque = deque()
+        self._poll_event = asyncio.Event()
+        self._server: Optional[HTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        """Valor para `ApplicationBuilder.base_url` (el token se añade detrás)"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {'api': self})])
+        sockets = bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(app)
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        if self._server is not None:
+            # Libera los getUpdates que estén esperando
+            self._poll_event.set()
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+    # ----------------- MÉTODOS DE LA API -----------------
+    async def handle(self, token: str, method: str, params: Dict) -> Tuple[int, Dict]:
+        received_at = time.perf_counter()
+        status, payload = 200, None
+
+        if method == 'getUpdates':
+            # Las llamadas de long polling no se registran: su duración es la espera
+            return status, {'ok': True, 'result': await self._get_updates(params)}
+
+        if method in FAULTY_METHODS:
+            delay, injected = self.faults.draw()
+            if delay:
+                await asyncio.sleep(delay)
+            if injected == 429:
+                status, payload = 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.faults.retry_after}",
+                    'parameters': {'retry_after': self.faults.retry_after},
+                }
+            elif injected == 500:
+                status, payload = 500, {'ok': False, 'error_code': 500, 'description': "Internal Server Error"}
+
+        if payload is None:
+            result = self._result(method, params)
+            if result is None:
+                status, payload = 404, {'ok': False, 'error_code': 404, 'description': "Not Found: method not found"}
+            else:
+                payload = {'ok': True, 'result': result}
+
+        # Solo una respuesta correcta cuenta como atención de la update
+        latency = self._match_update(method, params) if status == 200 else None
+        self.calls.append(CallRecord(method, params, received_at, status, latency))
+        return status, payload
+
+    def _result(self, method: str, params: Dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.secret_token = params.get('secret_token')
+            if str(params.get('drop_pending_updates')).lower() == 'true':
+                # Las entregas pendientes o en reintento se pierden
+                self._webhook_generation += 1
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method in ('answerCallbackQuery', 'answerInlineQuery'):
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            if 'inline_message_id' in params:
+                return True
+            chat_id = int(params['chat_id'])
+            message_id = (int(params['message_id']) if method == 'editMessageText'
+                          else next(self._message_ids[chat_id]))
+            message = {
+                'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+            }
+            if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+                message['reply_markup'] = params['reply_markup']
+            if method == 'editMessageText':
+                message['edit_date'] = int(time.time())
+            return message
+        if method == 'sendDocument':
+            chat_id = int(params['chat_id'])
+            document = params.get('document')
+            if isinstance(document, dict):
+                self.uploaded_bytes += document['size']
+                file_id = f"BQAC{next(self._file_ids)}"
+                document = {'file_id': file_id, 'file_unique_id': file_id, 'file_name': document['filename'],
+                            'file_size': document['size']}
+            else:
+                # Reenvío por file_id: no se sube nada
+                document = {'file_id': document, 'file_unique_id': document}
+            return {
+                'message_id': next(self._message_ids[chat_id]), 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'private'}, 'document': document,
+                'caption': params.get('caption', ''),
+            }
+        return None
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Un offset confirma todas las updates anteriores
+        while self._poll_queue and self._poll_queue[0]['update_id'] < offset:
+            self._poll_queue.popleft()
+        if not self._poll_queue and timeout:
+            self._poll_event.clear()
+            try:
+                await asyncio.wait_for(self._poll_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._poll_queue, limit))
+
+    def _match_update(self, method: str, params: Dict) -> Optional[float]:
+        pushed_at = None
+        if method == 'answerCallbackQuery':
+            pushed_at = self._pending_callbacks.pop(str(params.get('callback_query_id')), None)
+        elif method == 'answerInlineQuery':
+            pushed_at = self._pending_inline.pop(str(params.get('inline_query_id')), None)
+        elif 'chat_id' in params:
+            pending = self._pending_chats.get(int(params['chat_id']))
+            if pending:
+                pushed_at = pending.popleft()
+        return None if pushed_at is None else time.perf_counter() - pushed_at
+
+    # ----------------- ENVÍO DE UPDATES -----------------
+    async def push_updates(self, updates: Iterable[Dict], rate: float, concurrency: int = 64,
+                           retry_delay: Optional[float] = 0.05):
+        """Envía las updates al webhook registrado, o las encola para getUpdates, a `rate` updates/s
+
+        Como Telegram, una entrega fallida se reintenta (contra el webhook vigente
+        en ese momento) hasta que responde 200 o un setWebhook con
+        drop_pending_updates la descarta. `retry_delay=None` desactiva reintentos.
+        """
+        if not self.webhook_url:
+            await self._enqueue_updates(updates, rate)
+            return
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+            async def push(index: int, update: Dict):
+                await asyncio.sleep(max(0.0, start + index / rate - loop.time()))
+                generation = self._webhook_generation
+                async with semaphore:
+                    self._mark_pushed(update)
+                    while True:
+                        if generation != self._webhook_generation:
+                            self.push_statuses['dropped'] += 1
+                            self._forget_pushed(update)
+                            return
+                        try:
+                            response = await client.post(self.webhook_url or '', json=update,
+                                                         headers=self._webhook_headers())
+                            self.push_statuses[response.status_code] += 1
+                            if response.status_code == 200:
+                                return
+                        except httpx.HTTPError as e:
+                            self.push_statuses[type(e).__name__] += 1
+                        if retry_delay is None:
+                            return
+                        await asyncio.sleep(retry_delay)
+
+            await asyncio.gather(*(push(index, update) for index, update in enumerate(updates)))
+
+    def _webhook_headers(self) -> Dict[str, str]:
+        return {'X-Telegram-Bot-Api-Secret-Token': self.secret_token} if self.secret_token else {}
+
+    def _forget_pushed(self, update: Dict):
+        if 'callback_query' in update:
+            self._pending_callbacks.pop(update['callback_query']['id'], None)
+        elif 'inline_query' in update:
+            self._pending_inline.pop(update['inline_query']['id'], None)
+        else:
+            pending = self._pending_chats[update['message']['chat']['id']]
+            if pending:
+                pending.pop()
+
+    def _mark_pushed(self, update: Dict):
+        if 'callback_query' in update:
+            self._pending_callbacks[update['callback_query']['id']] = time.perf_counter()
+        elif 'inline_query' in update:
+            self._pending_inline[update['inline_query']['id']] = time.perf_counter()
+        else:
+            self._pending_chats[update['message']['chat']['id']].append(time.perf_counter())
+
+    async def _enqueue_updates(self, updates: Iterable[Dict], rate: float):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for index, update in enumerate(updates):
+            delay = start + index / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._mark_pushed(update)
+            self._poll_queue.append(update)
+            self._poll_event.set()
+            self.push_statuses['queued'] += 1
+
+    async def wait_idle(self, timeout: float = 10.0, settle: float = 0.2) -> bool:
+        """Espera a que todas las updates empujadas tengan respuesta"""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if not self.unanswered:
+                await asyncio.sleep(settle)
+                return True
+            await asyncio.sleep(0.02)
+        return False
+
+    # ----------------- MÉTRICAS -----------------
+    @property
+    def unanswered(self) -> int:
+        return (len(self._pending_callbacks) + len(self._pending_inline)
+                + sum(len(pending) for pending in self._pending_chats.values()))
+
+    def method_counts(self) -> Counter:
+        return Counter(call.method for call in self.calls)
+
+    def summary(self) -> Dict:
+        latencies = [call.update_latency for call in self.calls if call.update_latency is not None]
+        statuses = Counter(call.status for call in self.calls)
+        return {
+            'calls': len(self.calls),
+            'statuses': dict(statuses),
+            'methods': dict(self.method_counts()),
+            'answered_updates': len(latencies),
+            'unanswered_updates': self.unanswered,
+            'pushed': dict(self.push_statuses),
+            'p50_ms': round(1000 * percentile(latencies, 0.50), 2),
+            'p95_ms': round(1000 * percentile(latencies, 0.95), 2),
+            'p99_ms': round(1000 * percentile(latencies, 0.99), 2),
+            'max_ms': round(1000 * max(latencies, default=0.0), 2),
+            'uploaded_bytes': self.uploaded_bytes,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bot API local con fallos inyectables")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia fija por llamada (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Jitter uniforme adicional (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de error 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probabilidad de 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    async def serve():
+        api = FakeBotAPI(FaultPlan(args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                                   args.retry_after), args.host, args.port)
+        await api.start()
+        print(f"Bot API local en {api.base_url}<token>/<método>")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await api.stop()
+            print(json.dumps(api.summary(), indent=2))
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Cuestionarios declarativos
+Cada cuestionario vive en `flows/<nombre>.json` con sus preguntas,
+validadores, opciones y ramas. Al cargar se compila en una tabla de
+transiciones inmutable: el estado es el índice del paso en una tupla y cada
+botón o respuesta se resuelve con una búsqueda en un dict, así que un paso
+cuesta lo mismo en un cuestionario de 3 preguntas que en uno de 300. El
+progreso de cada usuario es (estado, vector de respuestas).
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from markup import MARKDOWN, MarkupError, validate as validate_markup
+
+FLOWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flows')
+
+# Estado final: el cuestionario está completo
+END = -1
+
+DEFAULT_ERROR = "⚠️ Respuesta no válida, inténtalo de nuevo:"
+
+
+class ValidationError(ValueError):
+    """Respuesta rechazada; `key` elige el mensaje de error de la pregunta"""
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.key = key
+
+
+# ----------------- VALIDADORES -----------------
+def _int_range(minimum: int, maximum: int) -> Callable[[str], int]:
+    def validate(text: str) -> int:
+        try:
+            value = int(text.strip())
+        except ValueError:
+            raise ValidationError('not_number')
+        if not minimum <= value <= maximum:
+            raise ValidationError('out_of_range')
+        return value
+    return validate
+
+
+def _text(max_length: int = 1000, lower: bool = False) -> Callable[[str], str]:
+    def validate(text: str) -> str:
+        value = text.strip()[:max_length]
+        if not value:
+            raise ValidationError('empty')
+        return value.lower() if lower else value
+    return validate
+
+
+VALIDATORS: Dict[str, Callable[..., Callable[[str], Any]]] = {
+    'int_range': _int_range,
+    'text': _text,
+}
+
+
+# ----------------- TABLA DE TRANSICIONES -----------------
+class Option(NamedTuple):
+    value: Any
+    next_state: int
+
+
+class Step(NamedTuple):
+    """Una pregunta compilada; todo lo que necesita un paso está precalculado"""
+    state: int
+    question: str
+    text: str
+    # Posición de la respuesta en el vector y campo del perfil donde se copia (si `profile`)
+    slot: int
+    field: str
+    profile: bool
+    keyboard: Optional[InlineKeyboardMarkup]
+    # callback_data → opción
+    options: Mapping[str, Option]
+    validate: Optional[Callable[[str], Any]]
+    errors: Mapping[str, str]
+    next_state: int
+    # Se salta si el perfil ya tiene este campo
+    skip_if: Optional[str]
+    skip_to: int
+
+
+class Transition(NamedTuple):
+    """Resultado de un paso: estado siguiente, respuesta aceptada o mensaje de error"""
+    state: int
+    step: Step
+    value: Any = None
+    error: Optional[str] = None
+
+
+class Flow:
+    """Cuestionario compilado (de solo lectura, compartido por todos los usuarios)"""
+
+    def __init__(self, name: str, tag: str, steps: Tuple[Step, ...], fields: Tuple[str, ...], start: int,
+                 parse_mode: Optional[str] = MARKDOWN):
+        self.name = name
+        self.tag = tag
+        self.parse_mode = parse_mode
+        self.steps = steps
+        self.fields = fields
+        self.start = start
+
+    @classmethod
+    def compile(cls, definition: Dict) -> 'Flow':
+        name = sys.intern(definition['name'])
+        tag = definition.get('tag', name[0])
+        parse_mode = definition.get('parse_mode', MARKDOWN)
+        questions = definition['questions']
+        states = {question['id']: state for state, question in enumerate(questions)}
+        if len(states) != len(questions):
+            raise ValueError(f"Cuestionario {name}: ids de pregunta duplicados")
+
+        def target(question_id: Optional[str], default: int) -> int:
+            if question_id is None:
+                return default
+            if question_id not in states:
+                raise ValueError(f"Cuestionario {name}: la pregunta {question_id!r} no existe")
+            return states[question_id]
+
+        # Varias preguntas pueden rellenar el mismo campo (p. ej. una opción "Otro" que pide texto)
+        fields: List[str] = []
+        for question in questions:
+            field = question.get('field', question['id'])
+            if field not in fields:
+                fields.append(sys.intern(field))
+
+        steps = []
+        for state, question in enumerate(questions):
+            # Sin `next` se pasa a la pregunta siguiente; la última termina
+            default_next = state + 1 if state + 1 < len(questions) else END
+            next_state = target(question.get('next'), default_next)
+            options = {}
+            rows = []
+            for index, option in enumerate(question.get('options', ())):
+                data = f"{tag}{state:x}:{index:x}"
+                if len(data.encode('utf-8')) > 64:
+                    raise ValueError(f"Cuestionario {name}: callback_data supera 64 bytes: {data!r}")
+                options[data] = Option(option.get('value'), target(option.get('next'), next_state))
+                rows.append([InlineKeyboardButton(option['label'], callback_data=data)])
+            spec = question.get('validator')
+            if spec is not None:
+                spec = dict(spec)
+                kind = spec.pop('type')
+                if kind not in VALIDATORS:
+                    raise ValueError(f"Cuestionario {name}: validador desconocido {kind!r}")
+                validate = VALIDATORS[kind](**spec)
+            else:
+                validate = None
+            if validate is None and not options:
+                raise ValueError(f"Cuestionario {name}: la pregunta {question['id']!r} no admite respuestas")
+            try:
+                validate_markup(question['text'], parse_mode)
+            except MarkupError as e:
+                raise MarkupError(f"Cuestionario {name}, pregunta {question['id']!r}: {e}") from None
+            field = sys.intern(question.get('field', question['id']))
+            steps.append(Step(
+                state=state,
+                question=sys.intern(question['id']),
+                text=question['text'],
+                slot=fields.index(field),
+                field=field,
+                profile=question.get('profile', False),
+                keyboard=InlineKeyboardMarkup(rows) if rows else None,
+                options=MappingProxyType(options),
+                validate=validate,
+                errors=MappingProxyType(dict(question.get('errors', {}))),
+                next_state=next_state,
+                skip_if=question.get('skip_if'),
+                skip_to=target(question.get('skip_to'), next_state),
+            ))
+
+        return cls(name, tag, tuple(steps), tuple(fields), target(definition.get('start'), 0), parse_mode)
+
+    def _enter(self, state: int, profile: Dict) -> int:
+        """Avanza sobre las preguntas cuyo dato ya está en el perfil"""
+        # Acotado por el número de pasos: un ciclo de saltos mal definido no cuelga el bot
+        for _ in range(len(self.steps)):
+            if state == END:
+                break
+            step = self.steps[state]
+            if step.skip_if is None or profile.get(step.skip_if) is None:
+                break
+            state = step.skip_to
+        return state
+
+    def begin(self, profile: Dict) -> Tuple[int, List[Any]]:
+        """Estado inicial y vector de respuestas vacío"""
+        return self._enter(self.start, profile), [None] * len(self.fields)
+
+    def step(self, state: int) -> Step:
+        return self.steps[state]
+
+    def advance(self, state: int, answers: List[Any], profile: Dict,
+                text: Optional[str] = None, data: Optional[str] = None) -> Transition:
+        """Aplica un mensaje (`text`) o un botón (`data`) a la pregunta actual
+
+        Guarda la respuesta en `answers`; con error el estado no cambia.
+        """
+        step = self.steps[state]
+        if data is not None:
+            option = step.options.get(data)
+            if option is None:
+                # Botón de otra pregunta o de un mensaje antiguo
+                return Transition(state, step)
+            value, next_state = option
+        elif step.validate is not None:
+            try:
+                value = step.validate(text or '')
+            except ValidationError as e:
+                return Transition(state, step, error=step.errors.get(e.key, DEFAULT_ERROR))
+            next_state = step.next_state
+        else:
+            return Transition(state, step, error=step.errors.get('choose', DEFAULT_ERROR))
+        if value is not None:
+            answers[step.slot] = value
+        return Transition(self._enter(next_state, profile), step, value)
+
+    def results(self, answers: List[Any]) -> Dict[str, Any]:
+        return dict(zip(self.fields, answers))
+
+
+@lru_cache(maxsize=None)
+def load_flows(directory: str = FLOWS_DIR) -> Mapping[str, Flow]:
+    """Compila los cuestionarios una vez por proceso"""
+    flows = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            flow = Flow.compile(json.load(f))
+        if flow.name in flows:
+            raise ValueError(f"Cuestionario duplicado: {flow.name}")
+        flows[flow.name] = flow
+    tags = [flow.tag for flow in flows.values()]
+    if len(set(tags)) != len(tags):
+        raise ValueError("Etiquetas de cuestionario duplicadas")
+    return MappingProxyType(flows)
+
+
+def callback_pattern(flows: Mapping[str, Flow]) -> str:
+    """Regex que acepta solo los callback_data de las opciones de estos cuestionarios"""
+    tags = '|'.join(re.escape(flow.tag) for flow in flows.values())
+    return f"^(?:{tags})[0-9a-f]+:[0-9a-f]+$"
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Catálogo de mensajes multilingüe
+Cada idioma vive en `locales/<código>.json` con sus mensajes, palabras clave
+por intent y marcadores para detectar el idioma. Las plantillas se compilan una
+sola vez al cargar y quedan en estructuras inmutables con cadenas internadas;
+al compilarlas se valida su formato (parse_mode del catálogo) y cada campo
+recibe la tabla de escape que le corresponde.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+from string import Formatter
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+from markup import FIELD_MARK, MARKDOWN, Markup, MarkupError, escape_table, field_contexts
+
+DEFAULT_LANGUAGE = 'es'
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class Template:
+    """Plantilla precompilada: literales y nombres de campo alternados
+
+    Los valores se escapan según la posición del campo; los `Markup` (otros
+    mensajes ya renderizados) se insertan tal cual.
+    """
+    __slots__ = ('key', 'literals', 'fields', 'escapes', 'static')
+
+    def __init__(self, key: str, source: str, parse_mode: Optional[str] = MARKDOWN):
+        literals = ['']
+        fields = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            literals[-1] += literal
+            if field is not None:
+                if spec or conversion:
+                    raise ValueError(f"Plantilla {key}: formato no soportado en {{{field}}}")
+                fields.append(sys.intern(field))
+                literals.append('')
+        try:
+            contexts = field_contexts(FIELD_MARK.join(literals), parse_mode)
+        except MarkupError as e:
+            raise MarkupError(f"Plantilla {key}: {e}") from None
+        self.key = sys.intern(key)
+        self.literals = tuple(sys.intern(literal) for literal in literals)
+        self.fields = tuple(fields)
+        self.escapes = tuple(escape_table(parse_mode, context) for context in contexts)
+        self.static = Markup(self.literals[0]) if not fields else None
+
+    def render(self, **values) -> Markup:
+        if self.static is not None:
+            return self.static
+        parts = [self.literals[0]]
+        for field, table, literal in zip(self.fields, self.escapes, self.literals[1:]):
+            value = values[field]
+            parts.append(value if isinstance(value, Markup) else str(value).translate(table))
+            parts.append(literal)
+        return Markup(''.join(parts))
+
+    def __repr__(self):
+        return f"Template({self.key!r}, fields={self.fields})"
+
+
+class LanguagePack:
+    """Mensajes e índice de intents de un idioma (de solo lectura)"""
+    __slots__ = ('code', 'name', 'messages', 'intents')
+
+    def __init__(self, code: str, name: str, messages: Mapping[str, Template],
+                 intents: Tuple[Tuple[str, Tuple[str, ...]], ...]):
+        self.code = code
+        self.name = name
+        self.messages = messages
+        self.intents = intents
+
+
+class MessageCatalog:
+    """Acceso a mensajes por idioma, detección de idioma e intents"""
+
+    def __init__(self, packs: Dict[str, LanguagePack], markers: Dict[str, str],
+                 default: str = DEFAULT_LANGUAGE, parse_mode: Optional[str] = MARKDOWN):
+        if default not in packs:
+            raise ValueError(f"Idioma por defecto sin catálogo: {default}")
+        self.packs: Mapping[str, LanguagePack] = MappingProxyType(packs)
+        self.default = default
+        # Formato con el que se envían todos los mensajes del catálogo
+        self.parse_mode = parse_mode
+        # token → idioma, un único dict para todos los idiomas
+        self.markers: Mapping[str, str] = MappingProxyType(markers)
+
+    @classmethod
+    def load(cls, directory: str = LOCALES_DIR, default: str = DEFAULT_LANGUAGE) -> 'MessageCatalog':
+        packs = {}
+        markers = {}
+        reference_keys = None
+        parse_modes = set()
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            code = sys.intern(data['language'])
+            parse_mode = data.get('parse_mode', MARKDOWN)
+            parse_modes.add(parse_mode)
+            messages = {
+                sys.intern(key): Template(key, source, parse_mode) for key, source in data['messages'].items()
+            }
+            intents = tuple(
+                (sys.intern(intent), tuple(sys.intern(keyword) for keyword in keywords))
+                for intent, keywords in data['intents'].items()
+            )
+            packs[code] = LanguagePack(code, data.get('name', code), MappingProxyType(messages), intents)
+            for marker in data.get('markers', []):
+                # Un marcador ambiguo no aporta información: se descarta
+                markers[marker] = code if markers.get(marker, code) == code else ''
+            if code == default:
+                reference_keys = set(messages)
+
+        if reference_keys is not None:
+            for code, pack in packs.items():
+                missing = reference_keys - set(pack.messages)
+                if missing:
+                    raise ValueError(f"Catálogo '{code}' incompleto: faltan {sorted(missing)}")
+        # Los handlers envían con un único parse_mode: migrar de formato es migrar todos los idiomas
+        if len(parse_modes) > 1:
+            raise ValueError(f"Catálogos con parse_mode distintos: {sorted(parse_modes)}")
+
+        return cls(packs, {marker: code for marker, code in markers.items() if code}, default,
+                   parse_modes.pop() if parse_modes else MARKDOWN)
+
+    @property
+    def languages(self) -> Tuple[str, ...]:
+        return tuple(self.packs)
+
+    def pack(self, language: Optional[str]) -> LanguagePack:
+        return self.packs.get(language) or self.packs[self.default]
+
+    def text(self, language: Optional[str], key: str, **values) -> Markup:
+        return self.pack(language).messages[key].render(**values)
+
+    def resolve(self, language_code: Optional[str], default: Optional[str] = None) -> str:
+        """Convierte un código tipo 'en-US' de Telegram en un idioma soportado, o en `default`"""
+        if language_code:
+            code = language_code.split('-')[0].lower()
+            if code in self.packs:
+                return code
+        return default or self.default
+
+    def detect_language(self, text: str) -> Optional[str]:
+        """Una sola pasada sobre los tokens contando marcadores; None si no hay evidencia"""
+        counts: Dict[str, int] = {}
+        markers = self.markers
+        for token in _TOKEN_RE.findall(text.lower()):
+            code = markers.get(token)
+            if code:
+                counts[code] = counts.get(code, 0) + 1
+        if not counts:
+            return None
+        return max(counts, key=counts.get)
+
+    def detect_intent(self, language: Optional[str], text: str) -> str:
+        """Primera categoría cuyas palabras clave aparecen en el texto (solo del idioma dado)"""
+        for intent, keywords in self.pack(language).intents:
+            for keyword in keywords:
+                if keyword in text:
+                    return intent
+        return 'general'
+
+
+@lru_cache(maxsize=None)
+def load_catalog(directory: str = LOCALES_DIR) -> MessageCatalog:
+    """Carga el catálogo una vez por proceso"""
+    return MessageCatalog.load(directory)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda en modo inline
+"@bot sífilis" o "@bot clínica guadalajara" desde cualquier chat. Las
+enfermedades de `ets_database` y los centros de `medical_centers` se indexan
+al arrancar en un array ordenado de términos: cada término de la consulta,
+aunque esté a medio escribir, es un rango contiguo que se localiza con dos
+búsquedas binarias. Los InlineQueryResultArticle se construyen una sola vez
+y las respuestas se guardan en un LRU por consulta normalizada, porque cada
+pulsación de tecla es una consulta nueva y muchas se repiten entre usuarios.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from markup import MARKDOWN, escape, escape_table
+from opening_hours import clinic_key
+from search import tokenize
+
+# Telegram admite hasta 50 resultados por respuesta
+RESULTS_PER_PAGE = 20
+
+# Cualquier término que empiece por el prefijo queda en [prefijo, prefijo + _PREFIX_END)
+_PREFIX_END = '\uffff'
+
+# Palabras con las que se busca cualquier centro, además de su nombre, ciudad y servicios
+CENTER_ALIASES = "clinica centro centros hospital salud consulta"
+
+# Respuesta: resultados de la página y offset de la siguiente ('' si no hay más)
+Answer = Tuple[List[InlineQueryResultArticle], str]
+
+# Dentro de *negrita* no hay escape posible en Markdown clásico: se quita el '*'
+_IN_BOLD = escape_table(MARKDOWN, '*')
+
+
+def _ets_article(ets_key: str, ets: Dict) -> InlineQueryResultArticle:
+    name = ets.get('nombre', ets_key)
+    lines = [f"🦠 *{name.translate(_IN_BOLD)}*", "", escape(ets.get('info', ''))]
+    if ets.get('tratamiento'):
+        lines += ["", f"💊 Tratamiento: {escape(ets['tratamiento'])}"]
+    if ets.get('prevencion'):
+        lines += [f"🛡️ Prevención: {escape(', '.join(ets['prevencion']))}"]
+    if ets.get('tiempo_sintomas'):
+        lines += [f"⏱️ Aparición: {escape(ets['tiempo_sintomas'])}"]
+    lines += ["", "_Solo un profesional médico puede realizar un diagnóstico._"]
+    return InlineQueryResultArticle(
+        id=f"e:{ets_key}"[:64],
+        title=name,
+        description=ets.get('info', ''),
+        input_message_content=InputTextMessageContent('\n'.join(lines), parse_mode=MARKDOWN),
+    )
+
+
+def _center_article(key: str, city_name: str, center: Dict) -> InlineQueryResultArticle:
+    lines = [
+        f"🏥 *{center['nombre'].translate(_IN_BOLD)}*",
+        f"📍 {escape(center.get('direccion', ''))}, {escape(city_name)}",
+    ]
+    if center.get('telefono'):
+        lines.append(f"📞 {escape(center['telefono'])}")
+    if center.get('horarios'):
+        lines.append(f"🕐 {escape(center['horarios'])}")
+    if center.get('servicios'):
+        lines.append(f"🩺 {escape(', '.join(center['servicios']))}")
+    return InlineQueryResultArticle(
+        id=f"c:{key}"[:64],
+        title=center['nombre'],
+        description=f"{city_name} · {center.get('direccion', '')}",
+        input_message_content=InputTextMessageContent('\n'.join(lines), parse_mode=MARKDOWN),
+    )
+
+
+class InlineIndex:
+    """Artículos precalculados y array ordenado de (término, documento) para buscar por prefijo"""
+
+    def __init__(self, cache_size: int = 10_000):
+        self.articles: List[InlineQueryResultArticle] = []
+        self.terms: List[str] = []
+        self.doc_ids = array('I')
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[int, ...]]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def build(cls, ets_database: Dict, medical_centers: Dict, **kwargs) -> 'InlineIndex':
+        index = cls(**kwargs)
+        postings = []
+        for ets_key, ets in ets_database.items():
+            text = f"{ets.get('nombre', ets_key)} {ets_key.replace('_', ' ')} {ets.get('tipo', '')} ets"
+            postings.extend((term, len(index.articles)) for term in set(tokenize(text)))
+            index.articles.append(_ets_article(ets_key, ets))
+        for city, city_data in medical_centers.items():
+            city_name = city_data.get('nombre', city)
+            for position, center in enumerate(city_data['centros']):
+                text = (f"{center['nombre']} {city_name} {city.replace('_', ' ')} "
+                        f"{' '.join(center.get('servicios', ()))} {CENTER_ALIASES}")
+                postings.extend((term, len(index.articles)) for term in set(tokenize(text)))
+                index.articles.append(_center_article(clinic_key(city, position), city_name, center))
+        postings.sort()
+        index.terms = [term for term, _ in postings]
+        index.doc_ids = array('I', (doc_id for _, doc_id in postings))
+        return index
+
+    def _prefix_docs(self, prefix: str) -> set:
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + _PREFIX_END, start)
+        return set(self.doc_ids[start:end])
+
+    def search(self, query: str) -> Tuple[int, ...]:
+        """Documentos que contienen todos los términos de la consulta (el último puede estar incompleto)"""
+        tokens = tokenize(query)
+        key = ' '.join(tokens)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return cached
+        self.stats['misses'] += 1
+        if not tokens:
+            found = tuple(range(len(self.articles)))
+        else:
+            # Empezar por el rango más corto acota el tamaño de las intersecciones
+            ranges = sorted((self._prefix_docs(token) for token in set(tokens)), key=len)
+            matches = ranges[0]
+            for docs in ranges[1:]:
+                if not matches:
+                    break
+                matches = matches & docs
+            found = tuple(sorted(matches))
+        self._cache[key] = found
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return found
+
+    def answer(self, query: str, offset: Optional[str] = None, limit: int = RESULTS_PER_PAGE) -> Answer:
+        found = self.search(query)
+        start = int(offset) if offset and offset.isdigit() else 0
+        end = start + limit
+        articles = self.articles
+        return [articles[doc_id] for doc_id in found[start:end]], str(end) if end < len(found) else ''
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Ciclo de vida del webhook
+Arranque: inicializa, pre-calienta (post_init) y empieza a procesar antes de
+registrar el webhook, sin descartar las updates que Telegram acumuló durante
+el despliegue. Parada (SIGTERM/SIGINT): cierra el servidor del webhook para
+que Telegram reintente contra la nueva instancia, drena las updates en curso
+con un plazo y vacía los buffers (post_shutdown).
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Aproximación al inicio del proceso: este módulo se importa al cargar el bot
+PROCESS_STARTED = time.perf_counter()
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+@contextmanager
+def shutdown_requested():
+    """Evento que SIGTERM o SIGINT activan mientras dure el bloque"""
+    loop = asyncio.get_running_loop()
+    requested = asyncio.Event()
+    for sig in SHUTDOWN_SIGNALS:
+        loop.add_signal_handler(sig, requested.set)
+    try:
+        yield requested
+    finally:
+        for sig in SHUTDOWN_SIGNALS:
+            loop.remove_signal_handler(sig)
+
+
+async def drain(application: Application, timeout: float) -> bool:
+    """Detiene la Application esperando a las updates en curso; False si se agotó el plazo"""
+    if not application.running:
+        return True
+    stopping = asyncio.ensure_future(application.stop())
+    try:
+        await asyncio.wait_for(asyncio.shield(stopping), timeout)
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f"Plazo de drenado agotado ({timeout}s); "
+                       f"{application.update_queue.qsize()} updates sin procesar")
+        stopping.cancel()
+        return False
+
+
+async def finish(application: Application):
+    """post_stop, shutdown y post_shutdown; los buffers se vacían aunque el apagado falle"""
+    if application.post_stop:
+        await application.post_stop(application)
+    try:
+        await application.shutdown()
+    finally:
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class WebhookLifecycle:
+    """Arranque y parada ordenados de una Application en modo webhook"""
+
+    def __init__(self, application: Application, listen: str, port: int, url_path: str, webhook_url: str,
+                 drain_timeout: float = 25.0, before_drain: Optional[Callable[[], Awaitable[None]]] = None,
+                 started_at: float = PROCESS_STARTED):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.url_path = url_path
+        self.webhook_url = webhook_url
+        self.drain_timeout = drain_timeout
+        self.before_drain = before_drain
+        self.started_at = started_at
+        self.timings: Dict[str, float] = {}
+        self.drained: Optional[bool] = None
+
+    async def start(self):
+        app = self.application
+        begin = time.perf_counter()
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        self.timings['prewarm_s'] = time.perf_counter() - begin
+
+        # Procesar desde ya: el backlog del despliegue llega en cuanto se registra el webhook
+        await app.start()
+        begin = time.perf_counter()
+        await app.updater.start_webhook(
+            listen=self.listen,
+            port=self.port,
+            url_path=self.url_path,
+            webhook_url=self.webhook_url,
+            drop_pending_updates=False
+        )
+        self.timings['set_webhook_s'] = time.perf_counter() - begin
+        self.timings['time_to_ready_s'] = time.perf_counter() - self.started_at
+        logger.info(f"Listo en {self.timings['time_to_ready_s']:.2f}s "
+                    f"(pre-calentamiento {self.timings['prewarm_s']:.2f}s)")
+
+    async def stop(self):
+        app = self.application
+        begin = time.perf_counter()
+        # Sin servidor, Telegram reintenta las entregas nuevas contra la siguiente instancia
+        if app.updater.running:
+            await app.updater.stop()
+        if self.before_drain:
+            await self.before_drain()
+
+        self.drained = await drain(app, self.drain_timeout)
+        self.timings['drain_s'] = time.perf_counter() - begin
+
+        # Los buffers se vacían aunque el drenado no haya terminado
+        await finish(app)
+        logger.info(f"Parada completa en {time.perf_counter() - begin:.2f}s (drenado completo: {self.drained})")
+
+    async def run(self):
+        """Atiende el webhook hasta recibir SIGTERM o SIGINT"""
+        try:
+            with shutdown_requested() as stop_requested:
+                await self.start()
+                await stop_requested.wait()
+                logger.info("Señal de parada recibida")
+        finally:
+            await self.stop()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Logging estructurado y no bloqueante
+Los registros se encolan con un QueueHandler y un hilo QueueListener los
+escribe como JSON. Cada registro lleva el usuario y la update en curso; el
+texto del usuario se redacta y cada logger puede muestrearse.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+# Contexto de la update que se está procesando
+current_user_id: contextvars.ContextVar = contextvars.ContextVar('current_user_id', default=None)
+current_update_id: contextvars.ContextVar = contextvars.ContextVar('current_update_id', default=None)
+current_user_text: contextvars.ContextVar = contextvars.ContextVar('current_user_text', default=None)
+
+# Campos `extra` que nunca deben salir en claro
+SENSITIVE_FIELDS = frozenset({'last_symptoms', 'last_message', 'symptoms', 'text'})
+REDACTED = '[REDACTED]'
+
+# Librerías que en DEBUG vuelcan updates y cuerpos HTTP completos (texto del
+# usuario incluido) sin pasar por el contexto; nunca bajan de INFO
+PAYLOAD_LOGGERS = ('telegram', 'httpx', 'httpcore')
+
+_RESERVED = frozenset(vars(logging.makeLogRecord({})).keys()) | {'message', 'asctime'}
+
+
+def set_update_context(user_id: Optional[int], update_id: Optional[int], text: Optional[str] = None):
+    """Fija los ids de correlación y el texto a redactar para la tarea actual"""
+    current_user_id.set(user_id)
+    current_update_id.set(update_id)
+    current_user_text.set(text)
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {key: REDACTED if key in SENSITIVE_FIELDS else _redact(item) for key, item in value.items()}
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar una fracción de los registros por logger; WARNING o más siempre pasa"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._random = random.random
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(record.name)
+        if rate is None:
+            # Buscar la tasa del logger padre más cercano ('telegram.ext' → 'telegram')
+            name = record.name
+            while '.' in name and rate is None:
+                name = name.rsplit('.', 1)[0]
+                rate = self.rates.get(name)
+            self.rates[record.name] = rate = 1.0 if rate is None else rate
+        return rate >= 1.0 or self._random() < rate
+
+
+class ContextFilter(logging.Filter):
+    """Añade ids de correlación y redacta el texto del usuario antes de encolar"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.user_id = current_user_id.get()
+        record.update_id = current_update_id.get()
+
+        if record.args:
+            record.args = tuple(_redact(arg) for arg in record.args) if isinstance(record.args, tuple) \
+                else _redact(record.args)
+        for field in SENSITIVE_FIELDS & record.__dict__.keys():
+            setattr(record, field, REDACTED)
+
+        text = current_user_text.get()
+        if text:
+            message = record.getMessage()
+            if text in message:
+                record.msg = message.replace(text, REDACTED)
+                record.args = None
+        return True
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que solo resuelve el mensaje; sin copiar el registro ni formatearlo aquí"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Se formatea aquí para no retener los frames del traceback en la cola
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea; los campos `extra` se incluyen tal cual"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                payload[key] = value
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_sampling(spec: Optional[str]) -> Dict[str, float]:
+    """'telegram:0.1,ets_bot:0.5' → {'telegram': 0.1, 'ets_bot': 0.5}"""
+    rates = {}
+    for item in (spec or '').split(','):
+        if ':' in item:
+            name, rate = item.rsplit(':', 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = 'INFO', fmt: str = 'json', sampling: Optional[Dict[str, float]] = None,
+                      stream=None) -> logging.handlers.QueueListener:
+    """Instala el pipeline en el logger raíz y arranca el hilo de escritura"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [user=%(user_id)s update=%(update_id)s] %(message)s'
+        ))
+
+    queue_handler = RecordQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(dict(sampling or {})))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    payload_level = max(root.getEffectiveLevel(), logging.INFO)
+    for name in PAYLOAD_LOGGERS:
+        logging.getLogger(name).setLevel(payload_level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Texto con formato para Telegram
+Valida las plantillas estáticas con las mismas reglas que aplica Telegram
+(Markdown, MarkdownV2 o HTML) y calcula, para cada campo interpolado, la
+tabla de escape que corresponde a su posición: fuera de entidades se escapa
+con barra invertida; dentro de una entidad de Markdown clásico, donde no hay
+escape posible, se elimina el carácter que la cerraría. `Markup` marca el
+texto que ya viene formateado (otros mensajes del catálogo) y no se escapa.
+"""
+
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+MARKDOWN = 'Markdown'
+MARKDOWN_V2 = 'MarkdownV2'
+HTML = 'HTML'
+PARSE_MODES = (MARKDOWN, MARKDOWN_V2, HTML)
+
+# Marca la posición de un campo al validar una plantilla
+FIELD_MARK = '\x00'
+
+_MARKDOWN_SPECIAL = '_*`['
+_MARKDOWN_V2_SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+_HTML_TAGS = frozenset({
+    'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'span', 'tg-spoiler', 'a', 'code', 'pre',
+    'blockquote', 'tg-emoji',
+})
+
+# Tabla de escape por (parse_mode, contexto); el contexto es el delimitador que cierra la
+# entidad donde cae el campo, o None fuera de entidades
+EscapeTable = Dict[int, Optional[str]]
+_TABLES: Dict[Tuple[Optional[str], Optional[str]], EscapeTable] = {
+    (MARKDOWN, None): str.maketrans({char: '\\' + char for char in _MARKDOWN_SPECIAL}),
+    (MARKDOWN_V2, None): str.maketrans({char: '\\' + char for char in _MARKDOWN_V2_SPECIAL}),
+    (HTML, None): str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}),
+    (None, None): {},
+}
+
+
+class MarkupError(ValueError):
+    """El texto no se puede enviar con ese parse_mode: Telegram lo rechazaría"""
+
+
+class Markup(str):
+    """Texto ya formateado para el parse_mode de destino: se interpola sin escapar"""
+    __slots__ = ()
+
+
+def escape_table(parse_mode: Optional[str], context: Optional[str] = None) -> EscapeTable:
+    table = _TABLES.get((parse_mode, context))
+    if table is None:
+        if parse_mode not in PARSE_MODES:
+            raise ValueError(f"parse_mode no soportado: {parse_mode!r}")
+        # Dentro de una entidad de Markdown clásico: quitar lo que la cerraría
+        table = _TABLES[(parse_mode, context)] = str.maketrans('', '', context)
+    return table
+
+
+def escape(value, parse_mode: Optional[str] = MARKDOWN) -> str:
+    """Escapa un valor para interpolarlo fuera de entidades; Markup se deja tal cual"""
+    if isinstance(value, Markup):
+        return value
+    return str(value).translate(escape_table(parse_mode))
+
+
+# ----------------- VALIDACIÓN -----------------
+def _scan_markdown(text: str) -> List[Optional[str]]:
+    """Markdown clásico: entidades sin anidar que terminan en la siguiente aparición del delimitador"""
+    contexts: List[Optional[str]] = []
+    position = 0
+    length = len(text)
+    while position < length:
+        char = text[position]
+        if char == FIELD_MARK:
+            contexts.append(None)
+        elif char == '\\' and position + 1 < length and text[position + 1] in _MARKDOWN_SPECIAL:
+            position += 1
+        elif char in _MARKDOWN_SPECIAL:
+            if text.startswith('```', position):
+                closing, start = '```', position + 3
+            else:
+                closing, start = (']' if char == '[' else char), position + 1
+            end = text.find(closing, start)
+            if end < 0:
+                raise MarkupError(f"Entidad {char!r} sin cerrar en la posición {position}")
+            contexts.extend(closing[0] for _ in range(text.count(FIELD_MARK, start, end)))
+            position = end + len(closing)
+            if char == '[' and text.startswith('(', position):
+                end = text.find(')', position)
+                if end < 0:
+                    raise MarkupError(f"Enlace sin cerrar en la posición {position}")
+                contexts.extend(')' for _ in range(text.count(FIELD_MARK, position, end)))
+                position = end + 1
+            continue
+        position += 1
+    return contexts
+
+
+def _scan_markdown_v2(text: str) -> List[Optional[str]]:
+    """MarkdownV2: entidades anidables y todo carácter reservado suelto debe ir escapado"""
+    contexts: List[Optional[str]] = []
+    stack: List[str] = []
+    position = 0
+    length = len(text)
+    while position < length:
+        char = text[position]
+        code = bool(stack) and stack[-1] in ('`', '```')
+        if char == FIELD_MARK:
+            contexts.append(None)
+        elif char == '\\':
+            if position + 1 == length:
+                raise MarkupError("Barra invertida al final del texto")
+            position += 1
+        elif code and not text.startswith(stack[-1], position):
+            # Dentro de código solo cuentan el cierre y las barras invertidas
+            pass
+        elif char in '*_~|`[]':
+            token = char
+            for long_token in ('```', '__', '||'):
+                if text.startswith(long_token, position):
+                    token = long_token
+                    break
+            if token == '|':
+                raise MarkupError(f"'|' sin escapar en la posición {position}")
+            if token == ']':
+                if not stack or stack[-1] != '[':
+                    raise MarkupError(f"']' sin abrir en la posición {position}")
+                stack.pop()
+                if text.startswith('(', position + 1):
+                    end = text.find(')', position + 1)
+                    if end < 0:
+                        raise MarkupError(f"Enlace sin cerrar en la posición {position}")
+                    position = end
+            elif stack and stack[-1] == token:
+                stack.pop()
+            elif token in stack:
+                raise MarkupError(f"Entidades cruzadas en la posición {position}")
+            else:
+                stack.append(token)
+            position += len(token)
+            continue
+        elif char in _MARKDOWN_V2_SPECIAL:
+            raise MarkupError(f"Carácter reservado {char!r} sin escapar en la posición {position}")
+        position += 1
+    if stack:
+        raise MarkupError(f"Entidad {stack[-1]!r} sin cerrar")
+    return contexts
+
+
+class _HTMLChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in _HTML_TAGS:
+            raise MarkupError(f"Etiqueta no admitida: <{tag}>")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            raise MarkupError(f"</{tag}> sin abrir")
+        self.stack.pop()
+
+    def handle_data(self, data):
+        # Las entidades válidas (&amp;) llegan por handle_entityref, no como datos
+        for char in '<>&':
+            if char in data:
+                raise MarkupError(f"{char!r} sin escapar")
+
+
+def _scan_html(text: str) -> List[Optional[str]]:
+    checker = _HTMLChecker()
+    checker.feed(text)
+    checker.close()
+    if checker.stack:
+        raise MarkupError(f"<{checker.stack[-1]}> sin cerrar")
+    return [None] * text.count(FIELD_MARK)
+
+
+_SCANNERS = {MARKDOWN: _scan_markdown, MARKDOWN_V2: _scan_markdown_v2, HTML: _scan_html}
+
+
+def field_contexts(text: str, parse_mode: Optional[str]) -> List[Optional[str]]:
+    """Valida `text` (con FIELD_MARK en lugar de cada campo) y devuelve el contexto de cada campo
+
+    Lanza MarkupError si Telegram rechazaría el texto.
+    """
+    if parse_mode is None:
+        return [None] * text.count(FIELD_MARK)
+    if parse_mode not in _SCANNERS:
+        raise ValueError(f"parse_mode no soportado: {parse_mode!r}")
+    return _SCANNERS[parse_mode](text)
+
+
+def validate(text: str, parse_mode: Optional[str]):
+    """Comprueba un texto ya renderizado"""
+    field_contexts(text, parse_mode)
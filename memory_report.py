@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Contabilidad de memoria por subsistema
+Tamaños profundos y número de objetos de las estructuras del bot, snapshots
+de tracemalloc con diff bajo demanda y máximo histórico (high-water mark).
+"""
+
+import asyncio
+import gc
+import resource
+import sys
+import tracemalloc
+from collections import deque
+from itertools import islice
+from types import BuiltinFunctionType, CoroutineType, FrameType, FunctionType, MethodType, ModuleType
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+# Código, tipos y el event loop se comparten entre todo el proceso: no se atribuyen a
+# nadie (desde un frame o el loop se alcanzaría el bot entero)
+_OPAQUE = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType, FrameType, CoroutineType,
+           asyncio.AbstractEventLoop)
+
+# Mapas más grandes que esto se estiman a partir de una muestra
+SAMPLE_LIMIT = 2_000
+
+
+class Footprint(NamedTuple):
+    objects: int
+    bytes: int
+    estimated: bool = False
+
+
+def _referents(obj) -> Iterable:
+    if isinstance(obj, dict):
+        return list(obj.keys()) + list(obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return obj
+    return gc.get_referents(obj)
+
+
+def deep_sizeof(obj, seen: Optional[Set[int]] = None) -> Footprint:
+    """Suma sys.getsizeof de todo lo alcanzable desde `obj` sin pasar dos veces por un objeto
+
+    `seen` puede compartirse entre llamadas para atribuir cada objeto al primer
+    subsistema que lo alcanza.
+    """
+    if seen is None:
+        seen = set()
+    objects = size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE):
+            continue
+        seen.add(id(current))
+        objects += 1
+        size += sys.getsizeof(current)
+        stack.extend(_referents(current))
+    return Footprint(objects, size)
+
+
+def deep_sizeof_mapping(mapping: Dict, seen: Optional[Set[int]] = None,
+                        sample_limit: int = SAMPLE_LIMIT) -> Footprint:
+    """Como deep_sizeof, pero extrapola desde una muestra de entradas en mapas grandes"""
+    if len(mapping) <= sample_limit:
+        return deep_sizeof(mapping, seen)
+    if seen is None:
+        seen = set()
+    seen.add(id(mapping))
+    objects, size = 0, 0
+    for key, value in islice(mapping.items(), sample_limit):
+        for part in (deep_sizeof(key, seen), deep_sizeof(value, seen)):
+            objects += part.objects
+            size += part.bytes
+    scale = len(mapping) / sample_limit
+    return Footprint(1 + int(objects * scale), sys.getsizeof(mapping) + int(size * scale), True)
+
+
+def process_memory() -> Dict[str, int]:
+    """RSS actual y máximo del proceso en bytes"""
+    usage = {'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/statm') as statm:
+            usage['rss'] = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        pass
+    return usage
+
+
+def subsystem_footprints(parts: Dict[str, object]) -> Dict[str, Footprint]:
+    """Tamaño de cada subsistema en el orden dado; lo compartido cuenta para el primero"""
+    seen: Set[int] = set()
+    footprints = {}
+    for name, part in parts.items():
+        if isinstance(part, dict):
+            footprints[name] = deep_sizeof_mapping(part, seen)
+        else:
+            footprints[name] = deep_sizeof(part, seen)
+    return footprints
+
+
+class MemoryProfiler:
+    """Snapshots de tracemalloc bajo demanda; sin snapshot activo no hay costo de rastreo"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.peak = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def snapshot(self) -> int:
+        """Inicia el rastreo si hace falta y fija la línea base; devuelve bytes rastreados"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.baseline = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        return current
+
+    def diff(self, limit: int = 10) -> List[str]:
+        """Las `limit` líneas que más crecieron desde la línea base, que pasa a ser el snapshot nuevo"""
+        if self.baseline is None:
+            self.snapshot()
+            return []
+        current = tracemalloc.take_snapshot()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = current.filter_traces(filters).compare_to(self.baseline.filter_traces(filters), 'lineno')
+        self.baseline = current
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        return [str(stat) for stat in stats[:limit]]
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.baseline = None
+
+    def high_water(self) -> Dict[str, int]:
+        marks = process_memory()
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if self.peak:
+            marks['traced_peak'] = self.peak
+        return marks
+
+
+def format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_report(footprints: Dict[str, Footprint], marks: Dict[str, int], users: int = 0) -> str:
+    lines = ["Memoria por subsistema (≈ = estimado por muestreo)"]
+    total = 0
+    for name, footprint in footprints.items():
+        total += footprint.bytes
+        approx = '≈' if footprint.estimated else ' '
+        lines.append(f"{name:<16}{approx}{format_bytes(footprint.bytes):>10}  {footprint.objects:>9} obj")
+    lines.append(f"{'total':<16} {format_bytes(total):>10}")
+    if users:
+        per_user = (footprints.get('sessions', Footprint(0, 0)).bytes
+                    + footprints.get('user_data', Footprint(0, 0)).bytes) / users
+        lines.append(f"por usuario      {format_bytes(int(per_user)):>10}  ({users} usuarios)")
+    for key, label in (('rss', 'RSS'), ('max_rss', 'RSS máximo'), ('traced_peak', 'pico tracemalloc')):
+        if key in marks:
+            lines.append(f"{label:<16} {format_bytes(marks[key]):>10}")
+    return "\n".join(lines)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Estado del último render de cada mensaje
+Guarda un hash del texto y del teclado mostrados por (chat_id, message_id)
+para saltar ediciones que no cambiarían nada.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Resultado de comparar un render nuevo con el último conocido
+UNKNOWN = 'unknown'
+UNCHANGED = 'unchanged'
+MARKUP_ONLY = 'markup_only'
+CHANGED = 'changed'
+
+
+def render_hashes(text: str, parse_mode: Optional[str], reply_markup) -> Tuple[int, int]:
+    # Los objetos de telegram son hashables por su contenido (_id_attrs)
+    return hash((text, parse_mode)), hash(reply_markup) if reply_markup is not None else 0
+
+
+class MessageStateCache:
+    """LRU acotado de (chat_id, message_id) → (hash de texto, hash de teclado)"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.states: "OrderedDict[Tuple[int, int], Tuple[int, int]]" = OrderedDict()
+        self.stats = {'edits': 0, 'markup_edits': 0, 'skipped': 0, 'not_modified_errors': 0}
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def compare(self, chat_id: int, message_id: int, text_hash: int, markup_hash: int) -> str:
+        state = self.states.get((chat_id, message_id))
+        if state is None:
+            return UNKNOWN
+        if state[0] != text_hash:
+            return CHANGED
+        return UNCHANGED if state[1] == markup_hash else MARKUP_ONLY
+
+    def remember(self, chat_id: int, message_id: int, text_hash: int, markup_hash: int):
+        key = (chat_id, message_id)
+        self.states[key] = (text_hash, markup_hash)
+        self.states.move_to_end(key)
+        if len(self.states) > self.max_entries:
+            self.states.popitem(last=False)
+
+    @property
+    def saved_calls(self) -> int:
+        """Llamadas a la API evitadas por ediciones que no cambiaban nada"""
+        return self.stats['skipped']
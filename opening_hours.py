@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Horarios de atención
+Convierte el texto libre de `horarios` ("Lun-Vie 8:00-20:00; Sáb 9:00-13:00")
+en intervalos semanales en minutos desde el lunes 00:00, y los compila en un
+bitmap semanal (un entero de 672 bits a 15 minutos) con el que "abierto
+ahora", "abre en N horas" y el orden de los resultados cuestan O(1) por centro.
+"""
+
+import logging
+import re
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Intervalo semanal [inicio, fin) en minutos desde el lunes 00:00
+Interval = Tuple[int, int]
+
+DAY_NAMES = ('Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom')
+
+_DAYS = {
+    'lun': 0, 'lunes': 0, 'mar': 1, 'martes': 1, 'mie': 2, 'miercoles': 2, 'jue': 3, 'jueves': 3,
+    'vie': 4, 'viernes': 4, 'sab': 5, 'sabado': 5, 'dom': 6, 'domingo': 6,
+}
+_EVERY_DAY = ('diario', 'todos los dias')
+
+_TIME = r'\d{1,2}(?::\d{2})?'
+_RANGE = rf'{_TIME}\s*(?:-|a)\s*{_TIME}'
+_GROUP = re.compile(
+    rf'(?P<days>[a-z][a-z .,\-]*?)\s*'
+    rf'(?P<times>24\s*h(?:oras)?|cerrado|{_RANGE}(?:\s*(?:,|y)\s*{_RANGE})*)'
+)
+_SEPARATORS = re.compile(r'[\s;,.]*')
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def _parse_days(spec: str) -> List[int]:
+    spec = spec.strip(' .,')
+    if spec in _EVERY_DAY:
+        return list(range(7))
+    days = []
+    for part in re.split(r'\s*(?:,|\by\b)\s*', spec):
+        # "Lunes a viernes" equivale a "Lun-Vie"
+        first, _, last = (name.strip(' .') for name in re.sub(r'\s+a\s+', '-', part).partition('-'))
+        if first not in _DAYS or (last and last not in _DAYS):
+            raise ValueError(f"Día no reconocido: {part!r}")
+        start = _DAYS[first]
+        end = _DAYS[last] if last else start
+        # Los rangos pueden dar la vuelta a la semana ("Vie-Lun")
+        days.extend((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+    return days
+
+
+def _parse_minute(value: str) -> int:
+    hours, _, minutes = value.partition(':')
+    minute = int(hours) * 60 + int(minutes or 0)
+    if minute > MINUTES_PER_DAY or int(minutes or 0) >= 60:
+        raise ValueError(f"Hora no válida: {value!r}")
+    return minute
+
+
+def _parse_times(spec: str) -> List[Tuple[int, int]]:
+    if spec == 'cerrado':
+        return []
+    if spec.startswith('24'):
+        return [(0, MINUTES_PER_DAY)]
+    ranges = []
+    for match in re.finditer(rf'({_TIME})\s*(?:-|a)\s*({_TIME})', spec):
+        start, end = _parse_minute(match.group(1)), _parse_minute(match.group(2))
+        # Un cierre anterior a la apertura cruza la medianoche
+        ranges.append((start, end if end > start else end + MINUTES_PER_DAY))
+    return ranges
+
+
+def _merge(intervals: List[Interval]) -> Tuple[Interval, ...]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
+@lru_cache(maxsize=None)
+def parse_horarios(text: str) -> Tuple[Interval, ...]:
+    """'Lun-Vie 8:00-20:00' → ((480, 1200), (1920, 2640), ...) ordenados y sin solapes
+
+    Lanza ValueError si queda texto que no se pudo interpretar.
+    """
+    normalized = _normalize(text)
+    intervals: List[Interval] = []
+    position = 0
+    for match in _GROUP.finditer(normalized):
+        if not _SEPARATORS.fullmatch(normalized, position, match.start()):
+            break
+        position = match.end()
+        for day in _parse_days(match.group('days')):
+            for start, end in _parse_times(match.group('times')):
+                start, end = day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end
+                if end > MINUTES_PER_WEEK:
+                    # Domingo por la noche continúa el lunes
+                    intervals.append((0, end - MINUTES_PER_WEEK))
+                    end = MINUTES_PER_WEEK
+                intervals.append((start, end))
+    if not _SEPARATORS.fullmatch(normalized, position):
+        raise ValueError(f"Horario no reconocido: {text!r}")
+    return _merge(intervals)
+
+
+def clinic_key(city: str, position: int) -> str:
+    """Identificador de un centro dentro de `medical_centers`"""
+    return f"{city}/{position}"
+
+
+# ----------------- BITMAPS SEMANALES -----------------
+BITMAP_MINUTES = 15
+
+
+def compile_bitmap(intervals: Iterable[Interval], granularity: int = BITMAP_MINUTES) -> int:
+    """Bit i activo si el tramo [i*granularity, (i+1)*granularity) está abierto por completo"""
+    bitmap = 0
+    for start, end in intervals:
+        first = -(-start // granularity)
+        last = end // granularity
+        if last > first:
+            bitmap |= ((1 << (last - first)) - 1) << first
+    return bitmap
+
+
+class OpeningIndex:
+    """Bitmaps semanales por centro; los horarios que no se entienden quedan como desconocidos"""
+
+    def __init__(self, granularity: int = BITMAP_MINUTES):
+        self.granularity = granularity
+        self.bits = MINUTES_PER_WEEK // granularity
+        self.full = (1 << self.bits) - 1
+        self.bitmaps: Dict[str, int] = {}
+        # Dos semanas seguidas: desplazar a la derecha basta para "girar" la semana
+        self._doubled: Dict[str, int] = {}
+
+    @classmethod
+    def from_medical_centers(cls, medical_centers: Dict, **kwargs) -> 'OpeningIndex':
+        index = cls(**kwargs)
+        for city, city_data in medical_centers.items():
+            for position, center in enumerate(city_data['centros']):
+                index.add(clinic_key(city, position), center['horarios'])
+        return index
+
+    def add(self, key: str, horarios: str):
+        try:
+            bitmap = compile_bitmap(parse_horarios(horarios), self.granularity)
+        except ValueError as e:
+            logger.warning(f"Horario de {key} sin interpretar: {e}")
+            return
+        self.bitmaps[key] = bitmap
+        self._doubled[key] = bitmap | bitmap << self.bits
+
+    def _position(self, moment: datetime) -> Tuple[int, int]:
+        """Tramo de la semana que contiene `moment` y minutos transcurridos dentro del tramo"""
+        minute = moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+        return divmod(minute, self.granularity)
+
+    def is_open(self, key: str, moment: datetime) -> Optional[bool]:
+        bitmap = self.bitmaps.get(key)
+        if bitmap is None:
+            return None
+        return bool(bitmap >> self._position(moment)[0] & 1)
+
+    def minutes_until_open(self, key: str, moment: datetime) -> Optional[int]:
+        """0 si está abierto; None si nunca abre o el horario es desconocido"""
+        ranked = self.rank((key,), moment)
+        return ranked[0][0] if ranked else None
+
+    def minutes_until_close(self, key: str, moment: datetime) -> Optional[int]:
+        """Minutos hasta el cierre si está abierto; None si cerrado, desconocido o abierto siempre"""
+        doubled = self._doubled.get(key)
+        if not doubled:
+            return None
+        position, elapsed = self._position(moment)
+        closed = ~(doubled >> position) & self.full
+        if closed & 1 or not closed:
+            return None
+        return ((closed & -closed).bit_length() - 1) * self.granularity - elapsed
+
+    def rank(self, keys: Iterable[str], moment: datetime,
+             within_hours: Optional[float] = None) -> List[Tuple[Optional[int], str]]:
+        """(minutos hasta abrir, clave) de los abiertos primero; `within_hours` descarta los demás
+
+        Con within_hours=0 solo quedan los abiertos ahora. Los horarios desconocidos
+        van al final y nunca pasan un filtro.
+        """
+        position, elapsed = self._position(moment)
+        granularity = self.granularity
+        limit = None if within_hours is None else within_hours * 60
+        doubled = self._doubled
+        ranked = []
+        unknown = []
+        for key in keys:
+            # Bit 0 = tramo actual; el bit activo más bajo es la próxima apertura
+            current = doubled.get(key, 0) >> position
+            if not current:
+                if limit is None:
+                    unknown.append((None, key))
+                continue
+            minutes = 0 if current & 1 else ((current & -current).bit_length() - 1) * granularity - elapsed
+            if limit is None or minutes <= limit:
+                ranked.append((minutes, key))
+        ranked.sort(key=itemgetter(0))
+        return ranked + unknown
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Personalización por clave de perfil
+Los textos personalizados dependen solo de una clave discreta (tramo de edad,
+género normalizado, nivel de riesgo e idioma). La clave se calcula cuando el
+perfil cambia y las salidas se precalculan en tablas indexadas por ella.
+"""
+
+import itertools
+from types import MappingProxyType
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from i18n import MessageCatalog
+from markup import Markup
+
+# Tramos de edad: los umbrales que usan las reglas son <25 y <=26
+AGE_UNKNOWN = 'unknown'
+AGE_UNDER_25 = 'under_25'
+AGE_25_26 = '25_26'
+AGE_OVER_26 = 'over_26'
+AGE_BUCKETS = (AGE_UNKNOWN, AGE_UNDER_25, AGE_25_26, AGE_OVER_26)
+
+GENDER_UNKNOWN = 'unknown'
+GENDER_MALE = 'male'
+GENDER_FEMALE = 'female'
+GENDER_OTHER = 'other'
+GENDERS = (GENDER_UNKNOWN, GENDER_MALE, GENDER_FEMALE, GENDER_OTHER)
+
+RISK_LEVELS = ('unknown', 'low', 'medium', 'high')
+
+# Categorías con consejos propios; el resto usa el consejo por defecto
+ADVICE_CATEGORIES = ('dolor_sintomas', 'prevencion', 'pruebas_tests')
+
+# Perfil representativo de cada tramo, usado para evaluar las reglas
+_AGE_SAMPLES = {AGE_UNKNOWN: None, AGE_UNDER_25: 20, AGE_25_26: 25, AGE_OVER_26: 40}
+_GENDER_SAMPLES = {GENDER_UNKNOWN: None, GENDER_MALE: 'Masculino', GENDER_FEMALE: 'Femenino',
+                   GENDER_OTHER: 'No binario'}
+
+
+class ProfileKey(NamedTuple):
+    age: str
+    gender: str
+    risk: str
+    language: str
+
+
+def age_bucket(age) -> str:
+    if not age:
+        return AGE_UNKNOWN
+    if age < 25:
+        return AGE_UNDER_25
+    if age <= 26:
+        return AGE_25_26
+    return AGE_OVER_26
+
+
+def normalize_gender(gender: Optional[str]) -> str:
+    gender = (gender or '').lower()
+    if not gender:
+        return GENDER_UNKNOWN
+    # Mismo criterio de subcadena que las reglas originales
+    if 'femenino' in gender:
+        return GENDER_FEMALE
+    if 'masculino' in gender:
+        return GENDER_MALE
+    return GENDER_OTHER
+
+
+def profile_key(user_data: Dict, default_language: str = 'es') -> ProfileKey:
+    risk = user_data.get('risk_level')
+    return ProfileKey(
+        age_bucket(user_data.get('age')),
+        normalize_gender(user_data.get('gender')),
+        risk if risk in RISK_LEVELS else 'unknown',
+        user_data.get('language') or default_language
+    )
+
+
+# ----------------- REGLAS -----------------
+def recommended_tests(catalog: MessageCatalog, user_data: Dict) -> str:
+    age = user_data.get('age', 0)
+    gender = (user_data.get('gender') or '').lower()
+    risk_level = user_data.get('risk_level', 'unknown')
+    messages = catalog.pack(user_data.get('language')).messages
+
+    tests = []
+
+    # Pruebas básicas para todos
+    tests.append('tests.basic')
+
+    if age and age <= 26:
+        tests.append('tests.vph')
+
+    if 'femenino' in gender:
+        tests.append('tests.pap')
+        tests.append('tests.culture')
+
+    if risk_level == 'high':
+        tests.append('tests.full_panel')
+        tests.append('tests.repeat')
+
+    if not tests:
+        return messages['tests.fallback'].render()
+    return Markup("\n".join(messages[key].render() for key in tests))
+
+
+def personalized_recommendations(catalog: MessageCatalog, user_data: Dict) -> str:
+    age = user_data.get('age', 0)
+    risk_level = user_data.get('risk_level', 'unknown')
+    messages = catalog.pack(user_data.get('language')).messages
+
+    recommendations = []
+
+    if age and age < 25:
+        recommendations.append('recommendations.vph')
+    if risk_level == 'high':
+        recommendations.append('recommendations.high')
+    elif risk_level == 'medium':
+        recommendations.append('recommendations.medium')
+    else:
+        recommendations.append('recommendations.default')
+
+    recommendations.append('recommendations.condoms')
+
+    if not recommendations:
+        return messages['recommendations.fallback'].render()
+    return Markup("\n".join(messages[key].render() for key in recommendations))
+
+
+def personalized_advice(catalog: MessageCatalog, category: str, user_data: Dict) -> str:
+    age = user_data.get('age', 0)
+    gender = (user_data.get('gender') or '').lower()
+    risk_level = user_data.get('risk_level', 'unknown')
+    messages = catalog.pack(user_data.get('language')).messages
+
+    advice = []
+
+    if category == 'dolor_sintomas':
+        if risk_level == 'high':
+            advice.append('advice.dolor_high')
+        if age and age < 25:
+            advice.append('advice.dolor_young')
+
+    elif category == 'prevencion':
+        if age and age <= 26:
+            advice.append('advice.prevencion_vph')
+        if risk_level != 'low':
+            advice.append('advice.prevencion_tests')
+
+    elif category == 'pruebas_tests':
+        if 'femenino' in gender:
+            advice.append('advice.pruebas_pap')
+        if age and age < 25:
+            advice.append('advice.pruebas_young')
+
+    if not advice:
+        return messages['advice.default'].render()
+    return Markup(" • ".join(messages[key].render() for key in advice))
+
+
+def personalized_greeting(catalog: MessageCatalog, user_data: Dict) -> str:
+    language = user_data.get('language')
+    age = user_data.get('age')
+    if age:
+        if age < 25:
+            return catalog.text(language, 'greeting.young')
+        elif age >= 25:
+            return catalog.text(language, 'greeting.adult')
+
+    return catalog.text(language, 'greeting.default')
+
+
+# ----------------- TABLAS PRECALCULADAS -----------------
+def all_keys(languages: Tuple[str, ...]):
+    for age, gender, risk, language in itertools.product(AGE_BUCKETS, GENDERS, RISK_LEVELS, languages):
+        yield ProfileKey(age, gender, risk, language)
+
+
+def sample_profile(key: ProfileKey) -> Dict:
+    """Perfil representativo de una clave"""
+    return {
+        'age': _AGE_SAMPLES[key.age],
+        'gender': _GENDER_SAMPLES[key.gender],
+        'risk_level': key.risk,
+        'language': key.language,
+    }
+
+
+class PersonalizationTables:
+    """Salidas de las reglas para cada combinación de clave, en dicts de solo lectura"""
+
+    def __init__(self, catalog: MessageCatalog):
+        self.default_language = catalog.default
+        self.languages = frozenset(catalog.languages)
+        self.tests: Dict[ProfileKey, str] = {}
+        self.recommendations: Dict[ProfileKey, str] = {}
+        self.greetings: Dict[ProfileKey, str] = {}
+        self.advice: Dict[Tuple[ProfileKey, str], str] = {}
+        self.default_advice: Dict[str, str] = {
+            language: catalog.text(language, 'advice.default') for language in catalog.languages
+        }
+
+        for key in all_keys(catalog.languages):
+            profile = sample_profile(key)
+            self.tests[key] = recommended_tests(catalog, profile)
+            self.recommendations[key] = personalized_recommendations(catalog, profile)
+            self.greetings[key] = personalized_greeting(catalog, profile)
+            for category in ADVICE_CATEGORIES:
+                self.advice[(key, category)] = personalized_advice(catalog, category, profile)
+
+        self.tests = MappingProxyType(self.tests)
+        self.recommendations = MappingProxyType(self.recommendations)
+        self.greetings = MappingProxyType(self.greetings)
+        self.advice = MappingProxyType(self.advice)
+
+    def key_for(self, user_data: Dict) -> ProfileKey:
+        key = user_data.get('profile_key')
+        if key is None:
+            key = profile_key(user_data, self.default_language)
+        if key.language not in self.languages:
+            key = key._replace(language=self.default_language)
+        return key
+
+    def advice_for(self, key: ProfileKey, category: str) -> str:
+        advice = self.advice.get((key, category))
+        if advice is None:
+            return self.default_advice.get(key.language) or self.default_advice[self.default_language]
+        return advice
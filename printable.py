@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Resumen imprimible para la cita médica
+El bot arma un documento con datos simples (título, secciones y líneas) a
+partir del perfil, la última evaluación y las pruebas recomendadas; un pool
+de procesos lo convierte en PDF (Helvetica, A4, sin dependencias externas)
+para que maquetar y comprimir no bloquee el event loop. La versión del
+documento es un digest de su contenido: mientras el perfil no cambie, el
+file_id que devolvió Telegram en el primer envío se reutiliza y no se vuelve
+a renderizar ni a subir nada.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+# A4 en puntos
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+
+TITLE_SIZE = 18
+HEADING_SIZE = 13
+BODY_SIZE = 11
+LEADING = 1.35
+
+# Anchos de Helvetica (1/1000 de em) para ' ' .. '~'; el resto se aproxima con DEFAULT_WIDTH
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+DEFAULT_WIDTH = 556
+# Helvetica-Bold es algo más ancha; basta con no pasarse del margen
+BOLD_FACTOR = 1.08
+
+# Markdown de los textos del bot y barras de escape
+_MARKUP = re.compile(r"\\(?=[_*`\[\]])|\*\*|[*`]|(?<![\w.])_|_(?![\w.])")
+
+
+def plain(text: str) -> str:
+    """Quita el formato Markdown y lo que WinAnsi no puede mostrar (emojis)"""
+    text = _MARKUP.sub('', str(text))
+    return text.encode('cp1252', 'ignore').decode('cp1252').strip()
+
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    width = sum(_HELVETICA_WIDTHS[ord(char) - 32] if 32 <= ord(char) <= 126 else DEFAULT_WIDTH
+                for char in text)
+    return width * size / 1000 * (BOLD_FACTOR if bold else 1)
+
+
+def wrap(text: str, size: float, width: float, bold: bool = False) -> List[str]:
+    """Corta por palabras; las viñetas continúan con sangría"""
+    indent = '   ' if text.startswith('• ') else ''
+    lines: List[str] = []
+    line = ''
+    for word in text.split(' '):
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate, size, bold) > width:
+            lines.append(line)
+            candidate = indent + word
+        line = candidate
+    lines.append(line)
+    return lines
+
+
+def _pdf_string(text: str) -> bytes:
+    data = text.encode('cp1252', 'ignore')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+# ----------------- MAQUETACIÓN -----------------
+# Línea colocada: (texto, fuente, tamaño, x, y)
+Placed = Tuple[str, bytes, float, float, float]
+
+
+def layout(document: Dict) -> List[List[Placed]]:
+    """Documento → páginas de líneas colocadas"""
+    pages: List[List[Placed]] = [[]]
+    usable = PAGE_WIDTH - 2 * MARGIN
+    y = PAGE_HEIGHT - MARGIN
+
+    def emit(text: str, size: float, bold: bool = False, space_before: float = 0):
+        nonlocal y
+        for line in wrap(text, size, usable, bold):
+            step = size * LEADING
+            if y - space_before - step < MARGIN:
+                pages.append([])
+                y = PAGE_HEIGHT - MARGIN
+                space_before = 0
+            y -= space_before + step
+            space_before = 0
+            pages[-1].append((line, b'/F2' if bold else b'/F1', size, MARGIN, y))
+
+    emit(plain(document['title']), TITLE_SIZE, bold=True)
+    if document.get('subtitle'):
+        emit(plain(document['subtitle']), BODY_SIZE)
+    for heading, lines in document['sections']:
+        emit(plain(heading), HEADING_SIZE, bold=True, space_before=HEADING_SIZE * 0.8)
+        for line in lines:
+            for part in str(line).split('\n'):
+                part = plain(part)
+                if part:
+                    emit(part, BODY_SIZE)
+    if document.get('footer'):
+        emit(plain(document['footer']), BODY_SIZE - 2, space_before=BODY_SIZE)
+    return pages
+
+
+def render_pdf(document: Dict) -> bytes:
+    """Documento → PDF 1.4; se ejecuta en los procesos del pool"""
+    pages = layout(document)
+    # 1 catálogo, 2 árbol de páginas, 3-4 fuentes; luego (página, contenido) por página
+    objects: List[bytes] = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    kids = []
+    for number, lines in enumerate(pages, start=1):
+        commands = [b'BT']
+        for text, font, size, x, y in lines:
+            commands.append(b'%s %.1f Tf 1 0 0 1 %.1f %.1f Tm %s Tj' % (font, size, x, y, _pdf_string(text)))
+        commands.append(b'/F1 8 Tf 1 0 0 1 %d %d Tm %s Tj' % (
+            PAGE_WIDTH - MARGIN - 24, MARGIN // 2, _pdf_string(f"{number}/{len(pages)}")))
+        commands.append(b'ET')
+        stream = zlib.compress(b'\n'.join(commands), 9)
+        page_id = len(objects) + 1
+        kids.append(page_id)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def document_version(document: Dict) -> str:
+    """Cambia solo si cambia algo de lo que se imprime"""
+    data = json.dumps(document, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=10).hexdigest()
+
+
+# ----------------- POOL Y CACHÉ -----------------
+class RenderPool:
+    """Procesos que renderizan documentos; compartido por todos los bots del proceso"""
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: un fork copiaría los hilos del bot (logging, perfilador) a medio usar
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def start(self):
+        """Lanza los procesos antes de la primera petición, que si no pagaría el arranque"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self.workers)))
+
+    async def render(self, document: Dict) -> bytes:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), render_pdf, document)
+        except BrokenProcessPool:
+            # Un proceso murió (p. ej. OOM): el siguiente intento arranca un pool nuevo
+            self._executor = None
+            raise
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FileIdCache:
+    """Versión de documento → file_id de Telegram (LRU); los file_id son propios de cada bot"""
+
+    def __init__(self, size: int = 10_000):
+        self.size = size
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {'renders': 0, 'reused': 0}
+
+    def get(self, version: str) -> Optional[str]:
+        file_id = self._entries.get(version)
+        if file_id is not None:
+            self._entries.move_to_end(version)
+        return file_id
+
+    def put(self, version: str, file_id: str):
+        self._entries[version] = file_id
+        self._entries.move_to_end(version)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def discard(self, version: str):
+        self._entries.pop(version, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilado por muestreo bajo demanda
+Un hilo lee la pila del hilo del event loop cada pocos milisegundos mientras
+haya en curso alguna update elegida para muestreo (una fracción de todas) y
+acumula las pilas en formato "collapsed" (`raíz;...;hoja N`), el que leen
+flamegraph.pl, speedscope o inferno. La ventana está acotada en el tiempo;
+fuera de ella no hay hilo ni envoltorio en process_update: costo cero.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 128
+
+# Con el loop esperando en select() la update está esperando red, no gastando CPU
+_IDLE_FUNCTIONS = frozenset({'select', 'poll', 'epoll'})
+
+
+class SamplingProfiler:
+    """Muestreador de pilas del hilo del event loop limitado a una ventana"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, max_depth: int = MAX_DEPTH, seed: Optional[int] = None):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.fraction = 1.0
+        self.stacks: Counter = Counter()
+        self.stats = {'samples': 0, 'idle_samples': 0, 'updates': 0, 'sampled_updates': 0}
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.deadline = 0.0
+        self._labels: Dict[object, str] = {}
+        self._random = random.Random(seed)
+        self._target: Optional[int] = None
+        self._in_flight = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self, duration: float, fraction: float = 1.0, thread_id: Optional[int] = None):
+        """Muestrea durante `duration` segundos las updates elegidas con probabilidad `fraction`"""
+        if self.active:
+            raise RuntimeError("Ya hay un perfilado en curso")
+        self.fraction = fraction
+        self.stacks = Counter()
+        self.stats = {'samples': 0, 'idle_samples': 0, 'updates': 0, 'sampled_updates': 0}
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self.deadline = self.started_at + duration
+        self._target = thread_id if thread_id is not None else threading.get_ident()
+        self._in_flight = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            self.stopped_at = time.monotonic()
+        return self.summary()
+
+    # ----------------- MUESTREO -----------------
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._target)
+        if frame is not None and frame.f_code.co_name in _IDLE_FUNCTIONS \
+                and frame.f_code.co_filename.endswith('selectors.py'):
+            self.stats['idle_samples'] += 1
+            return
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+            self.stats['samples'] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                return
+            if self._in_flight:
+                self._sample()
+
+    # ----------------- UPDATES -----------------
+    def attach(self, application):
+        """Envuelve process_update de esta Application mientras dure el perfilado
+
+        Se instala como atributo de la instancia: al quitarlo vuelve el método de
+        la clase y el camino normal no paga ni una comprobación.
+        """
+        process_update = type(application).process_update.__get__(application)
+
+        async def sampled_process_update(update):
+            self.stats['updates'] += 1
+            if self._random.random() >= self.fraction:
+                return await process_update(update)
+            self.stats['sampled_updates'] += 1
+            self._in_flight += 1
+            try:
+                return await process_update(update)
+            finally:
+                self._in_flight -= 1
+
+        application.process_update = sampled_process_update
+
+    @staticmethod
+    def detach(application):
+        application.__dict__.pop('process_update', None)
+
+    # ----------------- RESULTADOS -----------------
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        return path
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Funciones con más muestras en la cima de la pila (tiempo propio)"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(limit)
+
+    def inclusive(self, name: str) -> int:
+        """Muestras en las que aparece una función con ese nombre en cualquier nivel"""
+        prefix = f"{name} ("
+        return sum(count for stack, count in self.stacks.items()
+                   if any(frame.startswith(prefix) for frame in stack.split(';')))
+
+    def summary(self) -> Dict:
+        end = self.stopped_at or time.monotonic()
+        return {**self.stats, 'stacks': len(self.stacks), 'fraction': self.fraction,
+                'elapsed': round(end - self.started_at, 1) if self.started_at else 0.0}
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Control de flujo por usuario (ventana deslizante aproximada)
+Memoria O(1) por usuario activo y expulsión automática de usuarios inactivos
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Decisiones posibles del limitador
+ALLOW = 'allow'
+DROP = 'drop'
+DELAY = 'delay'
+WARN = 'warn'
+
+POLICIES = (DROP, DELAY, WARN)
+
+
+class _Bucket:
+    """Contadores de la ventana actual y la anterior de un usuario
+
+    `deferred` cuenta los eventos diferidos aún sin ejecutar y `next_release`
+    es el primer instante libre para el siguiente.
+    """
+    __slots__ = ('window_start', 'previous', 'current', 'warned', 'last_seen', 'deferred', 'next_release')
+
+    def __init__(self, window_start: float, now: float):
+        self.window_start = window_start
+        self.previous = 0
+        self.current = 0
+        self.warned = False
+        self.last_seen = now
+        self.deferred = 0
+        self.next_release = 0.0
+
+
+class SlidingWindowRateLimiter:
+    """Limitador por usuario con ventana deslizante de dos contadores
+
+    El conteo estimado es `previous * (1 - avance) + current`, lo que evita
+    guardar un timestamp por mensaje: cada usuario ocupa un único `_Bucket`.
+    """
+
+    def __init__(self, max_events: int = 8, window: float = 10.0, policy: str = WARN,
+                 idle_ttl: float = 300.0, max_delay: float = 5.0, evict_batch: int = 2,
+                 max_deferred: Optional[int] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de rate limit desconocida: {policy}")
+        self.max_events = max_events
+        self.window = window
+        self.policy = policy
+        self.idle_ttl = max(idle_ttl, window * 2)
+        self.max_delay = max_delay
+        # Diferidos por usuario como mucho; se liberan espaciados a ritmo de la ventana
+        self.max_deferred = max_events if max_deferred is None else max_deferred
+        self.release_interval = window / max_events
+        self.evict_batch = evict_batch
+        self.buckets: "OrderedDict[int, _Bucket]" = OrderedDict()
+        self.stats = {ALLOW: 0, DROP: 0, DELAY: 0, WARN: 0, 'evicted': 0}
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def _roll(self, bucket: _Bucket, now: float):
+        elapsed_windows = int((now - bucket.window_start) // self.window)
+        if elapsed_windows <= 0:
+            return
+        bucket.previous = bucket.current if elapsed_windows == 1 else 0
+        bucket.current = 0
+        bucket.window_start += elapsed_windows * self.window
+        bucket.warned = False
+
+    def _estimate(self, bucket: _Bucket, now: float) -> float:
+        progress = (now - bucket.window_start) / self.window
+        return bucket.previous * (1.0 - progress) + bucket.current
+
+    def _retry_after(self, bucket: _Bucket, now: float) -> float:
+        """Segundos hasta que el conteo estimado baje del límite"""
+        if bucket.previous <= 0:
+            return bucket.window_start + self.window - now
+        # previous * (1 - t/window) + current + 1 <= max_events  →  despejar t
+        excess = bucket.previous + bucket.current + 1 - self.max_events
+        t = self.window * excess / bucket.previous
+        return max(0.0, bucket.window_start + t - now)
+
+    def check(self, user_id: int, now: Optional[float] = None) -> Tuple[str, float]:
+        """Registra un evento del usuario y devuelve (decisión, espera en segundos)"""
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = _Bucket(now, now)
+            self.buckets[user_id] = bucket
+        else:
+            self.buckets.move_to_end(user_id)
+            self._roll(bucket, now)
+            bucket.last_seen = now
+        self.evict_idle(now, limit=self.evict_batch)
+
+        if self._estimate(bucket, now) + 1 <= self.max_events:
+            bucket.current += 1
+            self.stats[ALLOW] += 1
+            return ALLOW, 0.0
+
+        if self.policy == DELAY:
+            # Cada diferido sale `release_interval` después del anterior, no todos a la vez
+            release = max(now + self._retry_after(bucket, now), bucket.next_release)
+            if bucket.deferred < self.max_deferred and release - now <= self.max_delay:
+                bucket.deferred += 1
+                bucket.next_release = release + self.release_interval
+                self.stats[DELAY] += 1
+                return DELAY, release - now
+        elif self.policy == WARN and not bucket.warned:
+            bucket.warned = True
+            self.stats[WARN] += 1
+            return WARN, 0.0
+
+        self.stats[DROP] += 1
+        return DROP, 0.0
+
+    def release(self, user_id: int, now: Optional[float] = None):
+        """Un evento diferido se ejecuta: cuenta en la ventana en la que corre"""
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        self._roll(bucket, now)
+        bucket.deferred = max(0, bucket.deferred - 1)
+        bucket.current += 1
+
+    def evict_idle(self, now: Optional[float] = None, limit: Optional[int] = None) -> int:
+        """Elimina usuarios sin actividad reciente (los más antiguos están al frente)"""
+        if now is None:
+            now = time.monotonic()
+        evicted = 0
+        buckets = self.buckets
+        while buckets and (limit is None or evicted < limit):
+            user_id, bucket = next(iter(buckets.items()))
+            if now - bucket.last_seen < self.idle_ttl:
+                break
+            del buckets[user_id]
+            evicted += 1
+        self.stats['evicted'] += evicted
+        return evicted
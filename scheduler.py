@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Recordatorios de seguimiento persistentes
+Cola de prioridad (heap) respaldada por un journal append-only que se
+reproduce al iniciar, de modo que los recordatorios sobreviven reinicios.
+"""
+
+import heapq
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Entrada del heap: (vencimiento, user_id, tipo)
+Reminder = Tuple[float, int, str]
+
+
+class ReminderQueue:
+    """Heap de recordatorios con cancelación perezosa y journal en disco
+
+    Solo existe un recordatorio pendiente por (usuario, tipo); reprogramar
+    deja la entrada anterior del heap obsoleta y se descarta al extraerla.
+    Un recordatorio extraído sigue pendiente (y en el journal) hasta que se
+    confirma con `complete` o se reintenta con `retry`: si el envío falla o
+    el proceso muere a mitad, no se pierde.
+    """
+
+    def __init__(self, path: Optional[str] = None, compact_ratio: float = 2.0):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.heap: List[Reminder] = []
+        self.pending: Dict[Tuple[int, str], float] = {}
+        # Extraídos por pop_due y aún sin confirmar; no vuelven al heap al compactarlo
+        self.in_flight: Dict[Tuple[int, str], float] = {}
+        self.failures: Dict[Tuple[int, str], int] = {}
+        self._journal = None
+        if path:
+            self._load(compact_ratio)
+            self._journal = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def _load(self, compact_ratio: float):
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                parts = line.split()
+                if len(parts) == 4 and parts[0] == '+':
+                    self.pending[(int(parts[2]), parts[3])] = float(parts[1])
+                elif len(parts) == 3 and parts[0] == '-':
+                    self.pending.pop((int(parts[1]), parts[2]), None)
+        # heapify es O(n), más barato que n inserciones
+        self.heap = [(due, user_id, kind) for (user_id, kind), due in self.pending.items()]
+        heapq.heapify(self.heap)
+        if lines > compact_ratio * max(len(self.pending), 1):
+            self._compact()
+
+    def _compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for (user_id, kind), due in self.pending.items():
+                f.write(f"+ {due} {user_id} {kind}\n")
+        os.replace(tmp, self.path)
+
+    def schedule(self, user_id: int, kind: str, due: float):
+        self.failures.pop((user_id, kind), None)
+        self.pending[(user_id, kind)] = due
+        heapq.heappush(self.heap, (due, user_id, kind))
+        if self._journal:
+            self._journal.write(f"+ {due} {user_id} {kind}\n")
+        # Reprogramar y cancelar dejan entradas obsoletas; si dominan, reconstruir
+        if len(self.heap) > self.compact_ratio * max(len(self.pending), 64):
+            self._rebuild_heap()
+
+    def cancel(self, user_id: int, kind: str):
+        self.failures.pop((user_id, kind), None)
+        if self.pending.pop((user_id, kind), None) is not None and self._journal:
+            self._journal.write(f"- {user_id} {kind}\n")
+
+    def _rebuild_heap(self):
+        self.heap = [(due, user_id, kind) for (user_id, kind), due in self.pending.items()
+                     if self.in_flight.get((user_id, kind)) != due]
+        heapq.heapify(self.heap)
+
+    def pop_due(self, now: Optional[float] = None, limit: int = 100) -> List[Reminder]:
+        """Extrae hasta `limit` recordatorios vencidos, descartando entradas obsoletas
+
+        Cada recordatorio devuelto debe cerrarse con `complete` o `retry`.
+        """
+        if now is None:
+            now = time.time()
+        due_items = []
+        heap = self.heap
+        while heap and heap[0][0] <= now and len(due_items) < limit:
+            due, user_id, kind = heapq.heappop(heap)
+            if self.pending.get((user_id, kind)) != due:
+                continue
+            self.in_flight[(user_id, kind)] = due
+            due_items.append((due, user_id, kind))
+        return due_items
+
+    def complete(self, user_id: int, kind: str, due: float):
+        """Confirma un envío; no toca el recordatorio si se reprogramó mientras tanto"""
+        key = (user_id, kind)
+        if self.in_flight.get(key) == due:
+            del self.in_flight[key]
+        if self.pending.get(key) == due:
+            self.cancel(user_id, kind)
+
+    def retry(self, user_id: int, kind: str, due: float, now: Optional[float] = None,
+              base_delay: float = 60.0, max_delay: float = 3600.0, max_attempts: int = 6) -> bool:
+        """Reprograma un envío fallido con backoff exponencial; False si se agotaron los intentos"""
+        key = (user_id, kind)
+        if self.in_flight.get(key) == due:
+            del self.in_flight[key]
+        if self.pending.get(key) != due:
+            # Cancelado o reprogramado durante el envío
+            return True
+        attempts = self.failures.get(key, 0) + 1
+        if attempts >= max_attempts:
+            self.cancel(user_id, kind)
+            return False
+        if now is None:
+            now = time.time()
+        self.schedule(user_id, kind, now + min(base_delay * 2 ** (attempts - 1), max_delay))
+        self.failures[key] = attempts
+        return True
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
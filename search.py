@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda de texto libre sobre la enciclopedia ETS
+Índice invertido con puntuación BM25; cada documento es un campo de una
+enfermedad (síntomas, tratamiento, tiempo de aparición, ...).
+"""
+
+import heapq
+import math
+import re
+import unicodedata
+from array import array
+from typing import Dict, List, NamedTuple, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a al algo como con cual cuando de del donde el ella en entre es esta este esto ha hay la las le lo
+los me mi mis muy no o para pero por que se si sin sobre son su sus te tengo ti tu un una uno unos
+y ya yo dar da puede pueden tiene tienen hacer
+""".split())
+
+# Términos con los que suele preguntarse por cada campo; el nombre de la
+# enfermedad se indexa dentro de todos sus documentos
+FIELD_ALIASES = {
+    'sintomas': "sintomas signos senales molestias",
+    'info': "que es informacion general",
+    'tratamiento': "tratamiento cura curar tratar medicamento medicina antibiotico",
+    'tiempo_sintomas': "tiempo tarda tardan cuanto aparecen aparicion incubacion dias semanas despues",
+    'prevencion': "prevenir prevencion evitar proteger protegerse cuidarse",
+    'complicaciones': "complicaciones consecuencias riesgos peligro grave",
+}
+
+SEARCH_FIELDS = tuple(FIELD_ALIASES)
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Minúsculas, sin acentos ni stopwords y con plural simple recortado"""
+    tokens = []
+    for token in _TOKEN_RE.findall(_strip_accents(text.lower())):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith('s'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def field_text(value) -> str:
+    """Aplana el valor de un campo de `ets_database` a texto"""
+    if isinstance(value, dict):
+        return '\n'.join(f"{key}: {field_text(item)}" for key, item in value.items()
+                         if not isinstance(item, (int, float)))
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(item) for item in value)
+    return str(value)
+
+
+class SearchHit(NamedTuple):
+    score: float
+    ets_key: str
+    field: str
+
+
+class EncyclopediaIndex:
+    """Índice invertido BM25 sobre (enfermedad, campo)
+
+    El aporte BM25 de cada término a cada documento se calcula al construir el
+    índice, así una consulta solo suma pesos precalculados.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Tuple[str, str]] = []
+        self.postings: Dict[str, Tuple[array, array]] = {}
+
+    @classmethod
+    def build(cls, ets_database: Dict, **params) -> 'EncyclopediaIndex':
+        index = cls(**params)
+        lengths = []
+        postings: Dict[str, Tuple[array, array]] = {}  # token → (doc_ids, tfs)
+        for ets_key, ets in ets_database.items():
+            name = ets.get('nombre', ets_key)
+            for field in SEARCH_FIELDS:
+                if field not in ets:
+                    continue
+                doc_id = len(index.docs)
+                index.docs.append((ets_key, field))
+                tokens = tokenize(f"{name} {FIELD_ALIASES[field]} {field_text(ets[field])}")
+                lengths.append(len(tokens))
+                counts: Dict[str, int] = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    doc_ids, tfs = postings.setdefault(token, (array('I'), array('H')))
+                    doc_ids.append(doc_id)
+                    tfs.append(tf)
+
+        total = len(index.docs)
+        avg_length = sum(lengths) / total if total else 0.0
+        k1, b = index.k1, index.b
+        norms = [k1 * (1 - b + b * length / avg_length) for length in lengths]
+        for token, (doc_ids, tfs) in postings.items():
+            idf = math.log(1 + (total - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            weights = array('d', (idf * tf * (k1 + 1) / (tf + norms[doc_id])
+                                  for doc_id, tf in zip(doc_ids, tfs)))
+            index.postings[token] = (doc_ids, weights)
+        return index
+
+    def search(self, query: str, k: int = 3) -> List[SearchHit]:
+        scores: Dict[int, float] = {}
+        get = scores.get
+        for token in set(tokenize(query)):
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            for doc_id, weight in zip(*entry):
+                scores[doc_id] = get(doc_id, 0.0) + weight
+        # Desempate determinista por orden de inserción del documento
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [SearchHit(score, *self.docs[doc_id]) for doc_id, score in best]
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
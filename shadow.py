@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Evaluación en sombra de analizadores candidatos
+Una fracción de los mensajes reales se copia (texto, campos escalares del
+perfil y salida de producción) a una cola acotada; un pool de procesos con
+prioridad baja ejecuta sobre cada muestra las versiones candidatas del
+análisis de síntomas (nivel de riesgo y condiciones) y del enrutado del chat
+libre (categoría elegida). Con la cola llena la muestra se descarta: la
+sombra nunca hace esperar a una update. Las discrepancias se escriben en un
+JSONL compacto y se agregan por candidato.
+
+Candidatos (SHADOW_CANDIDATES): "symptoms=paquete.modulo:funcion,chat=..."
+    symptoms: f(texto, perfil) -> {'risk_level': 'low', 'conditions': ['Clamidia', ...]}
+    chat:     f(texto, perfil) -> 'saludo' | 'search:sifilis.tratamiento' | ...
+
+Uso offline: python shadow.py shadow.jsonl
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Analizadores que se pueden evaluar en sombra
+SYMPTOMS = 'symptoms'
+CHAT = 'chat'
+KINDS = (SYMPTOMS, CHAT)
+
+
+class Candidate(NamedTuple):
+    kind: str
+    # 'modulo:funcion', importable desde los procesos de sombra
+    path: str
+
+
+def parse_candidates(spec: Optional[str]) -> List[Candidate]:
+    candidates = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        kind, _, path = (part.strip() for part in item.partition('='))
+        if kind not in KINDS or ':' not in path:
+            raise ValueError(f"Candidato no válido: {item!r} (se espera 'symptoms|chat=modulo:funcion')")
+        candidates.append(Candidate(kind, path))
+    return candidates
+
+
+def resolve(path: str) -> Callable:
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def normalize(kind: str, result) -> Dict:
+    """Salida de un analizador → campos que se comparan con producción"""
+    if kind == SYMPTOMS:
+        return {'risk_level': result['risk_level'], 'conditions': list(result['conditions'])}
+    return {'category': result}
+
+
+def compare(production: Dict, candidate: Dict) -> Dict[str, Tuple]:
+    """Campos en los que difieren (producción, candidato); las condiciones se comparan sin orden"""
+    diffs = {}
+    for field, expected in production.items():
+        actual = candidate.get(field)
+        if field == 'conditions':
+            same = actual is not None and set(expected) == set(actual)
+        else:
+            same = expected == actual
+        if not same:
+            diffs[field] = (expected, actual)
+    return diffs
+
+
+def digest(text: str) -> str:
+    """Identifica mensajes repetidos en el log sin guardar el texto"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=6).hexdigest()
+
+
+# ----------------- PROCESOS DE SOMBRA -----------------
+_WORKER_CANDIDATES: List[Tuple[str, str, Callable]] = []
+
+
+def _init_worker(candidates: Tuple[Candidate, ...], niceness: int):
+    """Importa los candidatos una vez por proceso y le cede la CPU al bot"""
+    try:
+        # Linux: el proceso solo corre cuando la CPU estaría ociosa
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        if niceness:
+            try:
+                os.nice(niceness)
+            except OSError:
+                pass
+    _WORKER_CANDIDATES[:] = [(kind, path, resolve(path)) for kind, path in candidates]
+
+
+def _run_batch(batch: List[Tuple[str, str, Dict]]) -> List[List[Tuple[str, Optional[Dict], float, Optional[str]]]]:
+    """Por muestra: (candidato, salida normalizada, segundos, error) de cada candidato de su tipo"""
+    results = []
+    for kind, text, profile in batch:
+        outputs = []
+        for candidate_kind, path, function in _WORKER_CANDIDATES:
+            if candidate_kind != kind:
+                continue
+            begin = time.perf_counter()
+            try:
+                output, error = normalize(kind, function(text, profile)), None
+            except Exception as e:
+                output, error = None, f"{type(e).__name__}: {e}"
+            outputs.append((path, output, time.perf_counter() - begin, error))
+        results.append(outputs)
+    return results
+
+
+def _new_stats() -> Dict:
+    return {'samples': 0, 'errors': 0, 'disagreements': 0, 'seconds': 0.0,
+            'fields': Counter(), 'risk': Counter()}
+
+
+class ShadowRunner:
+    """Cola acotada de muestras y pool de procesos que compara candidatos con producción"""
+
+    def __init__(self, candidates: List[Candidate], sample_rate: float = 0.05, queue_size: int = 256,
+                 workers: int = 1, batch_size: int = 16, log_path: Optional[str] = None,
+                 log_text: bool = False, niceness: int = 10, seed: Optional[int] = None):
+        self.candidates = tuple(candidates)
+        self.kinds = frozenset(candidate.kind for candidate in self.candidates)
+        self.sample_rate = sample_rate if self.candidates else 0.0
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.log_path = log_path
+        # El texto de los usuarios no se guarda salvo que se pida: basta el digest para agrupar
+        self.log_text = log_text
+        self.niceness = niceness
+        self.counters = {'sampled': 0, 'dropped': 0, 'compared': 0, 'failed_batches': 0}
+        self.stats: Dict[str, Dict] = {candidate.path: _new_stats() for candidate in self.candidates}
+        self._random = random.Random(seed)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._log = None
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and not self._closed
+
+    def offer(self, kind: str, text: str, profile: Dict, production: Dict) -> bool:
+        """Desde el handler: copia la muestra si le toca y hay hueco; nunca espera"""
+        if kind not in self.kinds or not self.enabled or self._random.random() >= self.sample_rate:
+            return False
+        if self._queue is None:
+            self._start()
+        self.counters['sampled'] += 1
+        if self._queue.full():
+            self.counters['dropped'] += 1
+            return False
+        snapshot = {key: value for key, value in profile.items() if isinstance(value, (str, int, float, bool))}
+        self._queue.put_nowait((kind, text, snapshot, production, time.time()))
+        return True
+
+    async def start(self):
+        """Arranca los procesos antes de recibir updates: importar los candidatos no coincide con tráfico"""
+        if not self.enabled or self._queue is not None:
+            return
+        self._start()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._pool, os.getpid) for _ in range(self.workers)))
+        except BrokenProcessPool as e:
+            # Un candidato que no se puede importar no debe impedir que el bot arranque
+            logger.error(f"Evaluación en sombra desactivada: {e}")
+            self.sample_rate = 0.0
+
+    def _start(self):
+        # spawn: un fork copiaría los hilos del bot (logging, perfilador) a medio usar
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker, initargs=(self.candidates, self.niceness))
+        self._queue = asyncio.Queue(self.queue_size)
+        if self.log_path:
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(
+                    self._pool, _run_batch, [(kind, text, profile) for kind, text, profile, _, _ in batch]
+                )
+            except BrokenProcessPool as e:
+                # Un candidato que no importa o que tumba el proceso: no tiene sentido seguir muestreando
+                logger.error(f"Evaluación en sombra desactivada: {e}")
+                self.sample_rate = 0.0
+                return
+            except Exception as e:
+                self.counters['failed_batches'] += 1
+                logger.warning(f"Lote de sombra fallido ({len(batch)} muestras): {e}")
+            else:
+                self._record(batch, results)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _record(self, batch, results):
+        lines = []
+        for (kind, text, _, production, ts), outputs in zip(batch, results):
+            self.counters['compared'] += 1
+            for path, output, seconds, error in outputs:
+                stats = self.stats[path]
+                stats['samples'] += 1
+                stats['seconds'] += seconds
+                if error is not None:
+                    stats['errors'] += 1
+                    diffs = {'error': error}
+                else:
+                    diffs = compare(production, output)
+                    stats['fields'].update(diffs.keys())
+                    if kind == SYMPTOMS:
+                        stats['risk'][f"{production['risk_level']}>{output['risk_level']}"] += 1
+                if diffs:
+                    stats['disagreements'] += 1
+                    entry = {'t': int(ts), 'c': path, 'k': kind, 'h': digest(text), 'd': diffs}
+                    if self.log_text:
+                        entry['x'] = text
+                    lines.append(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        if lines and self._log is not None:
+            # Una escritura por lote
+            self._log.write(''.join(lines))
+            self._log.flush()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Espera a que se comparen las muestras encoladas"""
+        if self._queue is None:
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def summary(self) -> Dict:
+        candidates = {}
+        for path, stats in self.stats.items():
+            samples = stats['samples']
+            candidates[path] = {
+                'samples': samples,
+                'errors': stats['errors'],
+                'agreement': round(1 - stats['disagreements'] / samples, 4) if samples else None,
+                'fields': dict(stats['fields']),
+                'risk': dict(stats['risk'].most_common()),
+                'mean_ms': round(stats['seconds'] / samples * 1000, 3) if samples else None,
+            }
+        return {**self.counters, 'queued': self._queue.qsize() if self._queue else 0,
+                'sample_rate': self.sample_rate, 'candidates': candidates}
+
+    async def stop(self):
+        """Descarta lo pendiente, para los procesos y cierra el log con el resumen"""
+        self._closed = True
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._log is not None:
+            self._log.write(json.dumps({'t': int(time.time()), 'summary': self.summary()},
+                                       ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._log.close()
+            self._log = None
+
+
+# ----------------- RESUMEN OFFLINE -----------------
+def summarize(path: str) -> Dict:
+    """Discrepancias por candidato y campo, mensajes más repetidos y el último resumen escrito"""
+    fields: Counter = Counter()
+    messages: Counter = Counter()
+    last_summary = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if 'summary' in entry:
+                last_summary = entry['summary']
+                continue
+            for field in entry['d']:
+                fields[(entry['c'], field)] += 1
+            messages[(entry['c'], entry['h'])] += 1
+    return {'fields': fields, 'messages': messages, 'last_summary': last_summary}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumen de un log de evaluación en sombra")
+    parser.add_argument("path", help="Log de discrepancias (SHADOW_LOG_PATH)")
+    parser.add_argument("--top", type=int, default=10, help="Mensajes con más discrepancias")
+    args = parser.parse_args(argv)
+
+    summary = summarize(args.path)
+    for (candidate, field), count in sorted(summary['fields'].items()):
+        print(f"{candidate:<40} {field:<12} {count:>8}")
+    for (candidate, message), count in summary['messages'].most_common(args.top):
+        print(f"{candidate:<40} {message:<12} {count:>8}")
+    if summary['last_summary']:
+        for candidate, stats in summary['last_summary']['candidates'].items():
+            print(f"{candidate:<40} muestras={stats['samples']} acuerdo={stats['agreement']} "
+                  f"errores={stats['errors']} riesgo={stats['risk']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
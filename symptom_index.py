@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Inferencia de condiciones a partir de síntomas
+Mapa invertido precalculado de términos de síntoma normalizados a
+enfermedades de `ets_database`, con pesos por lista (comunes, por género,
+por etapa) y ajustados por el porcentaje de casos asintomáticos.
+"""
+
+import heapq
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from search import tokenize
+
+# Variantes coloquiales → término canónico (ya sin acentos ni plural)
+SYMPTOM_SYNONYMS = {
+    'duele': 'dolor', 'molestia': 'dolor', 'punzada': 'dolor', 'doloroso': 'dolor', 'dolorosa': 'dolor',
+    'quema': 'ardor', 'arde': 'ardor',
+    'flujo': 'secrecion', 'liquido': 'secrecion', 'descarga': 'secrecion',
+    'supuracion': 'secrecion', 'supura': 'secrecion', 'pus': 'secrecion',
+    'llaga': 'lesion', 'herida': 'lesion', 'ulcera': 'lesion', 'chancro': 'lesion', 'roncha': 'lesion',
+    'comezon': 'picazon', 'prurito': 'picazon', 'pica': 'picazon',
+    'calentura': 'fiebre', 'temperatura': 'fiebre',
+    'sangra': 'sangrado', 'sangre': 'sangrado',
+    'orina': 'orinar', 'orino': 'orinar',
+}
+
+# Términos que describen ausencia de síntomas o etapas, no un síntoma
+IGNORED_TERMS = frozenset({'comun', 'sintoma', 'visible', 'menudo', 'asintomatico', 'similare', 'menor',
+                           'leve', 'duracion', 'cambio', 'mas', 'durante', 'problema'})
+
+GENDER_LISTS = {'hombres': 'masculino', 'mujeres': 'femenino'}
+
+# Peso de cada lista de síntomas; las listas de otro género casi no cuentan
+COMMON_WEIGHT = 1.0
+STAGE_WEIGHT = 0.8
+OTHER_GENDER_WEIGHT = 0.2
+
+
+def normalize_terms(text: str) -> List[str]:
+    terms = []
+    for token in tokenize(text):
+        token = SYMPTOM_SYNONYMS.get(token, token)
+        if token not in IGNORED_TERMS:
+            terms.append(token)
+    return terms
+
+
+def gender_group(gender: Optional[str]) -> Optional[str]:
+    """'hombres', 'mujeres' o None según el género del perfil"""
+    gender = (gender or '').lower()
+    for group, marker in GENDER_LISTS.items():
+        if marker in gender:
+            return group
+    return None
+
+
+class SymptomIndex:
+    """Término de síntoma → (ids de enfermedad, pesos) para cada grupo de género"""
+
+    GROUPS = (None, 'hombres', 'mujeres')
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.names: List[str] = []
+        self.postings: Dict[Optional[str], Dict[str, Tuple[array, array]]] = {}
+
+    @classmethod
+    def build(cls, ets_database: Dict) -> 'SymptomIndex':
+        index = cls()
+        # term → {disease_id: peso por grupo}
+        raw: Dict[Optional[str], Dict[str, Dict[int, float]]] = {group: {} for group in cls.GROUPS}
+        document_frequency: Dict[str, int] = {}
+
+        for ets_key, ets in ets_database.items():
+            disease_id = len(index.keys)
+            index.keys.append(ets_key)
+            index.names.append(ets.get('nombre', ets_key))
+            sintomas = ets.get('sintomas', {})
+            # Enfermedades con alto % asintomático explican peor un síntoma reportado
+            presence = 1.0 - 0.5 * sintomas.get('asintomatico', 0) / 100
+
+            seen = set()
+            for list_name, items in sintomas.items():
+                if not isinstance(items, list):
+                    continue
+                terms = set()
+                for item in items:
+                    terms.update(normalize_terms(item))
+                seen.update(terms)
+                for group in cls.GROUPS:
+                    if list_name == 'comunes':
+                        weight = COMMON_WEIGHT
+                    elif list_name in GENDER_LISTS:
+                        weight = COMMON_WEIGHT if list_name == group else OTHER_GENDER_WEIGHT
+                    else:
+                        weight = STAGE_WEIGHT
+                    weights = raw[group]
+                    for term in terms:
+                        by_disease = weights.setdefault(term, {})
+                        by_disease[disease_id] = max(by_disease.get(disease_id, 0.0), weight * presence)
+            for term in seen:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        total = max(len(index.keys), 1)
+        for group, weights in raw.items():
+            postings = {}
+            for term, by_disease in weights.items():
+                # Síntomas que comparten pocas enfermedades discriminan más
+                idf = math.log(1 + total / document_frequency[term])
+                ids = sorted(by_disease)
+                postings[term] = (array('I', ids), array('d', (by_disease[i] * idf for i in ids)))
+            index.postings[group] = postings
+        return index
+
+    def _top(self, text: str, gender: Optional[str], k: int) -> List[Tuple[int, float]]:
+        postings = self.postings[gender_group(gender)]
+        scores: Dict[int, float] = {}
+        get = scores.get
+        for term in set(normalize_terms(text)):
+            entry = postings.get(term)
+            if entry is None:
+                continue
+            for disease_id, weight in zip(*entry):
+                scores[disease_id] = get(disease_id, 0.0) + weight
+        # Empates: gana la enfermedad definida primero en la base de conocimientos
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def rank(self, text: str, gender: Optional[str] = None, k: int = 3) -> List[Tuple[float, str]]:
+        """Top-k (puntuación, clave) ordenado de forma determinista"""
+        return [(score, self.keys[disease_id]) for disease_id, score in self._top(text, gender, k)]
+
+    def condition_names(self, text: str, gender: Optional[str] = None, k: int = 3) -> List[str]:
+        return [self.names[disease_id] for disease_id, _ in self._top(text, gender, k)]
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Varios bots en un proceso
+Un único servidor de webhooks enruta cada update por su ruta URL a la
+Application del tenant correspondiente. La base de conocimientos, los
+índices de búsqueda, el catálogo de textos y los menús se construyen una
+sola vez y se comparten; cada tenant puede sustituir sus centros médicos y
+su idioma por defecto, y guarda su estado en ficheros propios.
+
+Uso: python tenants.py tenants.json [--port 5000] [--webhook-url https://...]
+
+tenants.json:
+    [{"name": "norte", "token_env": "TOKEN_NORTE", "language": "es",
+      "medical_centers": {...}}, ...]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from telegram import Update
+from telegram.ext import Application
+
+import ets_bot
+import logging_setup
+from lifecycle import PROCESS_STARTED, drain, finish, shutdown_requested
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class TenantConfig(NamedTuple):
+    name: str
+    token: str
+    # Por defecto el token, como en el modo de un solo bot
+    url_path: Optional[str] = None
+    language: Optional[str] = None
+    medical_centers: Optional[Dict] = None
+    secret_token: Optional[str] = None
+
+
+def load_tenants(path: str) -> List[TenantConfig]:
+    """Lee la configuración; el token puede venir en claro (`token`) o de una variable (`token_env`)"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    tenants = []
+    for entry in entries:
+        token = entry.get('token') or os.environ.get(entry.get('token_env', ''))
+        if not token:
+            raise ValueError(f"Tenant {entry.get('name')!r} sin token")
+        tenants.append(TenantConfig(
+            name=entry['name'],
+            token=token,
+            url_path=entry.get('url_path'),
+            language=entry.get('language'),
+            medical_centers=entry.get('medical_centers'),
+            secret_token=entry.get('secret_token') or os.environ.get(entry.get('secret_token_env', '')) or None,
+        ))
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError("Nombres de tenant duplicados")
+    return tenants
+
+
+def build_tenants(configs: List[TenantConfig], shared: Optional[ets_bot.SharedResources] = None,
+                  base_url: Optional[str] = ets_bot.BOT_API_URL,
+                  concurrent_updates: int = ets_bot.CONCURRENT_UPDATES) -> List[ets_bot.ETSBotAdvanced]:
+    """Un ETSBotAdvanced por tenant, todos sobre los mismos recursos compartidos"""
+    shared = shared or ets_bot.SharedResources()
+    return [
+        ets_bot.ETSBotAdvanced(config.token, base_url=base_url, concurrent_updates=concurrent_updates,
+                               shared=shared, name=config.name, language=config.language,
+                               medical_centers=config.medical_centers)
+        for config in configs
+    ]
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    """POST /<url_path> → cola de updates de la Application del tenant"""
+
+    def initialize(self, bot_application: Application, secret_token: str):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    def check_xsrf_cookie(self):
+        pass
+
+    async def post(self):
+        if self.request.headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        await self.bot_application.update_queue.put(Update.de_json(data, self.bot_application.bot))
+
+
+class TenantServer:
+    """Servidor de webhooks compartido, enrutado por ruta URL"""
+
+    def __init__(self, listen: str = '0.0.0.0', port: int = 5000):
+        self.listen = listen
+        self.port = port
+        self.routes = []
+        self._server: Optional[tornado.httpserver.HTTPServer] = None
+
+    def add(self, url_path: str, application: Application, secret_token: str):
+        self.routes.append((rf"/{url_path.strip('/')}/?", _WebhookHandler,
+                            {'bot_application': application, 'secret_token': secret_token}))
+
+    async def start(self):
+        sockets = tornado.netutil.bind_sockets(self.port, self.listen)
+        # Con port=0 el sistema elige uno libre
+        self.port = sockets[0].getsockname()[1]
+        self._server = tornado.httpserver.HTTPServer(tornado.web.Application(self.routes))
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+
+class TenantLifecycle:
+    """Arranque y parada ordenados de todos los tenants detrás de un servidor"""
+
+    def __init__(self, configs: List[TenantConfig], bots: List[ets_bot.ETSBotAdvanced], webhook_url: str,
+                 listen: str = '0.0.0.0', port: int = 5000, drain_timeout: float = ets_bot.SHUTDOWN_DRAIN_TIMEOUT,
+                 started_at: float = PROCESS_STARTED):
+        self.tenants = list(zip(configs, bots))
+        self.webhook_url = webhook_url.rstrip('/')
+        self.server = TenantServer(listen, port)
+        self.drain_timeout = drain_timeout
+        self.started_at = started_at
+        self.timings: Dict[str, float] = {}
+        self.drained: Dict[str, bool] = {}
+        # Sin secreto configurado se genera uno: solo Telegram conoce la ruta y el secreto
+        self.secret_tokens = {config.name: config.secret_token or secrets.token_urlsafe(32)
+                              for config, _ in self.tenants}
+        for config, bot in self.tenants:
+            self.server.add(config.url_path or config.token, bot.application, self.secret_tokens[config.name])
+
+    @staticmethod
+    async def _start_application(app: Application):
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+
+    async def start(self):
+        begin = time.perf_counter()
+        await asyncio.gather(*(self._start_application(bot.application) for _, bot in self.tenants))
+        self.timings['prewarm_s'] = time.perf_counter() - begin
+
+        await self.server.start()
+        begin = time.perf_counter()
+        await asyncio.gather(*(
+            bot.application.bot.set_webhook(
+                url=f"{self.webhook_url}/{config.url_path or config.token}",
+                secret_token=self.secret_tokens[config.name],
+                drop_pending_updates=False
+            )
+            for config, bot in self.tenants
+        ))
+        self.timings['set_webhook_s'] = time.perf_counter() - begin
+        self.timings['time_to_ready_s'] = time.perf_counter() - self.started_at
+        logger.info(f"{len(self.tenants)} bots listos en {self.timings['time_to_ready_s']:.2f}s "
+                    f"(puerto {self.server.port})")
+
+    async def stop(self):
+        begin = time.perf_counter()
+        await self.server.stop()
+        for _, bot in self.tenants:
+            await bot.prepare_shutdown()
+
+        results = await asyncio.gather(*(drain(bot.application, self.drain_timeout) for _, bot in self.tenants))
+        self.drained = {config.name: drained for (config, _), drained in zip(self.tenants, results)}
+        self.timings['drain_s'] = time.perf_counter() - begin
+
+        # Un tenant que falle al apagarse no impide vaciar los buffers de los demás
+        for (config, _), error in zip(self.tenants, await asyncio.gather(
+                *(finish(bot.application) for _, bot in self.tenants), return_exceptions=True)):
+            if isinstance(error, Exception):
+                logger.error(f"Error al detener el tenant {config.name}: {error}")
+        logger.info(f"Parada completa en {time.perf_counter() - begin:.2f}s (drenado: {self.drained})")
+
+    async def run(self):
+        """Atiende los webhooks hasta recibir SIGTERM o SIGINT"""
+        try:
+            with shutdown_requested() as stop_requested:
+                await self.start()
+                await stop_requested.wait()
+                logger.info("Señal de parada recibida")
+        finally:
+            await self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Varios bots ETS en un proceso")
+    parser.add_argument("config", help="JSON con la lista de tenants")
+    parser.add_argument("--listen", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--webhook-url", default=ets_bot.WEBHOOK_URL, help="URL pública base (WEBHOOK_URL)")
+    args = parser.parse_args(argv)
+
+    log_listener = logging_setup.configure_logging(
+        ets_bot.LOG_LEVEL, ets_bot.LOG_FORMAT, logging_setup.parse_sampling(ets_bot.LOG_SAMPLING)
+    )
+    try:
+        if not args.webhook_url:
+            logger.error("Falta WEBHOOK_URL")
+            return 1
+        configs = load_tenants(args.config)
+        bots = build_tenants(configs)
+        logger.info(f"Tenants: {', '.join(config.name for config in configs)}")
+        asyncio.run(TenantLifecycle(configs, bots, args.webhook_url, args.listen, args.port).run())
+        return 0
+    finally:
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
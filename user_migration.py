@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exportación e importación en streaming de perfiles y sesiones
+Formato: una subcarpeta por exportación (`gen-00001/`) con fragmentos
+`users-00000.ndjson.gz` (un registro JSON por línea) y `checkpoint.json`.
+Solo se reanuda una exportación interrumpida; la siguiente a una completa
+crea una generación nueva y, al terminar, borra las anteriores.
+"""
+
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+GENERATION_PATTERN = "gen-{:05d}"
+CHUNK_PATTERN = "users-{:05d}.ndjson.gz"
+CHECKPOINT_FILE = "checkpoint.json"
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def _encode_default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _decode_hook(obj: Dict):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_encode_default)
+_decoder = json.JSONDecoder(object_hook=_decode_hook)
+
+
+def _read_checkpoint(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {"chunks": 0, "records": 0}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_checkpoint(path: str, checkpoint: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def generation_dir(root: str, generation: int) -> str:
+    return os.path.join(root, GENERATION_PATTERN.format(generation))
+
+
+def _generations(root: str) -> List[int]:
+    numbers = []
+    for path in glob.glob(os.path.join(root, "gen-*")):
+        suffix = os.path.basename(path)[4:]
+        if suffix.isdigit() and os.path.isdir(path):
+            numbers.append(int(suffix))
+    return sorted(numbers)
+
+
+def latest_export(src_dir: str) -> Optional[Tuple[int, str]]:
+    """(generación, directorio) de la última exportación completa
+
+    Los fragmentos sueltos del formato anterior, sin generaciones, cuentan
+    como la generación 0.
+    """
+    for generation in reversed(_generations(src_dir)):
+        path = generation_dir(src_dir, generation)
+        if _read_checkpoint(os.path.join(path, CHECKPOINT_FILE)).get("complete"):
+            return generation, path
+    if next(iter_chunk_paths(src_dir), None) is not None:
+        return 0, src_dir
+    return None
+
+
+def _remove_other_generations(root: str, keep: int):
+    for generation in _generations(root):
+        if generation != keep:
+            shutil.rmtree(generation_dir(root, generation), ignore_errors=True)
+    for path in list(iter_chunk_paths(root)) + [os.path.join(root, CHECKPOINT_FILE)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def export_records(records: Iterable[Dict], dest_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   compresslevel: int = 6) -> Dict:
+    """Escribe los registros en fragmentos comprimidos de una generación nueva
+
+    Si la última generación quedó a medias, la reanuda desde su checkpoint:
+    el iterable debe producir los registros en orden estable entre ejecuciones
+    para que los ya exportados puedan saltarse.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    generations = _generations(dest_dir)
+    generation = generations[-1] if generations else 0
+    checkpoint_path = os.path.join(generation_dir(dest_dir, generation), CHECKPOINT_FILE)
+    checkpoint = _read_checkpoint(checkpoint_path)
+    if not generations or checkpoint.get("complete"):
+        generation += 1
+        checkpoint_path = os.path.join(generation_dir(dest_dir, generation), CHECKPOINT_FILE)
+        checkpoint = {"generation": generation, "chunks": 0, "records": 0, "complete": False}
+    chunk_dir = generation_dir(dest_dir, generation)
+    os.makedirs(chunk_dir, exist_ok=True)
+    iterator = itertools.islice(iter(records), checkpoint["records"], None)
+
+    while True:
+        chunk_path = os.path.join(chunk_dir, CHUNK_PATTERN.format(checkpoint["chunks"]))
+        tmp_path = chunk_path + ".tmp"
+        written = 0
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=compresslevel) as f:
+            for record in itertools.islice(iterator, chunk_size):
+                f.write(_encoder.encode(record))
+                f.write('\n')
+                written += 1
+        if not written:
+            os.remove(tmp_path)
+            break
+        os.replace(tmp_path, chunk_path)
+        checkpoint["chunks"] += 1
+        checkpoint["records"] += written
+        _write_checkpoint(checkpoint_path, checkpoint)
+        if written < chunk_size:
+            break
+
+    checkpoint["generation"] = generation
+    checkpoint["complete"] = True
+    _write_checkpoint(checkpoint_path, checkpoint)
+    # Solo cuando la nueva está completa: hasta entonces se importa la anterior
+    _remove_other_generations(dest_dir, generation)
+    return checkpoint
+
+
+def iter_chunk_paths(src_dir: str) -> Iterator[str]:
+    yield from sorted(glob.glob(os.path.join(src_dir, "users-*.ndjson.gz")))
+
+
+def iter_records(chunk_path: str) -> Iterator[Dict]:
+    with gzip.open(chunk_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield _decoder.decode(line)
+
+
+def import_records(src_dir: str, sink: Callable[[Dict], None],
+                   checkpoint_path: Optional[str] = None, resume: bool = True) -> Dict:
+    """Entrega cada registro de la última exportación completa a `sink`, con checkpoint por fragmento
+
+    El checkpoint guarda la generación que consumió, así que una exportación
+    nueva se importa desde el principio. Con `resume=False` no se lee ni se
+    escribe checkpoint, para destinos que no sobreviven al proceso.
+    """
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(src_dir, "import_" + CHECKPOINT_FILE)
+    latest = latest_export(src_dir)
+    if latest is None:
+        return {"generation": None, "chunks": 0, "records": 0}
+    generation, chunk_dir = latest
+    checkpoint = _read_checkpoint(checkpoint_path) if resume else {}
+    if checkpoint.get("generation") != generation:
+        checkpoint = {"generation": generation, "chunks": 0, "records": 0}
+
+    for index, chunk_path in enumerate(iter_chunk_paths(chunk_dir)):
+        if index < checkpoint["chunks"]:
+            continue
+        count = 0
+        for record in iter_records(chunk_path):
+            sink(record)
+            count += 1
+        checkpoint["chunks"] += 1
+        checkpoint["records"] += count
+        if resume:
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+    return checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspección de exportaciones de usuarios")
+    parser.add_argument("command", choices=["inspect"])
+    parser.add_argument("path", help="Directorio de exportación")
+    args = parser.parse_args(argv)
+
+    latest = latest_export(args.path)
+    if latest is None:
+        print("No hay exportaciones completas")
+        return 1
+    generation, path = latest
+    total = 0
+    for chunk_path in iter_chunk_paths(path):
+        count = sum(1 for _ in iter_records(chunk_path))
+        total += count
+        print(f"{os.path.basename(chunk_path)}: {count} registros")
+    print(f"Generación {generation}, total: {total} registros")
+    print(f"Checkpoint: {_read_checkpoint(os.path.join(path, CHECKPOINT_FILE))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())